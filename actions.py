@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+
+class ActionGraph:
+    """
+    A composite Discord action made of steps with declared dependencies. Independent steps run concurrently,
+    and a step starts as soon as everything it depends on has finished. The graph as a whole is a single
+    coroutine function (run), so it is reported to ensure_display as one unit.
+    """
+    def __init__(self):
+        self._actions = []
+        self._names = set()
+        self.results = {}
+
+    def __len__(self):
+        return len(self._actions)
+
+    def add(self, name, func, after=[]):
+        """
+        Adds a step calling the coroutine function `func`, once all steps named in `after` are done.
+        Dependencies must be added first, which also rules out cycles. Returns the graph, for chaining.
+        """
+        if name in self._names:
+            raise ValueError("Duplicate action name {}".format(name))
+        for dep in after:
+            if dep not in self._names:
+                raise ValueError("Action {} depends on unknown action {}".format(name, dep))
+        self._actions.append((name, func, list(after)))
+        self._names.add(name)
+        return self
+
+    async def _run_action(self, tasks, name, func, after):
+        for dep in after:
+            # Raises if the dependency failed, which skips this step too
+            await tasks[dep]
+        self.results[name] = await func()
+
+    async def run(self):
+        """
+        Runs all steps and returns their results by name. If any step fails, its dependents are skipped,
+        the others still complete, and the first error is raised at the end.
+        """
+        self.results = {}
+        tasks = {}
+        for name, func, after in self._actions:
+            tasks[name] = asyncio.ensure_future(self._run_action(tasks, name, func, after))
+
+        outcomes = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        errors = [(name, e) for name, e in zip(tasks.keys(), outcomes) if isinstance(e, BaseException)]
+        if len(errors) > 0:
+            logging.error("Action graph failed: {}".format(", ".join(["{} ({})".format(name, e) for name, e in errors])))
+            raise errors[0][1]
+        return self.results
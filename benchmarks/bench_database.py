@@ -0,0 +1,75 @@
+"""
+Micro-benchmark of the warnings DB access: one connection per query (the old nonquery/pedigree path)
+against the long-lived Database connection on its worker thread.
+
+    python benchmarks/bench_database.py [num_warnings]
+"""
+import asyncio
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from database import Database
+
+CREATE_EVENTS = "CREATE TABLE Events (Event_type INTEGER, Player_id INTEGER, Reason TEXT, Datetime TEXT, Warner TEXT)"
+
+
+def bench_connect_per_query(path, warnings):
+    start = time.perf_counter()
+    for w in warnings:
+        conn = sqlite3.connect(path)
+        conn.execute("INSERT INTO Events (Event_type,Player_id,Reason,Datetime,Warner) VALUES (666,{},\"{}\",\"{}\",\"{}\")".format(w[0], w[1], str(w[2]), w[3]))
+        conn.commit()
+        conn.close()
+    insert_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for w in warnings:
+        conn = sqlite3.connect(path)
+        conn.execute("SELECT player_id,Reason,Datetime,Warner FROM Events WHERE Event_type = 666 AND Player_id = " + str(w[0])).fetchall()
+        conn.close()
+    select_time = time.perf_counter() - start
+    return insert_time, select_time
+
+
+async def bench_database(path, warnings):
+    db = Database(path)
+    start = time.perf_counter()
+    await db.add_warnings(warnings)
+    insert_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for w in warnings:
+        await db.get_warnings(w[0])
+    select_time = time.perf_counter() - start
+    await db.close()
+    return insert_time, select_time
+
+
+def main():
+    num_warnings = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    warnings = [(100000000000000000 + i % 50, "reason {}".format(i), datetime.datetime(2024, 1, 1), "shaman") for i in range(num_warnings)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old_path = os.path.join(tmp, "old.db")
+        new_path = os.path.join(tmp, "new.db")
+        for path in [old_path, new_path]:
+            conn = sqlite3.connect(path)
+            conn.execute(CREATE_EVENTS)
+            conn.close()
+
+        old = bench_connect_per_query(old_path, warnings)
+        new = asyncio.run(bench_database(new_path, warnings))
+
+    print("{} warnings".format(num_warnings))
+    print("connect per query: insert {:8.1f} us/row, select {:8.1f} us/query".format(old[0] / num_warnings * 1e6, old[1] / num_warnings * 1e6))
+    print("Database:          insert {:8.1f} us/row, select {:8.1f} us/query".format(new[0] / num_warnings * 1e6, new[1] / num_warnings * 1e6))
+
+
+if __name__ == "__main__":
+    main()
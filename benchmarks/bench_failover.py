@@ -0,0 +1,116 @@
+"""
+Runs the failover protocol simulator (simulation.py) over a table of scenarios, and prints failover time,
+duplicate and missed displays, and COM volume for each. Results are deterministic for a given seed.
+
+    python benchmarks/bench_failover.py [--seeds 5] [--duration 600] [name ...]
+
+The sweeps show how ENSURE_DISPLAY_WINDOW and HEARTBEAT_INTERVAL trade duplicates and failover time against
+COM traffic, so changes to them can be judged before deploying.
+
+With the default --seeds and --duration, each scenario's duplicates, missed displays and masters are checked
+against its limits, and the script exits with an error if any regressed.
+"""
+import argparse
+import logging
+import os
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from simulation import SimConfig, run_scenario
+
+CRASH_MASTER = [(200, None)]
+CRASH_AND_RESTART = [(200, None), (400, None)]
+
+DEFAULT_SEEDS = 5
+DEFAULT_DURATION = 600
+# Totals over the default seeds and duration, for scenarios that don't set their own
+DEFAULT_LIMITS = {"duplicates": 0, "missed": 0, "max_masters": 1}
+# A window as long as the action interval hides the action in flight when the master dies
+LOSSY_WINDOW_LIMITS = {1: {}, 2: {}, 5: {"missed": 5}}
+
+# name, SimConfig kwargs, run_scenario kwargs, limits (overriding DEFAULT_LIMITS)
+SCENARIOS = [
+    ("steady", {}, {}, {}),
+    ("steady_lossy", {"com_loss": 0.1}, {}, {}),
+    ("crash_master", {}, {"crashes": CRASH_MASTER}, {}),
+    # Keyed actions whose ENSURE_DISPLAY was lost stay journaled, and the new master displays them again
+    ("crash_master_lossy", {"com_loss": 0.1}, {"crashes": CRASH_MASTER}, {"duplicates": 20}),
+    ("crash_master_slow_com", {"com_latency": (0.5, 2.0)}, {"crashes": CRASH_MASTER}, {}),
+    ("crash_twice_restart", {}, {"crashes": CRASH_AND_RESTART, "restarts": [(260, 1), (460, 3)]}, {}),
+    ("unkeyed_crash_master", {}, {"crashes": CRASH_MASTER, "keyed_fraction": 0.0}, {}),
+    ("two_instances_crash", {}, {"crashes": CRASH_MASTER, "num_instances": 2}, {}),
+]
+for window in [1, 2, 5]:
+    SCENARIOS.append(("window_{}s_lossy".format(window), {"ensure_display_window": window, "com_loss": 0.1}, {
+        "crashes": CRASH_MASTER, "keyed_fraction": 0.0,
+    }, LOSSY_WINDOW_LIMITS[window]))
+for interval in [5, 10, 20]:
+    SCENARIOS.append(("heartbeat_{}s".format(interval), {"heartbeat_interval": interval}, {"crashes": CRASH_MASTER}, {}))
+
+
+def run(name, config_kwargs, scenario_kwargs, seeds, duration):
+    """
+    Aggregates a scenario over several seeds: totals for counts, worst case for failover time and masters.
+    """
+    total = {"duplicates": 0, "missed": 0, "failovers": 0, "failed_failovers": 0, "com_messages_per_minute": 0.0}
+    max_failover = None
+    max_masters = 0
+    for seed in range(seeds):
+        config = SimConfig(seed=seed, **config_kwargs)
+        summary = run_scenario(config, duration=duration, **scenario_kwargs).summary()
+        for k in total:
+            total[k] += summary[k]
+        if summary["max_failover_seconds"] is not None:
+            max_failover = max(max_failover or 0.0, summary["max_failover_seconds"])
+        max_masters = max(max_masters, summary["max_masters"])
+    total["com_messages_per_minute"] /= seeds
+    total["max_failover_seconds"] = max_failover
+    total["max_masters"] = max_masters
+    return total
+
+
+def regressions(result, limits):
+    """
+    Returns a description of each count over its limit, empty if none are.
+    """
+    limits = dict(DEFAULT_LIMITS, **limits)
+    return ["{} {} > {}".format(k, result[k], limit) for k, limit in limits.items() if result[k] > limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Failover protocol simulation")
+    parser.add_argument("names", nargs="*", help="scenarios to run, all by default")
+    parser.add_argument("--seeds", type=int, default=DEFAULT_SEEDS, help="runs per scenario, with seeds 0 to N-1")
+    parser.add_argument("--duration", type=int, default=DEFAULT_DURATION, help="simulated seconds of activity per run")
+    args = parser.parse_args()
+    # The journal warns about stale entries, which is expected here
+    logging.basicConfig(level=logging.ERROR)
+    check_limits = args.seeds == DEFAULT_SEEDS and args.duration == DEFAULT_DURATION
+
+    print("{:<24} {:>10} {:>8} {:>10} {:>8} {:>12} {:>10}".format(
+        "scenario", "failovers", "failed", "max fo s", "masters", "dup/missed", "com/min"
+    ))
+    failed = []
+    for name, config_kwargs, scenario_kwargs, limits in SCENARIOS:
+        if len(args.names) > 0 and name not in args.names:
+            continue
+        result = run(name, config_kwargs, scenario_kwargs, args.seeds, args.duration)
+        if check_limits:
+            failed += ["{}: {}".format(name, regression) for regression in regressions(result, limits)]
+        print("{:<24} {:>10} {:>8} {:>10} {:>8} {:>12} {:>10.1f}".format(
+            name, result["failovers"], result["failed_failovers"],
+            "-" if result["max_failover_seconds"] is None else "{:.1f}".format(result["max_failover_seconds"]),
+            result["max_masters"], "{}/{}".format(result["duplicates"], result["missed"]), result["com_messages_per_minute"]
+        ))
+
+    if len(failed) > 0:
+        print("\nRegressions:")
+        for line in failed:
+            print("  " + line)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
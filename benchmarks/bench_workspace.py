@@ -0,0 +1,72 @@
+"""
+Round-trip benchmark of the workspace codec against the old pickle path.
+
+    python benchmarks/bench_workspace.py [num_lobbies]
+"""
+import os
+import pickle
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from lobbies import Lobby
+from workspace import encode_workspace, decode_workspace
+
+
+def make_lobbies(n):
+    return [
+        Lobby({
+            "id": 1000 + i,
+            "name": "IB lobby {}".format(i),
+            "map": "Impossible.Bosses.v1.12.2.w3x",
+            "host": "host{}".format(i),
+            "server": "eu",
+            "slotsTaken": i % 8,
+            "slotsTotal": 9,
+        }, is_ent=False)
+        for i in range(n)
+    ]
+
+
+def make_workspace(lobbies, lobbies_as_dicts):
+    return {
+        "open_lobbies": [lobby.to_workspace_dict() for lobby in lobbies] if lobbies_as_dicts else lobbies,
+        "lobby_message_ids": {lobby.get_message_id_key(): 900000000000000000 + lobby.id for lobby in lobbies},
+        "gathers": [{
+            "channel_id": 777162167446274051,
+            "active": True,
+            "message_id": 777162167446274052,
+            "list_content": "someone asks : <:ib:1><:ib2:2>",
+            "okib_member_ids": list(range(100000000000000000, 100000000000000008)),
+            "laterib_member_ids": [],
+            "noib_member_ids": [200000000000000000],
+            "gatherer_id": 100000000000000000,
+            "gathered": False,
+            "gather_time": 1700000000.0,
+        }],
+    }
+
+
+def main():
+    num_lobbies = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    number = 2000
+    lobbies = make_lobbies(num_lobbies)
+
+    pickle_ws = make_workspace(lobbies, lobbies_as_dicts=False)
+    codec_ws = make_workspace(lobbies, lobbies_as_dicts=True)
+    pickle_size = len(pickle.dumps(pickle_ws))
+    codec_size = len(encode_workspace(codec_ws))
+
+    assert decode_workspace(encode_workspace(codec_ws))["open_lobbies"] == codec_ws["open_lobbies"]
+
+    pickle_time = timeit.timeit(lambda: pickle.loads(pickle.dumps(pickle_ws)), number=number)
+    codec_time = timeit.timeit(lambda: decode_workspace(encode_workspace(codec_ws)), number=number)
+
+    print("{} lobbies, {} round trips".format(num_lobbies, number))
+    print("pickle: {:8.1f} us/round trip, {} bytes".format(pickle_time / number * 1e6, pickle_size))
+    print("codec:  {:8.1f} us/round trip, {} bytes".format(codec_time / number * 1e6, codec_size))
+
+
+if __name__ == "__main__":
+    main()
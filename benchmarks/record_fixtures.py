@@ -0,0 +1,33 @@
+"""
+Records the API payloads used by the offline benchmark suite into benchmarks/fixtures.
+
+    python benchmarks/record_fixtures.py [replay_id]
+"""
+import json
+import os
+import sys
+
+import requests
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "fixtures")
+
+SOURCES = {
+    "wc3stats_gamelist.json": "https://api.wc3stats.com/gamelist",
+    "ent_allgames.json": "https://host.entgaming.net/allgames",
+    "wc3stats_replay.json": "https://api.wc3stats.com/replays/{}",
+}
+
+
+def main():
+    replay_id = int(sys.argv[1]) if len(sys.argv) > 1 else 105240
+    for file_name, url in SOURCES.items():
+        url = url.format(replay_id)
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        with open(os.path.join(FIXTURES_DIR, file_name), "w") as f:
+            json.dump(response.json(), f, indent=1)
+        print("Recorded {} ({} bytes) from {}".format(file_name, len(response.content), url))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Offline benchmark suite over recorded API payloads (benchmarks/fixtures, refreshed by record_fixtures.py).
+Discord is replaced by a fake channel, so nothing here touches the network.
+
+    python benchmarks/suite.py [--save-baseline] [--threshold 0.25] [--iterations-scale 1.0] [name ...]
+
+Each benchmark reports throughput and latency percentiles, and is compared to benchmarks/baseline.json.
+Benchmarks whose median latency regressed by more than the threshold are flagged, and the exit status is 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, "fixtures")
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "baseline.json")
+
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from lobbies import Lobby, get_lobby_changes, plan_lobby_updates
+from messages import MessageHub, MessageType, format_ensure_display_message, format_ensure_display_value
+from replays import ReplayData
+from workspace import encode_workspace, decode_workspace
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
+
+
+def next_tick(lobby_dicts, slots_taken_key, slots_total_key, id_offset):
+    """
+    Derives the next poll's payload from a recorded one: some lobbies close, some fill up, and a few new ones open.
+    """
+    tick = []
+    for i, obj in enumerate(lobby_dicts):
+        if i % 5 == 0:
+            continue
+        obj = dict(obj)
+        if i % 3 == 0:
+            obj[slots_taken_key] = min(obj[slots_taken_key] + 1, obj[slots_total_key] - 1)
+        tick.append(obj)
+    for i in range(3):
+        obj = dict(lobby_dicts[i])
+        obj["id"] += id_offset
+        tick.append(obj)
+    return tick
+
+
+class FakeMessage:
+    def __init__(self, message_id):
+        self.id = message_id
+
+    async def edit(self, content=None, embed=None):
+        await asyncio.sleep(0)
+
+    async def add_reaction(self, emoji):
+        await asyncio.sleep(0)
+
+
+class FakeChannel:
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, content=None, embed=None):
+        await asyncio.sleep(0)
+        self.sent += 1
+        return FakeMessage(self.sent)
+
+    async def fetch_message(self, message_id):
+        await asyncio.sleep(0)
+        return FakeMessage(message_id)
+
+
+class FakeRole:
+    mention = "<@&1228087653929455646>"
+
+
+class Fixtures:
+    def __init__(self):
+        self.gamelist_raw = load_fixture("wc3stats_gamelist.json")
+        self.allgames_raw = load_fixture("ent_allgames.json")
+        self.replay_raw = load_fixture("wc3stats_replay.json")
+
+        gamelist = json.loads(self.gamelist_raw)["body"]
+        allgames = json.loads(self.allgames_raw)
+        self.bnet_tick0 = [Lobby(obj, is_ent=False) for obj in gamelist]
+        self.bnet_tick1 = [Lobby(obj, is_ent=False) for obj in next_tick(gamelist, "slotsTaken", "slotsTotal", 10000000)]
+        self.ent_tick0 = [Lobby(obj, is_ent=True) for obj in allgames]
+        self.ent_tick1 = [Lobby(obj, is_ent=True) for obj in next_tick(allgames, "slots_taken", "slots_total", 10000000)]
+
+        # COM traffic from the last few minutes, heartbeats and lobby message IDs
+        self.message_hub = MessageHub()
+        for i in range(200):
+            self.message_hub.on_message(MessageType.HEARTBEAT, "12")
+            self.message_hub.on_message(MessageType.ENSURE_DISPLAY, format_ensure_display_message(
+                1, "{:016x}".format(i), format_ensure_display_value("lobbymsg{}".format(i), 900000 + i)
+            ))
+
+
+def bench_parse_wc3stats(f):
+    lobbies = [Lobby(obj, is_ent=False) for obj in json.loads(f.gamelist_raw)["body"]]
+    return [lobby for lobby in lobbies if lobby.is_ib()]
+
+
+def bench_parse_ent(f):
+    lobbies = [Lobby(obj, is_ent=True) for obj in json.loads(f.allgames_raw)]
+    return [lobby for lobby in lobbies if lobby.is_ib()]
+
+
+def bench_lobby_changes(f):
+    get_lobby_changes(f.bnet_tick0, f.bnet_tick1)
+    get_lobby_changes(f.ent_tick0, f.ent_tick1)
+
+
+async def bench_report_lobbies(f):
+    channel = FakeChannel()
+    roles = [FakeRole()]
+
+    async def create_message(lobby):
+        info = lobby.to_discord_message_info(roles, True)
+        if info is not None:
+            await channel.send(content=info["message"], embed=info["embed"])
+
+    async def update_message(lobby, is_open=True):
+        message = await channel.fetch_message(lobby.id)
+        info = lobby.to_discord_message_info(roles, is_open)
+        if info is not None:
+            await message.edit(content=info["message"], embed=info["embed"])
+
+    for prev, api in [(f.bnet_tick0, f.bnet_tick1), (f.ent_tick0, f.ent_tick1)]:
+        lobbies, graph = plan_lobby_updates(prev, api, create_message, update_message)
+        await graph.run()
+
+
+def bench_parse_replay(f):
+    return ReplayData(json.loads(f.replay_raw))
+
+
+def bench_message_hub(f):
+    # Messages accumulate like they would over the hub's retention window
+    f.message_hub.on_message(MessageType.ENSURE_DISPLAY, format_ensure_display_message(1, "0123456789abcdef"))
+    f.message_hub.got_message(MessageType.ENSURE_DISPLAY, 10)
+    f.message_hub.got_message(MessageType.ENSURE_DISPLAY, 10, "lobbymsg-1")
+
+
+def bench_workspace(f):
+    workspace = {
+        "open_lobbies": [lobby.to_workspace_dict() for lobby in f.bnet_tick0 + f.ent_tick0],
+        "lobby_message_ids": {lobby.get_message_id_key(): 900000000000000000 + lobby.id for lobby in f.bnet_tick0},
+        "gathers": [],
+    }
+    decode_workspace(encode_workspace(workspace))
+
+
+# name, function, iterations
+BENCHMARKS = [
+    ("parse_wc3stats_gamelist", bench_parse_wc3stats, 2000),
+    ("parse_ent_allgames", bench_parse_ent, 2000),
+    ("get_lobby_changes", bench_lobby_changes, 5000),
+    ("report_lobbies", bench_report_lobbies, 500),
+    ("parse_replay", bench_parse_replay, 2000),
+    ("message_hub", bench_message_hub, 2000),
+    ("workspace_round_trip", bench_workspace, 1000),
+]
+
+
+def percentile(sorted_samples, q):
+    index = min(int(q * len(sorted_samples)), len(sorted_samples) - 1)
+    return sorted_samples[index]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "ops_per_sec": len(samples) / sum(samples),
+        "p50": percentile(samples, 0.50),
+        "p95": percentile(samples, 0.95),
+        "p99": percentile(samples, 0.99),
+        "max": samples[-1],
+    }
+
+
+async def measure(func, fixtures, iterations):
+    is_async = asyncio.iscoroutinefunction(func)
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        if is_async:
+            await func(fixtures)
+        else:
+            func(fixtures)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def run_benchmarks(names, iterations_scale):
+    fixtures = Fixtures()
+    results = {}
+    for name, func, iterations in BENCHMARKS:
+        if len(names) > 0 and name not in names:
+            continue
+        iterations = max(int(iterations * iterations_scale), 1)
+        # Warm-up, so caches and lazy imports don't count
+        await measure(func, fixtures, max(iterations // 10, 1))
+        results[name] = summarize(await measure(func, fixtures, iterations))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns a status per benchmark: regressed, improved, ok or new (not in the baseline).
+    """
+    statuses = {}
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            statuses[name] = "new"
+        elif result["p50"] > base["p50"] * (1 + threshold):
+            statuses[name] = "REGRESSED"
+        elif result["p50"] < base["p50"] * (1 - threshold):
+            statuses[name] = "improved"
+        else:
+            statuses[name] = "ok"
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite")
+    parser.add_argument("names", nargs="*", help="benchmarks to run, all by default")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative p50 change that counts as a regression")
+    parser.add_argument("--iterations-scale", type=float, default=1.0, help="multiplier on each benchmark's iterations")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmarks(args.names, args.iterations_scale))
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, "r") as f:
+            baseline = json.load(f)
+    statuses = compare(results, baseline, args.threshold)
+
+    print("{:<26} {:>12} {:>10} {:>10} {:>10} {:>10} {:>10}  {}".format(
+        "benchmark", "ops/s", "p50 us", "p95 us", "p99 us", "max us", "base p50", "status"
+    ))
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        print("{:<26} {:>12.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10} {}".format(
+            name, result["ops_per_sec"], result["p50"] * 1e6, result["p95"] * 1e6, result["p99"] * 1e6,
+            result["max"] * 1e6, "-" if base is None else "{:.1f}".format(base["p50"] * 1e6), statuses[name]
+        ))
+
+    if args.save_baseline:
+        baseline_results = baseline.get("results", {})
+        baseline_results.update(results)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({
+                "machine": "{} {} / Python {}".format(platform.system(), platform.machine(), platform.python_version()),
+                "results": baseline_results,
+            }, f, indent=1, sort_keys=True)
+        print("Saved baseline to {}".format(BASELINE_PATH))
+
+    regressed = [name for name, status in statuses.items() if status == "REGRESSED"]
+    if len(regressed) > 0:
+        print("Regressions over {:.0%}: {}".format(args.threshold, ", ".join(regressed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
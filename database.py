@@ -0,0 +1,312 @@
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import zlib
+
+EVENTS_COLUMNS = ["Event_type", "Player_id", "Reason", "Datetime", "Warner"]
+
+EVENT_TYPE_WARNING = 666
+
+# First byte of a DB sync payload, the rest is zlib-compressed
+SYNC_DELTA = b"D"
+SYNC_SNAPSHOT = b"S"
+
+
+def _migrate_create_events(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Events (
+            Id INTEGER PRIMARY KEY AUTOINCREMENT,
+            Event_type INTEGER NOT NULL,
+            Player_id INTEGER NOT NULL,
+            Reason TEXT,
+            Datetime INTEGER NOT NULL,
+            Warner TEXT
+        )
+    """)
+
+
+def _migrate_integer_datetimes(conn):
+    # Hand-made DBs store str(datetime.now()) in local time. Rebuild the table so Datetime holds unix seconds,
+    # which sort correctly, and rows get an AUTOINCREMENT Id so the DB sync journal IDs are never reused.
+    conn.execute("""
+        CREATE TABLE Events_new (
+            Id INTEGER PRIMARY KEY AUTOINCREMENT,
+            Event_type INTEGER NOT NULL,
+            Player_id INTEGER NOT NULL,
+            Reason TEXT,
+            Datetime INTEGER NOT NULL,
+            Warner TEXT
+        )
+    """)
+    conn.execute("""
+        INSERT INTO Events_new (Id, Event_type, Player_id, Reason, Datetime, Warner)
+        SELECT rowid, Event_type, Player_id, Reason,
+            CASE
+                WHEN typeof(Datetime) IN ('integer', 'real') THEN CAST(Datetime AS INTEGER)
+                ELSE COALESCE(CAST(strftime('%s', Datetime, 'utc') AS INTEGER), 0)
+            END,
+            Warner
+        FROM Events ORDER BY rowid
+    """)
+    conn.execute("DROP TABLE Events")
+    conn.execute("ALTER TABLE Events_new RENAME TO Events")
+
+
+def _migrate_events_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS Events_type_player_datetime ON Events (Event_type, Player_id, Datetime)")
+
+
+# Schema version N is reached by applying MIGRATIONS[N-1]. Only ever append to this list.
+MIGRATIONS = [
+    _migrate_create_events,
+    _migrate_integer_datetimes,
+    _migrate_events_index,
+]
+
+
+def migrate(conn):
+    """
+    Brings the DB schema up to date, tracking the applied version in PRAGMA user_version.
+    Returns the number of migrations applied.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > len(MIGRATIONS):
+        raise Exception("DB schema version {} is newer than this code ({})".format(version, len(MIGRATIONS)))
+
+    for i in range(version, len(MIGRATIONS)):
+        logging.info("Applying DB migration {}: {}".format(i + 1, MIGRATIONS[i].__name__))
+        # Explicit BEGIN, since sqlite3 doesn't open transactions for DDL on its own
+        conn.execute("BEGIN")
+        try:
+            MIGRATIONS[i](conn)
+            # PRAGMA doesn't take parameters
+            conn.execute("PRAGMA user_version = {}".format(i + 1))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return len(MIGRATIONS) - version
+
+
+def format_event_datetime(value):
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+    return str(value)
+
+
+class Database:
+    """
+    Async access to the warnings DB. Keeps one long-lived WAL-mode connection that is only ever used from a
+    dedicated worker thread, so disk I/O never blocks the event loop. Statements are constant and parameterized,
+    which also lets sqlite3 reuse its prepared statement cache.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("PRAGMA synchronous = NORMAL")
+            migrate(self._conn)
+        return self._conn
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def run(self, func, *args):
+        """
+        Runs a blocking function on the DB thread.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def open(self):
+        """
+        Connects and applies pending schema migrations. Other methods connect lazily, but the DB sync
+        helpers use their own connections and expect an up-to-date schema.
+        """
+        await self.run(self._connection)
+
+    async def close(self):
+        await self.run(self._close)
+
+    def _add_warnings(self, warnings):
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO Events (Event_type, Player_id, Reason, Datetime, Warner) VALUES (?, ?, ?, ?, ?)",
+                [(EVENT_TYPE_WARNING, player_id, reason, int(dt.timestamp()), warner) for player_id, reason, dt, warner in warnings]
+            )
+
+    async def add_warnings(self, warnings):
+        """
+        Inserts (player_id, reason, datetime, warner) tuples in a single transaction. datetime is a datetime.datetime.
+        """
+        await self.run(self._add_warnings, warnings)
+
+    def _get_warnings(self, player_id):
+        cursor = self._connection().execute(
+            "SELECT Player_id, Reason, Datetime, Warner FROM Events WHERE Event_type = ? AND Player_id = ? ORDER BY Datetime",
+            (EVENT_TYPE_WARNING, player_id)
+        )
+        return cursor.fetchall()
+
+    async def get_warnings(self, player_id):
+        """
+        Returns the (player_id, reason, datetime, warner) rows of all warnings for the given player, oldest first.
+        datetime is in unix seconds, see format_event_datetime.
+        """
+        return await self.run(self._get_warnings, player_id)
+
+    def _apply_sync_payload(self, archive_path, payload):
+        # The snapshot restore writes through its own connection, drop ours so we don't read stale pages
+        self._close()
+        result = apply_sync_payload(self.path, archive_path, payload)
+        # A snapshot may come from an instance with an older schema
+        self._connection()
+        return result
+
+    async def get_high_water_mark(self):
+        return await self.run(get_high_water_mark, self.path)
+
+    async def make_sync_payload(self, high_water_mark):
+        return await self.run(make_sync_payload, self.path, high_water_mark)
+
+    async def apply_sync_payload(self, archive_path, payload):
+        return await self.run(self._apply_sync_payload, archive_path, payload)
+
+
+def _has_events_table(conn):
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Events'")
+    return cursor.fetchone() is not None
+
+
+def get_high_water_mark(db_path):
+    """
+    Returns the highest Events row ID in the given DB, 0 if there are no events yet,
+    or -1 if there is no usable DB at all (which forces a full snapshot on sync).
+    """
+    if not os.path.exists(db_path):
+        return -1
+    conn = sqlite3.connect(db_path)
+    try:
+        if not _has_events_table(conn):
+            return -1
+        row = conn.execute("SELECT MAX(rowid) FROM Events").fetchone()
+        return 0 if row[0] is None else row[0]
+    except sqlite3.DatabaseError as e:
+        logging.error("Failed to read high-water mark from {}: {}".format(db_path, e))
+        return -1
+    finally:
+        conn.close()
+
+
+def _without_wal_header(data):
+    # Header bytes 18 and 19 are the file format read/write versions, 2 for WAL mode. An in-memory DB can't
+    # have a WAL, so backing up a deserialized WAL-mode image fails with "unable to open database file".
+    # Setting them back to 1 (rollback journal) is how SQLite itself leaves WAL mode.
+    if len(data) < 20 or data[18:20] == b"\x01\x01":
+        return data
+    return data[:18] + b"\x01\x01" + data[20:]
+
+
+def _snapshot_bytes(conn):
+    # Online backup into memory, so we get a consistent copy even if the DB is being written to
+    snapshot = sqlite3.connect(":memory:")
+    try:
+        conn.backup(snapshot)
+        return _without_wal_header(snapshot.serialize())
+    finally:
+        snapshot.close()
+
+
+def make_sync_payload(db_path, high_water_mark):
+    """
+    Builds the payload that brings a DB with the given high-water mark up to date with ours:
+    only the newer Events rows if possible, a full snapshot otherwise.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        our_mark = -1
+        if _has_events_table(conn):
+            row = conn.execute("SELECT MAX(rowid) FROM Events").fetchone()
+            our_mark = 0 if row[0] is None else row[0]
+
+        if high_water_mark < 0 or our_mark < 0 or high_water_mark > our_mark:
+            logging.info("DB sync: snapshot (theirs {}, ours {})".format(high_water_mark, our_mark))
+            return SYNC_SNAPSHOT + zlib.compress(_snapshot_bytes(conn))
+
+        cursor = conn.execute(
+            "SELECT rowid, {} FROM Events WHERE rowid > ? ORDER BY rowid".format(", ".join(EVENTS_COLUMNS)),
+            (high_water_mark,)
+        )
+        rows = cursor.fetchall()
+        logging.info("DB sync: {} rows after {}".format(len(rows), high_water_mark))
+        return SYNC_DELTA + zlib.compress(json.dumps(rows, separators=(",", ":")).encode("utf-8"))
+    finally:
+        conn.close()
+
+
+def archive_db(db_path, archive_path):
+    if not os.path.exists(db_path):
+        return
+
+    archive_dir = os.path.dirname(archive_path)
+    if not os.path.exists(archive_dir):
+        os.mkdir(archive_dir)
+
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(archive_path)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def apply_sync_payload(db_path, archive_path, payload):
+    """
+    Applies a payload built by make_sync_payload to the local DB. Returns the number of new Events rows,
+    or None if a full snapshot was restored.
+    """
+    kind = payload[:1]
+    data = zlib.decompress(payload[1:])
+
+    if kind == SYNC_SNAPSHOT:
+        archive_db(db_path, archive_path)
+        snapshot = sqlite3.connect(":memory:")
+        conn = sqlite3.connect(db_path)
+        try:
+            # Snapshots from instances that didn't clear the WAL header yet
+            snapshot.deserialize(_without_wal_header(data))
+            snapshot.backup(conn)
+        finally:
+            conn.close()
+            snapshot.close()
+        logging.info("DB sync: restored snapshot ({} bytes)".format(len(data)))
+        return None
+    elif kind == SYNC_DELTA:
+        rows = json.loads(data)
+        conn = sqlite3.connect(db_path)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO Events (rowid, {}) VALUES (?, {})".format(
+                        ", ".join(EVENTS_COLUMNS), ", ".join(["?"] * len(EVENTS_COLUMNS))
+                    ),
+                    rows
+                )
+        finally:
+            conn.close()
+        logging.info("DB sync: applied {} rows".format(len(rows)))
+        return len(rows)
+    else:
+        raise ValueError("Unknown DB sync payload type {!r}".format(kind))
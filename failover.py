@@ -0,0 +1,366 @@
+import collections
+import datetime
+import enum
+import hashlib
+import logging
+
+from messages import MessageHub, MessageType, format_ensure_display_message, parse_ensure_display_message
+
+
+def elect_master(alive_instances):
+    """
+    Deterministic master election: every instance that sees the same set of live instances picks the same master.
+    Instances can disagree on that set, so the winner still has to claim a new term (see FailoverNode).
+    """
+    if len(alive_instances) == 0:
+        return None
+    return max(alive_instances)
+
+
+class Liveness:
+    """
+    Heartbeat-based leases for bot instances. Every COM message from an instance renews its lease, and each
+    instance broadcasts a heartbeat every `interval` seconds so that idle instances stay alive too.
+    An instance is considered dead once `missed_beats` heartbeats in a row fail to arrive.
+    """
+    def __init__(self, interval, missed_beats=3):
+        self.interval = interval
+        self.lease = datetime.timedelta(seconds=interval * missed_beats)
+        self._last_seen = {}
+
+    def beat(self, instance_id, now=None):
+        self._last_seen[instance_id] = datetime.datetime.now() if now is None else now
+
+    def forget(self, instance_id):
+        self._last_seen.pop(instance_id, None)
+
+    def is_alive(self, instance_id, now=None):
+        if instance_id not in self._last_seen:
+            return False
+        now = datetime.datetime.now() if now is None else now
+        return now - self._last_seen[instance_id] <= self.lease
+
+    def expired(self, instance_ids, now=None):
+        """
+        Returns the given instances whose lease has run out. Instances never heard from get a fresh lease
+        starting now instead, since we may simply not have waited long enough.
+        """
+        now = datetime.datetime.now() if now is None else now
+        result = []
+        for instance_id in instance_ids:
+            if instance_id not in self._last_seen:
+                self._last_seen[instance_id] = now
+            elif not self.is_alive(instance_id, now):
+                result.append(instance_id)
+        return result
+
+
+def action_key(*parts):
+    """
+    Deterministic idempotency key for a displayed action, built from IDs and primitives that every instance
+    computes identically (e.g. a command message ID, or a lobby ID and state fingerprint).
+    """
+    data = "/".join([str(part) for part in parts]).encode("utf-8")
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+class ActionLog:
+    """
+    Bounded set of the most recently displayed action keys, kept by every instance so that a new master
+    skips actions the old master already performed.
+    """
+    MAX_KEYS = 2048
+
+    def __init__(self, max_keys=MAX_KEYS):
+        self._keys = collections.OrderedDict()
+        self._max_keys = max_keys
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self._max_keys:
+            self._keys.popitem(last=False)
+
+
+class PendingAction:
+    def __init__(self, timestamp, func, window, return_name, key):
+        self.timestamp = timestamp
+        self.func = func
+        self.window = window
+        self.return_name = return_name
+        self.key = key
+
+
+class PendingActionJournal:
+    """
+    Follower-side log of displayed actions that the master hasn't confirmed with ENSURE_DISPLAY yet.
+    If the master dies, the instance that takes over drains the journal and performs those actions itself.
+    """
+    MAX_ENTRIES = 256
+    MAX_AGE_SECONDS = 5 * 60
+
+    def __init__(self):
+        self._entries = collections.deque(maxlen=PendingActionJournal.MAX_ENTRIES)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def append(self, func, window, return_name=None, key=None, now=None):
+        now = datetime.datetime.now() if now is None else now
+        if len(self._entries) == self._entries.maxlen:
+            logging.warning("Pending action journal full, dropping oldest entry")
+        self._entries.append(PendingAction(now, func, window, return_name, key))
+
+    def acknowledge(self, key=None, now=None):
+        """
+        The master displayed something. Keyed actions are confirmed by their own key only; actions without
+        a key fall back to considering everything recorded up to now as done.
+        """
+        now = datetime.datetime.now() if now is None else now
+        self._entries = collections.deque([
+            e for e in self._entries
+            if not (e.key is None and e.timestamp <= now) and (key is None or e.key != key)
+        ], maxlen=PendingActionJournal.MAX_ENTRIES)
+
+    def clear(self):
+        self._entries.clear()
+
+    def drain(self, now=None):
+        """
+        Removes and returns all pending actions, skipping those too old to still be worth displaying.
+        """
+        now = datetime.datetime.now() if now is None else now
+        cutoff = now - datetime.timedelta(seconds=PendingActionJournal.MAX_AGE_SECONDS)
+        entries = [e for e in self._entries if e.timestamp > cutoff]
+        if len(entries) != len(self._entries):
+            logging.warning("Dropping {} stale pending actions".format(len(self._entries) - len(entries)))
+        self._entries.clear()
+        return entries
+
+
+@enum.unique
+class Effect(enum.Enum):
+    """
+    Work FailoverNode leaves to its host, as tuples (Effect, *args) to carry out in order.
+    """
+    COM = "com"                                     # (to_id, message_type, message)
+    CONNECT_TIMER = "connecttimer"                  # (): call on_connect_timeout after the connect timeout
+    CANCEL_CONNECT_TIMER = "cancelconnecttimer"     # ()
+    SEND_WORKSPACE = "sendworkspace"                # (to_id)
+    REQUEST_DB = "requestdb"                        # (master_id): send REQUEST_DB with our DB high-water mark
+    SET_RETURN_VALUE = "setreturnvalue"             # (name, value)
+    PERFORM = "perform"                             # (PendingAction): display it, the old master never confirmed it
+    UPDATE_SOURCE = "updatesource"                  # (): another instance runs a newer version
+
+
+def parse_term(message):
+    try:
+        return int(message)
+    except ValueError:
+        return 0
+
+
+class FailoverNode:
+    """
+    The master/follower protocol of one bot instance, without any I/O: main.py and the simulator (simulation.py)
+    feed it COM messages, heartbeat ticks and displayed actions, and carry out the effects it returns.
+    Every method taking `now` uses the current time when it's None.
+
+    Mastership is owned through terms. An instance that promotes itself claims the next term, and its LET_MASTER,
+    CONNECT_ACK, heartbeats and ENSURE_DISPLAY messages all carry it. Claims are ordered by (term, instance ID), so
+    instances that lost messages or disagree on who is alive still converge on one master: an instance that hears
+    a higher claim follows it, stepping down if it was master, and a master that hears a lower one tells its
+    sender to follow.
+    """
+    def __init__(self, bot_id, version, heartbeat_interval, missed_beats=3):
+        self.bot_id = bot_id
+        self.version = version
+        self.initialized = False
+        self.im_master = False
+        self.alive_instances = set()
+        self.master_instance = None
+        # The highest term claimed so far, owned by master_instance (None while looking for a master)
+        self.term = 0
+        self.liveness = Liveness(heartbeat_interval, missed_beats)
+        self.pending_actions = PendingActionJournal()
+        self.action_log = ActionLog()
+        self.message_hub = MessageHub()
+
+    def connect(self):
+        return [(Effect.COM, -1, MessageType.CONNECT, str(self.version)), (Effect.CONNECT_TIMER,)]
+
+    def on_connect_timeout(self, now=None):
+        # A master we heard from since, but whose CONNECT_ACK we missed, still has to send us the workspace
+        if self.master_instance is not None and self.liveness.is_alive(self.master_instance, now=now):
+            logging.info("No connect ack from master {}, connecting again".format(self.master_instance))
+            return [(Effect.COM, self.master_instance, MessageType.CONNECT, str(self.version)), (Effect.CONNECT_TIMER,)]
+        # No master answered our CONNECT
+        return self.self_promote()
+
+    def self_promote(self):
+        self.initialized = True
+        self.im_master = True
+        self.master_instance = self.bot_id
+        self.term += 1
+        # Needed for initialization. Alternatively, can use function arg (what archi was doing)
+        self.alive_instances.add(self.bot_id)
+        logging.info("I'm in charge! Term {}".format(self.term))
+        return [(Effect.COM, -1, MessageType.LET_MASTER, str(self.term))]
+
+    def on_claim(self, from_id, term):
+        """
+        Another instance claims to be master for `term`. Returns the effects, if any.
+        """
+        current = (self.term, -1 if self.master_instance is None else self.master_instance)
+        if (term, from_id) > current:
+            if self.im_master:
+                logging.warning("I was unworthy :( Instance {} is master for term {}".format(from_id, term))
+                self.im_master = False
+            if from_id != self.master_instance:
+                logging.info("Master is now {}, term {}".format(from_id, term))
+            self.term = term
+            self.master_instance = from_id
+            self.alive_instances.add(from_id)
+        elif (term, from_id) < current and self.im_master:
+            # A stale master, which missed our promotion
+            logging.warning("Instance {} still claims term {}, telling it about term {}".format(from_id, term, self.term))
+            return [(Effect.COM, from_id, MessageType.LET_MASTER, str(self.term))]
+        return []
+
+    def run_election(self, now=None):
+        """
+        Promotes this instance if it wins the election, and hands back the actions the old master never confirmed.
+        """
+        if self.im_master or elect_master(self.alive_instances) != self.bot_id:
+            return []
+
+        effects = self.self_promote()
+        pending_actions = self.pending_actions.drain(now=now)
+        if len(pending_actions) > 0:
+            logging.info("Draining {} pending actions".format(len(pending_actions)))
+        return effects + [(Effect.PERFORM, action) for action in pending_actions]
+
+    def check_liveness(self, now=None):
+        dead_instances = self.liveness.expired([i for i in self.alive_instances if i != self.bot_id], now=now)
+        for instance_id in dead_instances:
+            logging.warning("Instance {} missed its heartbeats, considering it dead".format(instance_id))
+            self.alive_instances.discard(instance_id)
+            self.liveness.forget(instance_id)
+
+        if self.master_instance is None or self.master_instance in dead_instances:
+            logging.info("No live master, instances {}".format(self.alive_instances))
+            self.master_instance = None
+            return self.run_election(now=now)
+        return []
+
+    def heartbeat(self, now=None):
+        if not self.initialized:
+            return []
+        # The master's heartbeats renew its claim, for instances that missed the LET_MASTER
+        message = str(self.version)
+        if self.im_master:
+            message += "+" + str(self.term)
+        return [(Effect.COM, -1, MessageType.HEARTBEAT, message)] + self.check_liveness(now=now)
+
+    def forget(self, instance_id, now=None):
+        """
+        The instance is going away (e.g. updating), so don't wait for its lease to run out.
+        """
+        if instance_id in self.alive_instances:
+            self.alive_instances.remove(instance_id)
+        else:
+            logging.error("Updating instance not in alive instances: {}".format(self.alive_instances))
+
+        self.liveness.forget(instance_id)
+        if self.master_instance == instance_id:
+            self.master_instance = None
+            return self.run_election(now=now)
+        return []
+
+    def is_displayed(self, key):
+        return key is not None and key in self.action_log
+
+    def displayed(self, key, value_message=""):
+        """
+        The master displayed an action: tells the other instances, so they don't repeat it.
+        """
+        if key is not None:
+            self.action_log.add(key)
+        return [(Effect.COM, -1, MessageType.ENSURE_DISPLAY, format_ensure_display_message(self.term, key, value_message))]
+
+    def defer(self, func, window, return_name=None, key=None, now=None):
+        """
+        A follower saw an action for the master to display. Keyed actions are journaled until the master confirms
+        that exact key. Otherwise, the action is only journaled if no ENSURE_DISPLAY messages (with that return
+        name, if given) were seen within the last `window` seconds. The journal is drained if the master dies.
+        """
+        if key is not None or not self.message_hub.got_message(MessageType.ENSURE_DISPLAY, window, return_name, now=now):
+            self.pending_actions.append(func, window, return_name, key, now=now)
+
+    def receive(self, from_id, message_type, message, now=None):
+        """
+        Handles a COM message from another instance. Types that aren't about the protocol itself (DB and workspace
+        sync) are left to the host.
+        """
+        # Any message from an instance proves it's alive
+        self.liveness.beat(from_id, now=now)
+        effects = []
+
+        if message_type == MessageType.CONNECT:
+            if self.im_master:
+                effects.append((Effect.COM, from_id, MessageType.CONNECT_ACK, "{}+{}".format(self.version, self.term)))
+                # It is master's responsibility to send workspace to synchronize newcomer.
+                # The DB follows once the newcomer tells us how far behind it is (REQUEST_DB).
+                effects.append((Effect.SEND_WORKSPACE, from_id))
+            else:
+                effects.append((Effect.COM, from_id, MessageType.CONNECT_ACK, str(self.version)))
+
+            version = int(message)
+            if version >= self.version:
+                self.alive_instances.add(from_id)
+            if version > self.version:
+                logging.info("Bot instance {} running newer version {}, updating...".format(from_id, version))
+                effects.append((Effect.UPDATE_SOURCE,))
+            logging.info("After CONNECT message, instances {}".format(self.alive_instances))
+        elif message_type == MessageType.CONNECT_ACK:
+            _, master, term = message.partition("+")
+            self.alive_instances.add(from_id)
+            if master:
+                logging.info("Received connect ack from master instance {}".format(from_id))
+                self.alive_instances.add(self.bot_id)
+                effects += self.on_claim(from_id, parse_term(term))
+                effects.append((Effect.CANCEL_CONNECT_TIMER,))
+                effects.append((Effect.REQUEST_DB, from_id))
+            logging.info("After CONNECT_ACK message, instances {}, master {}".format(self.alive_instances, self.master_instance))
+        elif message_type == MessageType.LET_MASTER:
+            effects += self.on_claim(from_id, parse_term(message))
+        elif message_type == MessageType.ENSURE_DISPLAY:
+            try:
+                term, key, kv = parse_ensure_display_message(message)
+            except ValueError as e:
+                # Dropped before it reaches the message hub, which would trip on it for every ensure_display
+                logging.warning("Dropping malformed ENSURE_DISPLAY from instance {}: {}".format(from_id, e))
+                return effects
+            # Even a stale master did display it
+            if key is not None:
+                self.action_log.add(key)
+            self.pending_actions.acknowledge(key, now=now)
+            if kv is not None:
+                effects.append((Effect.SET_RETURN_VALUE, kv[0], kv[1]))
+            effects += self.on_claim(from_id, term)
+        elif message_type == MessageType.HEARTBEAT:
+            _, master, term = message.partition("+")
+            if from_id not in self.alive_instances:
+                logging.info("Heartbeat from unknown instance {}, adding it".format(from_id))
+                self.alive_instances.add(from_id)
+            if master:
+                effects += self.on_claim(from_id, parse_term(term))
+
+        self.message_hub.on_message(message_type, message, now=now)
+        return effects
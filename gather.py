@@ -0,0 +1,241 @@
+import datetime
+from enum import Enum, unique
+
+
+@unique
+class MemberState(Enum):
+    OKIB = "okib"
+    LATERIB = "laterib"
+    NOIB = "noib"
+
+
+# laterIB members aren't shown in the list message
+VISIBLE_STATES = [MemberState.OKIB, MemberState.NOIB]
+
+
+class GatherState:
+    """
+    OKIB gather membership. Each member is in at most one state, and each state keeps its members in
+    insertion order, so every transition is O(1). The rendered list text is cached until membership changes.
+    """
+    def __init__(self):
+        self._states = {}
+        self._members = {state: {} for state in MemberState}
+        self._render_key = None
+        self._render_text = None
+
+    def get_state(self, member_id):
+        return self._states.get(member_id)
+
+    def members(self, state):
+        return list(self._members[state].values())
+
+    def count(self, state):
+        return len(self._members[state])
+
+    def set(self, member, state):
+        """
+        Moves a member to the given state. Returns whether the rendered list changed.
+        """
+        old_state = self._states.get(member.id)
+        if old_state == state:
+            return False
+
+        if old_state is not None:
+            del self._members[old_state][member.id]
+        self._members[state][member.id] = member
+        self._states[member.id] = state
+
+        changed = old_state in VISIBLE_STATES or state in VISIBLE_STATES
+        if changed:
+            self._render_key = None
+        return changed
+
+    def clear(self):
+        self._states = {}
+        self._members = {state: {} for state in MemberState}
+        self._render_key = None
+
+    def to_ids(self):
+        return {state: list(self._members[state].keys()) for state in MemberState}
+
+    def load_ids(self, ids_by_state, get_member):
+        """
+        Replaces membership with the given member IDs per state, resolved through get_member.
+        Returns the IDs that couldn't be resolved.
+        """
+        self.clear()
+        missing = []
+        for state in MemberState:
+            for member_id in ids_by_state[state]:
+                member = get_member(member_id)
+                if member is None:
+                    missing.append(member_id)
+                else:
+                    self.set(member, state)
+        return missing
+
+    def render(self, gatherer_name, ask_emoji, okib_emoji, noib_emoji, gather_players):
+        render_key = (gatherer_name, ask_emoji, okib_emoji, noib_emoji, gather_players)
+        if render_key != self._render_key:
+            okib_members = self._members[MemberState.OKIB].values()
+            noib_members = self._members[MemberState.NOIB].values()
+            self._render_text = "{} asks : {}\n{} {}/{} : {}\n{} : {}".format(
+                gatherer_name, ask_emoji,
+                okib_emoji, len(okib_members), gather_players, ", ".join([m.display_name for m in okib_members]),
+                noib_emoji, ", ".join([m.display_name for m in noib_members])
+            )
+            self._render_key = render_key
+        return self._render_text
+
+
+class Gather:
+    """
+    One channel's OKIB gather. A closed gather keeps its members, so it can be reopened with "okib retrieve".
+    """
+    MESSAGE_KEY_PREFIX = "okibmsg"
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.active = False
+        self.message_id = None
+        self.list_content = ""
+        self.state = GatherState()
+        self.gatherer = None
+        self.gathered = False
+        self.time = datetime.datetime.now()
+        # Set by the owner, coalesces list message edits for this gather
+        self.list_updater = None
+
+    @property
+    def channel_id(self):
+        return self.channel.id
+
+    def get_message_id_key(self):
+        # Name of the list message ID value set on all instances through ensure_display
+        return Gather.MESSAGE_KEY_PREFIX + str(self.channel_id)
+
+    @staticmethod
+    def parse_message_id_key(key):
+        """
+        Returns the channel ID from a key made by get_message_id_key, or None if it's not a gather key.
+        """
+        if not key.startswith(Gather.MESSAGE_KEY_PREFIX):
+            return None
+        try:
+            return int(key[len(Gather.MESSAGE_KEY_PREFIX):])
+        except ValueError:
+            return None
+
+    def start(self, gatherer, members, retrieve=False):
+        self.active = True
+        self.gatherer = gatherer
+        self.time = datetime.datetime.now()
+        if not retrieve:
+            self.gathered = False
+            self.state.clear()
+            for member in members:
+                self.state.set(member, MemberState.OKIB)
+
+    def update_list(self, ask_emoji, okib_emoji, noib_emoji, gather_players):
+        self.list_content = self.state.render(self.gatherer.display_name, ask_emoji, okib_emoji, noib_emoji, gather_players)
+
+    def check_gathered(self, gather_players):
+        """
+        Returns True if the gather just completed. Un-marks a completed gather that lost players.
+        """
+        num_okib = self.state.count(MemberState.OKIB)
+        if num_okib >= gather_players and not self.gathered:
+            return True
+        if num_okib < gather_players and self.gathered:
+            self.gathered = False
+        return False
+
+    def to_workspace_dict(self):
+        member_ids = self.state.to_ids()
+        return {
+            "channel_id": self.channel_id,
+            "active": self.active,
+            "message_id": self.message_id,
+            "list_content": self.list_content,
+            "okib_member_ids": member_ids[MemberState.OKIB],
+            "laterib_member_ids": member_ids[MemberState.LATERIB],
+            "noib_member_ids": member_ids[MemberState.NOIB],
+            "gatherer_id": None if self.gatherer is None else self.gatherer.id,
+            "gathered": self.gathered,
+            "gather_time": self.time.timestamp(),
+        }
+
+    @staticmethod
+    def from_workspace_dict(obj, channel, gatherer, get_member):
+        """
+        Returns the gather and the member IDs that couldn't be resolved through get_member.
+        """
+        gather = Gather(channel)
+        gather.active = obj["active"]
+        gather.message_id = obj["message_id"]
+        gather.list_content = obj["list_content"]
+        missing = gather.state.load_ids({
+            MemberState.OKIB: obj["okib_member_ids"],
+            MemberState.LATERIB: obj["laterib_member_ids"],
+            MemberState.NOIB: obj["noib_member_ids"],
+        }, get_member)
+        gather.gatherer = gatherer
+        gather.gathered = obj["gathered"]
+        gather.time = datetime.datetime.fromtimestamp(obj["gather_time"])
+        return gather, missing
+
+
+class GatherRegistry:
+    """
+    All gathers by channel, plus an index of their list messages so reactions find their gather in O(1).
+    """
+    def __init__(self):
+        self._by_channel_id = {}
+        self._by_message_id = {}
+
+    def __len__(self):
+        return len(self._by_channel_id)
+
+    def __iter__(self):
+        return iter(list(self._by_channel_id.values()))
+
+    def get(self, channel_id):
+        return self._by_channel_id.get(channel_id)
+
+    def add(self, gather):
+        self.remove(gather.channel_id)
+        self._by_channel_id[gather.channel_id] = gather
+        if gather.message_id is not None:
+            self._by_message_id[gather.message_id] = gather
+        return gather
+
+    def remove(self, channel_id):
+        gather = self._by_channel_id.pop(channel_id, None)
+        if gather is not None and gather.message_id is not None:
+            self._by_message_id.pop(gather.message_id, None)
+        return gather
+
+    def clear(self):
+        self._by_channel_id = {}
+        self._by_message_id = {}
+
+    def active(self):
+        return [gather for gather in self._by_channel_id.values() if gather.active]
+
+    def find_by_message(self, message_id):
+        return self._by_message_id.get(message_id)
+
+    def set_message_id(self, channel_id, message_id):
+        """
+        Points the channel's gather at a new list message (or None). Returns False if there's no such gather.
+        """
+        gather = self._by_channel_id.get(channel_id)
+        if gather is None:
+            return False
+        if gather.message_id is not None:
+            self._by_message_id.pop(gather.message_id, None)
+        gather.message_id = message_id
+        if message_id is not None:
+            self._by_message_id[message_id] = gather
+        return True
@@ -1,6 +1,9 @@
 import discord
+import functools
 import logging
 
+from actions import ActionGraph
+
 BELL_EMOJI = "\U0001F514"
 NOBELL_EMOJI = "\U0001F515"
 
@@ -105,7 +108,23 @@ def get_map_server_nice(server):
         return ":flag_nl: Amsterdam (ENT)"
     return server
 
+# Region subscription (see the sub command) that each lobby server belongs to
+LOBBY_SERVER_REGIONS = {
+    "usw": "na",
+    "eu": "eu",
+    "kr": "kr",
+    "Montreal": "na",
+    "New York": "na",
+    "France": "eu",
+    "Amsterdam": "eu",
+}
+
+def get_lobby_region(server):
+    return LOBBY_SERVER_REGIONS.get(server)
+
 class Lobby:
+    MESSAGE_KEY_PREFIX = "lobbymsg"
+
     def __init__(self, lobby_dict, is_ent):
         self.is_ent = is_ent
         self.id = lobby_dict["id"]
@@ -113,6 +132,8 @@ class Lobby:
         self.map = lobby_dict["map"]
         self.host = lobby_dict["host"]
         self.subscribers = []
+        # Roles mentioned in the lobby message, chosen when it's created so edits keep the same content
+        self.mention_role_ids = []
 
         if is_ent:
             self.server = lobby_dict["location"]
@@ -125,6 +146,35 @@ class Lobby:
             self.slots_taken = lobby_dict["slotsTaken"]
             self.slots_total = lobby_dict["slotsTotal"]
 
+    @classmethod
+    def from_workspace_dict(cls, obj, subscribers=[]):
+        lobby = cls.__new__(cls)
+        lobby.is_ent = obj["is_ent"]
+        lobby.id = obj["id"]
+        lobby.name = obj["name"]
+        lobby.map = obj["map"]
+        lobby.host = obj["host"]
+        lobby.server = obj["server"]
+        lobby.slots_taken = obj["slots_taken"]
+        lobby.slots_total = obj["slots_total"]
+        lobby.subscribers = list(subscribers)
+        lobby.mention_role_ids = list(obj["mention_role_ids"])
+        return lobby
+
+    def to_workspace_dict(self):
+        return {
+            "id": self.id,
+            "is_ent": self.is_ent,
+            "name": self.name,
+            "map": self.map,
+            "host": self.host,
+            "server": self.server,
+            "slots_taken": self.slots_taken,
+            "slots_total": self.slots_total,
+            "subscriber_ids": [sub.id for sub in self.subscribers],
+            "mention_role_ids": list(self.mention_role_ids),
+        }
+
     def __eq__(self, other):
         return self.id == other.id
 
@@ -137,7 +187,19 @@ class Lobby:
         )
 
     def get_message_id_key(self):
-        return "lobbymsg{}".format(self.id)
+        return Lobby.MESSAGE_KEY_PREFIX + str(self.id)
+
+    @staticmethod
+    def parse_message_id_key(key):
+        """
+        Returns the lobby ID from a key made by get_message_id_key, or None if it's not a lobby key.
+        """
+        if not key.startswith(Lobby.MESSAGE_KEY_PREFIX):
+            return None
+        try:
+            return int(key[len(Lobby.MESSAGE_KEY_PREFIX):])
+        except ValueError:
+            return None
 
     def is_ib(self):
         # return self.map.find("Legion") != -1 and self.map.find("TD") != -1 # test
@@ -147,7 +209,10 @@ class Lobby:
     def is_updated(self, new):
         return self.name != new.name or self.server != new.server or self.map != new.map or self.host != new.host or self.slots_taken != new.slots_taken or self.slots_total != new.slots_total
 
-    def to_discord_message_info(self, bnet_lobby_role, is_open):
+    def get_region(self):
+        return get_lobby_region(self.server)
+
+    def to_discord_message_info(self, mention_roles, is_open):
         COLOR_CLOSED = discord.Colour(0x8a0808)
 
         version = get_map_version(self.map)
@@ -165,10 +230,10 @@ class Lobby:
         elif version.deprecated:
             mark = ":x:"
             message = ":warning: *Old map version* :warning:"
-        if not self.is_ent:
+        if len(mention_roles) > 0:
             if len(message) > 0:
                 message += "\n"
-            message += f"{bnet_lobby_role.mention}"
+            message += " ".join([role.mention for role in mention_roles])
 
         slots_taken = self.slots_taken
         slots_total = self.slots_total
@@ -214,3 +279,53 @@ class Lobby:
             "message": message,
             "embed": embed,
         }
+
+
+def get_lobby_changes(prev_lobbies, api_lobbies):
+    prev_lobbies_by_id = {lobby.id: lobby for lobby in prev_lobbies}
+    api_lobby_ids = set([lobby.id for lobby in api_lobbies])
+
+    lobbies = []
+    is_prev_lobby_closed = [(lobby.id not in api_lobby_ids) for lobby in prev_lobbies]
+    is_lobby_new = []
+    is_lobby_updated = []
+    for lobby in api_lobbies:
+        prev_lobby = prev_lobbies_by_id.get(lobby.id)
+        is_new = prev_lobby is None
+        is_updated = False
+        if not is_new:
+            lobby.subscribers = prev_lobby.subscribers
+            lobby.mention_role_ids = prev_lobby.mention_role_ids
+            is_updated = prev_lobby.is_updated(lobby)
+
+        lobbies.append(lobby)
+        is_lobby_new.append(is_new)
+        is_lobby_updated.append(is_updated)
+
+    return (lobbies, is_prev_lobby_closed, is_lobby_new, is_lobby_updated)
+
+def plan_lobby_updates(prev_lobbies, api_lobbies, create_message, update_message):
+    """
+    Diffs the lobbies and returns the new open lobbies, and an ActionGraph of the message updates to make.
+    create_message(lobby) and update_message(lobby, is_open=True) are coroutine functions.
+    """
+    changes = get_lobby_changes(prev_lobbies, api_lobbies)
+    lobbies = changes[0]
+
+    # Each lobby has its own message, so all of these run concurrently
+    graph = ActionGraph()
+
+    # Update messages for closed lobbies
+    for i in range(len(prev_lobbies)):
+        if changes[1][i]:
+            graph.add("close{}".format(i), functools.partial(update_message, prev_lobbies[i], is_open=False))
+
+    # Create/update messages for open lobbies
+    for i in range(len(lobbies)):
+        assert not (changes[2][i] and changes[3][i])
+        if changes[2][i]:
+            graph.add("create{}".format(i), functools.partial(create_message, lobbies[i]))
+        if changes[3][i]:
+            graph.add("update{}".format(i), functools.partial(update_message, lobbies[i]))
+
+    return (lobbies, graph)
@@ -0,0 +1,118 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# Attributes every LogRecord has. Anything else was passed through `extra` and goes into the JSON as a field.
+_RECORD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__.keys()) | {"message", "asctime", "suppressed"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line. The time comes first, so the line still starts with a sortable timestamp
+    (see logstore.LOG_JSON_LINE_PREFIX). Fields passed with `extra` are included as they are.
+    """
+    def format(self, record):
+        obj = {
+            "time": datetime.datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k, v in record.__dict__.items():
+            if k not in _RECORD_ATTRS and not k.startswith("_"):
+                obj[k] = v
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed > 0:
+            obj["suppressed"] = suppressed
+        if record.exc_info:
+            obj["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            obj["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(obj, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Per-logger token buckets, `limits` maps a logger name to (records per second, burst). Records below
+    WARNING over the limit are dropped, and the next record let through counts them in `suppressed`.
+    Loggers without a limit, and their children, are not limited.
+    """
+    def __init__(self, limits, clock=time.monotonic):
+        super().__init__()
+        self._limits = limits
+        self._clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+        # metrics
+        self.num_dropped = 0
+
+    def _limit(self, name):
+        while True:
+            limit = self._limits.get(name)
+            if limit is not None or "." not in name:
+                return name, limit
+            name = name.rsplit(".", 1)[0]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        name, limit = self._limit(record.name)
+        if limit is None:
+            return True
+
+        rate, burst = limit
+        now = self._clock()
+        with self._lock:
+            tokens, last, dropped = self._buckets.get(name, (burst, now, 0))
+            tokens = min(tokens + (now - last) * rate, burst)
+            if tokens < 1:
+                self._buckets[name] = (tokens, now, dropped + 1)
+                self.num_dropped += 1
+                return False
+            self._buckets[name] = (tokens - 1, now, 0)
+        record.suppressed = dropped
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue for a QueueListener thread. Unlike QueueHandler, messages are not formatted
+    here: %-style arguments are only formatted by the listener, off the event loop. Pass arguments that aren't
+    mutated afterwards. When the queue is full, records are dropped rather than waited on.
+    """
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        # metrics
+        self.num_dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.num_dropped += 1
+
+
+def start_queue_logging(logger, handlers, max_queue_size=10000, filters=()):
+    """
+    Replaces the logger's handlers with a queue, serviced by a listener thread writing to `handlers`.
+    The listener is stopped (and the queue flushed) at exit. Returns (queue handler, listener).
+    """
+    queue_handler = NonBlockingQueueHandler(queue.Queue(max_queue_size))
+    for f in filters:
+        queue_handler.addFilter(f)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler, listener
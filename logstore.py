@@ -0,0 +1,306 @@
+import bisect
+import datetime
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+
+LOG_INDEX_FILE_NAME = "index.json"
+# Format of the timestamp at the start of each log line, which sorts like the time it represents
+LOG_LINE_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+LOG_LINE_TIMESTAMP_LENGTH = 19
+# JSON lines (logqueue.JsonFormatter) start with the time field instead
+LOG_JSON_LINE_PREFIX = "{\"time\": \""
+LOG_SEGMENT_TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+
+
+def _locked(func):
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def format_line_timestamp(dt):
+    return dt.strftime(LOG_LINE_TIMESTAMP_FORMAT)
+
+
+class LogSegment:
+    __slots__ = ["file", "start", "end"]
+
+    def __init__(self, file, start, end=None):
+        self.file = file
+        # Line timestamps (LOG_LINE_TIMESTAMP_FORMAT), end is None while the segment is being written
+        self.start = start
+        self.end = end
+
+    def is_compressed(self):
+        return self.file.endswith(".gz")
+
+    def to_dict(self):
+        return {"file": self.file, "start": self.start, "end": self.end}
+
+
+class LogStore:
+    """
+    Log segments in a directory, and a persistent index of their time ranges sorted by start. Finished segments
+    are gzipped, and the oldest ones are deleted past `max_segments`. Looking up a time range is a binary search
+    over the index, then a scan of the matching segments only.
+    """
+    def __init__(self, logs_dir, prefix, max_segments=200):
+        self._logs_dir = logs_dir
+        self._prefix = prefix
+        self._max_segments = max_segments
+        self._index_path = os.path.join(logs_dir, LOG_INDEX_FILE_NAME)
+        self._segments = []
+        self._starts = []
+        # The handler rotates from whichever thread logs, and lookups run in an executor
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._segments)
+
+    @_locked
+    def segments(self):
+        return list(self._segments)
+
+    def _path(self, segment):
+        return os.path.join(self._logs_dir, segment.file)
+
+    def _reindex(self):
+        self._segments.sort(key=lambda s: s.start)
+        self._starts = [s.start for s in self._segments]
+
+    @_locked
+    def load(self):
+        """
+        Reads the index, or rebuilds it from the directory if it's missing or broken. Segments left open by
+        a previous run, which didn't shut down cleanly, are finished and compressed.
+        """
+        if not os.path.exists(self._logs_dir):
+            os.makedirs(self._logs_dir)
+
+        self._segments = []
+        try:
+            with open(self._index_path, "r") as f:
+                self._segments = [LogSegment(obj["file"], obj["start"], obj["end"]) for obj in json.load(f)]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if os.path.exists(self._index_path):
+                logging.warning("Rebuilding log index, failed to read {}: {}".format(self._index_path, e))
+            self._segments = self._scan()
+        self._segments = [s for s in self._segments if os.path.exists(self._path(s))]
+        self._reindex()
+
+        for segment in self._segments:
+            if not segment.is_compressed():
+                self.finish_segment(segment, save=False)
+        self._prune()
+        self.save()
+
+    def _scan(self):
+        segments = []
+        for file in os.listdir(self._logs_dir):
+            if not (file.endswith(".log") or file.endswith(".log.gz")):
+                continue
+            try:
+                timestamp_str = file.split(".")[1][:len("YYYYmmdd_HHMMSS")]
+                start = datetime.datetime.strptime(timestamp_str, LOG_SEGMENT_TIMESTAMP_FORMAT)
+            except (IndexError, ValueError):
+                logging.warning("Ignoring log file {}".format(file))
+                continue
+            mtime = datetime.datetime.fromtimestamp(os.path.getmtime(os.path.join(self._logs_dir, file)))
+            segments.append(LogSegment(file, format_line_timestamp(start), format_line_timestamp(mtime)))
+        return segments
+
+    def save(self):
+        tmp_path = self._index_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump([s.to_dict() for s in self._segments], f, indent=0)
+            os.replace(tmp_path, self._index_path)
+        except OSError as e:
+            logging.warning("Failed to write log index {}: {}".format(self._index_path, e))
+
+    @_locked
+    def new_segment(self, now):
+        """
+        Adds an open segment starting at `now` and returns the path to write it to.
+        """
+        name = "{}.{}".format(self._prefix, now.strftime(LOG_SEGMENT_TIMESTAMP_FORMAT))
+        file = name + ".log"
+        n = 1
+        while os.path.exists(os.path.join(self._logs_dir, file)) or os.path.exists(os.path.join(self._logs_dir, file + ".gz")):
+            file = "{}-{}.log".format(name, n)
+            n += 1
+        segment = LogSegment(file, format_line_timestamp(now))
+        self._segments.append(segment)
+        self._reindex()
+        self.save()
+        return self._path(segment)
+
+    @_locked
+    def finish_segment(self, segment, end=None, save=True):
+        """
+        Compresses a segment that won't be written anymore.
+        """
+        path = self._path(segment)
+        if end is None:
+            end = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+        segment.end = format_line_timestamp(end)
+        try:
+            with open(path, "rb") as f_in, gzip.open(path + ".gz", "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.remove(path)
+            segment.file += ".gz"
+        except OSError as e:
+            logging.warning("Failed to compress log segment {}: {}".format(path, e))
+        if save:
+            self._prune()
+            self.save()
+
+    @_locked
+    def finish_path(self, path, end):
+        file = os.path.basename(path)
+        for segment in self._segments:
+            if segment.file == file:
+                self.finish_segment(segment, end)
+                return
+
+    def _prune(self):
+        finished = [s for s in self._segments if s.end is not None]
+        for segment in finished[:max(len(finished) - self._max_segments, 0)]:
+            try:
+                os.remove(self._path(segment))
+            except OSError as e:
+                logging.warning("Failed to delete log segment {}: {}".format(segment.file, e))
+            self._segments.remove(segment)
+        self._reindex()
+
+    @_locked
+    def find(self, start, end):
+        """
+        Returns the segments that may contain lines between the datetimes `start` and `end`, oldest first.
+        """
+        start_str = format_line_timestamp(start)
+        end_str = format_line_timestamp(end)
+        # The segment open at `start` is the last one starting at or before it
+        first = max(bisect.bisect_right(self._starts, start_str) - 1, 0)
+        last = bisect.bisect_right(self._starts, end_str)
+        return [
+            s for s in self._segments[first:last]
+            if s.end is None or s.end >= start_str
+        ]
+
+    @_locked
+    def _open(self, segment):
+        # Locked, so a segment being compressed is opened either before or after it's renamed
+        path = self._path(segment)
+        if segment.is_compressed():
+            return gzip.open(path, "rt", errors="replace")
+        if not os.path.exists(path) and os.path.exists(path + ".gz"):
+            # Compressed since the segment was looked up
+            return gzip.open(path + ".gz", "rt", errors="replace")
+        return open(path, "r", errors="replace")
+
+    def excerpt(self, start, end):
+        """
+        Returns the log lines between the datetimes `start` and `end` as gzipped bytes, or None if there are none.
+        Lines without a timestamp, like tracebacks, go with the line before them.
+        """
+        start_str = format_line_timestamp(start)
+        end_str = format_line_timestamp(end)
+        out = io.BytesIO()
+        num_lines = 0
+        with gzip.GzipFile(fileobj=out, mode="wb") as gz:
+            for segment in self.find(start, end):
+                try:
+                    f = self._open(segment)
+                except OSError as e:
+                    logging.warning("Failed to open log segment {}: {}".format(segment.file, e))
+                    continue
+                with f:
+                    in_range = False
+                    for line in f:
+                        offset = len(LOG_JSON_LINE_PREFIX) if line.startswith(LOG_JSON_LINE_PREFIX) else 0
+                        timestamp = line[offset:offset + LOG_LINE_TIMESTAMP_LENGTH]
+                        if len(timestamp) == LOG_LINE_TIMESTAMP_LENGTH and timestamp[4] == "-" and timestamp[13] == ":":
+                            if timestamp > end_str:
+                                break
+                            in_range = timestamp >= start_str
+                        if in_range:
+                            gz.write(line.encode("utf-8"))
+                            num_lines += 1
+        if num_lines == 0:
+            return None
+        return out.getvalue()
+
+
+class SegmentedLogHandler(logging.Handler):
+    """
+    Writes log records to the store's segments, starting a new one when the current one is over `max_bytes`
+    or older than `max_age_seconds`.
+    """
+    def __init__(self, store, max_bytes, max_age_seconds):
+        super().__init__()
+        self._store = store
+        self._max_bytes = max_bytes
+        self._max_age = datetime.timedelta(seconds=max_age_seconds)
+        self._stream = None
+        self._path = None
+        self._opened_at = None
+        self._size = 0
+        self._emitting = False
+
+    def _should_rotate(self, now):
+        return self._size >= self._max_bytes or now - self._opened_at >= self._max_age
+
+    def _close_segment(self, now):
+        if self._stream is None:
+            return
+        self._stream.close()
+        self._stream = None
+        self._store.finish_path(self._path, now)
+
+    def _open_segment(self, now):
+        self._path = self._store.new_segment(now)
+        self._stream = open(self._path, "a", encoding="utf-8")
+        self._opened_at = now
+        self._size = 0
+
+    def emit(self, record):
+        try:
+            now = datetime.datetime.fromtimestamp(record.created)
+            data = self.format(record) + "\n"
+            self.acquire()
+            if self._emitting:
+                # Logged by the store while rotating, the segments are in flux
+                self.release()
+                sys.stderr.write(data)
+                return
+            self._emitting = True
+            try:
+                if self._stream is None:
+                    self._open_segment(now)
+                elif self._should_rotate(now):
+                    self._close_segment(now)
+                    self._open_segment(now)
+                self._stream.write(data)
+                self._stream.flush()
+                self._size += len(data)
+            finally:
+                self._emitting = False
+                self.release()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.acquire()
+        try:
+            self._close_segment(datetime.datetime.now())
+        finally:
+            self.release()
+        super().close()
@@ -1,26 +1,46 @@
+import time
+# Taken first, so the startup report includes imports
+_startup_begin = time.perf_counter()
+
 import aiohttp
 import asyncio
 import datetime
-from enum import Enum, unique
 import functools
 import io
 import logging
+import logging.handlers
 import os
-import pickle
-import sqlite3
 import sys
 import traceback
 from dataclasses import dataclass
 
 import discord
 from discord.ext import commands, tasks
-import git
 
-from lobbies import Lobby, BELL_EMOJI, NOBELL_EMOJI
+from actions import ActionGraph
+from database import Database, format_event_datetime
+from gather import Gather, GatherRegistry, MemberState
+from failover import Effect, FailoverNode, action_key
+from lobbies import Lobby, BELL_EMOJI, NOBELL_EMOJI, plan_lobby_updates
+from logqueue import JsonFormatter, RateLimitFilter, start_queue_logging
+from logstore import LOG_LINE_TIMESTAMP_FORMAT, LogStore, SegmentedLogHandler
+from memory import MemberLRU, cache_sizes, read_rss_bytes
+from messages import MessageType, format_ensure_display_value
+from metrics import COUNT_BUCKETS, MetricsRegistry, MetricsServer
+from notify import DmFanout, RolePingLimiter
+from permissions import Rank, RankResolver, requires_rank
+from pagination import Paginator, PagedMessage, is_page_message_key, page_message_key, paginate_lines, PREV_PAGE_EMOJI, NEXT_PAGE_EMOJI
 from replays import ReplayData, replays_load_emojis, replay_id_to_url
+from resolver import RESOLVER_CACHE_FILE_NAME, DiscordResolver
+from scheduler import DEFAULT_GLOBAL_LIMIT, DEFAULT_ROUTE_LIMITS, DiscordScheduler, JobShed, Priority, get_route, instrument_http, unscheduled
+from timers import Debouncer, TimerWheel
+from version import StartupTimer, get_source_version
+from watchdog import LoopWatchdog
+from workspace import encode_workspace, decode_workspace
 
 ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
 LOGS_DIR = os.path.join(ROOT_DIR, "logs")
+WATCHDOG_LOG_PATH = os.path.join(ROOT_DIR, "watchdog.log")
 LOG_FILE_TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
 
 # PARAMS (PRIVATE)
@@ -51,84 +71,49 @@ NOIB_EMOJI_ID = getattr(constants, "NOIB_EMOJI_ID", 477544228629512193)
 IB_EMOJI_ID = getattr(constants, "IB_EMOJI_ID", 451846742661398528)
 IB2_EMOJI_ID = getattr(constants, "IB2_EMOJI_ID", 590986772734017536)
 
-
-def get_source_version():
-    repo = git.Repo(ROOT_DIR)
-    head_commit_sha = repo.head.commit.binsha
-    all_commits = repo.iter_commits()
-    total = 0
-    index = -1
-    for commit in all_commits:
-        if commit.binsha == head_commit_sha:
-            index = total
-        total += 1
-
-    if index == -1:
-        raise Exception("HEAD commit sha not found: {}".format(repo.head.commit.hexsha))
-    return total - index
-
-
-@unique
-class MessageType(Enum):
-    CONNECT = "connect"
-    CONNECT_ACK = "connectack"
-    LET_MASTER = "letmaster"
-    ENSURE_DISPLAY = "ensure"
-    SEND_DB = "senddb"
-    SEND_DB_ACK = "senddback"
-    SEND_WORKSPACE = "sendws"
-    SEND_WORKSPACE_ACK = "sendwsack"
-
-
-class Message:
-    def __init__(self, timestamp, message):
-        self.timestamp = timestamp
-        self.message = message
-
-
-class MessageHub:
-    MAX_AGE_SECONDS = 5 * 60
-
-    def __init__(self):
-        self._message_queues = {}
-        for message_type in MessageType:
-            self._message_queues[message_type] = []
-
-    def on_message(self, message_type, message):
-        assert isinstance(message_type, MessageType)
-        assert isinstance(message, str)
-        assert message_type in self._message_queues
-
-        # TODO should I use the "real" message timestamp?
-        timestamp_now = datetime.datetime.now()
-        msg = Message(timestamp_now, message)
-        self._message_queues[message_type].append(msg)
-
-        # Trim old messages based on max age
-        timestamp_cutoff = timestamp_now - datetime.timedelta(seconds=MessageHub.MAX_AGE_SECONDS)
-        for message_type in self._message_queues.keys():
-            self._message_queues[message_type] = [
-                m for m in self._message_queues[message_type] if m.timestamp > timestamp_cutoff
-            ]
-
-    def got_message(self, message_type, window_seconds, return_name=None):
-        assert isinstance(message_type, MessageType)
-        assert message_type in self._message_queues
-
-        timestamp_cutoff = datetime.datetime.now() - datetime.timedelta(seconds=window_seconds)
-        messages_in_window = [
-            m for m in self._message_queues[message_type] if m.timestamp > timestamp_cutoff
-        ]
-        if return_name is None:
-            return len(messages_in_window) > 0
-        else:
-            assert message_type == MessageType.ENSURE_DISPLAY
-            for message in messages_in_window:
-                if message != "":
-                    kv = parse_ensure_display_value(message)
-                    if kv[0] == return_name:
-                        return True
-            return False
+# A dead master is replaced after INTERVAL * MISSES_BEFORE_DEAD seconds (15), at the cost of more COM messages
+# (3 instances send 36 heartbeats a minute, against 18 at 10s). See benchmarks/bench_failover.py.
+HEARTBEAT_INTERVAL = getattr(constants, "HEARTBEAT_INTERVAL", 5)
+HEARTBEAT_MISSES_BEFORE_DEAD = getattr(constants, "HEARTBEAT_MISSES_BEFORE_DEAD", 3)
+
+METRICS_HOST = getattr(constants, "METRICS_HOST", "127.0.0.1")
+METRICS_PORT = getattr(constants, "METRICS_PORT", 9108) # None disables the HTTP endpoint
+WATCHDOG_INTERVAL = getattr(constants, "WATCHDOG_INTERVAL", 0.1)
+WATCHDOG_THRESHOLD = getattr(constants, "WATCHDOG_THRESHOLD", 0.25) # seconds the loop can block before it's a stall
+WATCHDOG_ASYNCIO_DEBUG = getattr(constants, "WATCHDOG_ASYNCIO_DEBUG", False)
+
+LOG_SEGMENT_MAX_BYTES = getattr(constants, "LOG_SEGMENT_MAX_BYTES", 4 * 1024 * 1024)
+LOG_SEGMENT_MAX_AGE = getattr(constants, "LOG_SEGMENT_MAX_AGE", 24 * 60 * 60) # seconds
+LOG_MAX_SEGMENTS = getattr(constants, "LOG_MAX_SEGMENTS", 200) # oldest compressed segments are deleted past this
+LOG_EXCERPT_MINUTES = getattr(constants, "LOG_EXCERPT_MINUTES", 30) # default time span for get_logs
+LOG_QUEUE_SIZE = getattr(constants, "LOG_QUEUE_SIZE", 10000) # records waiting to be written, dropped past this
+# Logger name: (INFO records per second, burst). Warnings and errors are never limited.
+LOG_RATE_LIMITS = getattr(constants, "LOG_RATE_LIMITS", {
+    "com": (5, 50),
+    "display": (5, 50),
+    "lobbies": (5, 50),
+})
+
+# Route kind ("send", "edit", "delete", "fetch", "reaction"): (calls, per seconds), per channel
+DISCORD_ROUTE_LIMITS = getattr(constants, "DISCORD_ROUTE_LIMITS", DEFAULT_ROUTE_LIMITS)
+DISCORD_GLOBAL_LIMIT = getattr(constants, "DISCORD_GLOBAL_LIMIT", DEFAULT_GLOBAL_LIMIT)
+DISCORD_SHED_AFTER = getattr(constants, "DISCORD_SHED_AFTER", 10) # seconds a cosmetic call can wait before it's dropped
+
+# Low memory mode doesn't cache the guild's member list (members are fetched on demand, see _members),
+# and keeps fewer messages
+LOW_MEMORY_MODE = getattr(constants, "LOW_MEMORY_MODE", False)
+LOW_MEMORY_MESSAGE_CACHE_SIZE = getattr(constants, "LOW_MEMORY_MESSAGE_CACHE_SIZE", 100)
+MEMBER_LRU_SIZE = getattr(constants, "MEMBER_LRU_SIZE", 512)
+RANK_CACHE_TTL = getattr(constants, "RANK_CACHE_TTL", 600) # seconds, also refreshed by member updates and top role changes
+
+# New bnet lobbies mention the role of their server's region (see sub/unsub), at most once per interval for each role
+LOBBY_ROLE_PING_INTERVAL = getattr(constants, "LOBBY_ROLE_PING_INTERVAL", 5 * 60) # seconds
+
+TIMER_CATEGORY_CONNECT = "connect"
+TIMER_CATEGORY_OKIB_LIST = "okiblist"
+
+_startup = StartupTimer(_startup_begin)
+_startup.mark("imports")
 
 
 def create_client():
@@ -136,7 +121,13 @@ def create_client():
     client_intents.message_content = True
     client_intents.members = True
     client_intents.reactions = True
-    client = commands.Bot(command_prefix=COMMAND_CHARACTER, intents=client_intents)
+    cache_kwargs = {}
+    if LOW_MEMORY_MODE:
+        # The members intent stays on, for member objects in events and member updates
+        cache_kwargs["member_cache_flags"] = discord.MemberCacheFlags.none()
+        cache_kwargs["chunk_guilds_at_startup"] = False
+        cache_kwargs["max_messages"] = LOW_MEMORY_MESSAGE_CACHE_SIZE
+    client = commands.Bot(command_prefix=COMMAND_CHARACTER, intents=client_intents, **cache_kwargs)
     client.remove_command("help")
     return client
 
@@ -163,24 +154,50 @@ class DiscordObjs:
 # constants
 DB_FILE_PATH = os.path.join(ROOT_DIR, "IBCE_WARN.db")
 DB_ARCHIVE_PATH = os.path.join(ROOT_DIR, "archive", "IBCE_WARN.db")
+# Full snapshots requested after a DB sync payload fails to apply, before keeping the local DB as is
+DB_SYNC_RETRIES = 2
 CONSTANTS_PATH = os.path.join(ROOT_DIR, "constants.py")
-VERSION = get_source_version()
+RESOLVER_CACHE_PATH = os.path.join(ROOT_DIR, RESOLVER_CACHE_FILE_NAME)
+VERSION = get_source_version(ROOT_DIR)
+_startup.mark("git")
 print("Source version {}".format(VERSION))
 
+_resolver = DiscordResolver(RESOLVER_CACHE_PATH)
+_log_store = LogStore(LOGS_DIR, "v{}".format(VERSION), LOG_MAX_SEGMENTS)
+_log_rate_limit = RateLimitFilter(LOG_RATE_LIMITS)
+_log_queue_handler = None
+# Hot path loggers, rate limited separately
+_log_com = logging.getLogger("com")
+_log_display = logging.getLogger("display")
+_log_lobbies = logging.getLogger("lobbies")
+_metrics = MetricsRegistry()
+_metrics_server = MetricsServer(_metrics, METRICS_HOST, METRICS_PORT)
+_scheduler = DiscordScheduler(
+    DISCORD_ROUTE_LIMITS, DISCORD_GLOBAL_LIMIT, DISCORD_SHED_AFTER,
+    on_wait=lambda priority, seconds: _metrics.histogram("discord_queue_wait_seconds", priority=priority.name).observe(seconds)
+)
+_watchdog = LoopWatchdog(
+    WATCHDOG_THRESHOLD, WATCHDOG_INTERVAL, logging.getLogger("watchdog"),
+    on_lag=_metrics.histogram("event_loop_lag_seconds").observe
+)
+
+# warnings database
+_db = Database(DB_FILE_PATH)
+_db_sync_failures = 0
+_paginator = Paginator()
+
 # discord connection
 _discord_objs: DiscordObjs | None = None
+_members = MemberLRU(MEMBER_LRU_SIZE)
+_ranks = RankResolver(RANK_CACHE_TTL)
 _client: commands.Bot = create_client()
+instrument_http(_client.http, _scheduler)
 
 # communication
-_initialized = False
 _kv_entries = []
 _com_channel = None
-_im_master = False
-_alive_instances = set()
-_master_instance = None
-_callbacks = []
-_message_hub = MessageHub()
-_is_master_timeout = True
+_timers = TimerWheel()
+_node = FailoverNode(BOT_ID, VERSION, HEARTBEAT_INTERVAL, HEARTBEAT_MISSES_BEFORE_DEAD)
 
 # globals / workspace
 _open_lobbies = []
@@ -188,20 +205,6 @@ _ent_down_tries = 0
 _wc3stats_down_tries = 0
 
 
-class TimedCallback:
-    def __init__(self, t, func, *args, **kwargs):
-        self._timeout = t
-        self.callback = functools.partial(func, *args, **kwargs)
-        self._task = asyncio.ensure_future(self._job())
-
-    async def _job(self):
-        await asyncio.sleep(self._timeout)
-        await self.callback()
-
-    def cancel(self):
-        self._task.cancel()
-
-
 async def com(to_id, message_type, message = "", file = None):
     assert isinstance(to_id, int)
     assert isinstance(message_type, MessageType)
@@ -213,84 +216,85 @@ async def com(to_id, message_type, message = "", file = None):
         message_type.value,
         message
     ])
-    if file is None:
-        await _com_channel.send(payload)
-    else:
-        await _com_channel.send(payload, file=file)
-
-
-def archive_db():
-    archive_dir = os.path.dirname(DB_ARCHIVE_PATH)
-    if not os.path.exists(archive_dir):
-        os.mkdir(archive_dir)
+    _metrics.counter("com_messages_total", direction="out", type=message_type.name).inc()
+    # Never queued behind display calls: heartbeats and acknowledgements have to go out on time for failover
+    with unscheduled():
+        if file is None:
+            await _com_channel.send(payload)
+        else:
+            await _com_channel.send(payload, file=file)
 
-    if os.path.exists(DB_FILE_PATH):
-        os.replace(DB_FILE_PATH, DB_ARCHIVE_PATH)
 
-async def update_db(db_bytes):
-    archive_db()
-    with open(DB_FILE_PATH, "wb") as f:
-        f.write(db_bytes)
+async def update_db(payload):
+    try:
+        await _db.apply_sync_payload(DB_ARCHIVE_PATH, payload)
+    except Exception as e:
+        logging.error("Failed to apply DB sync payload, {}".format(e))
+        traceback.print_exc()
+        return False
+    return True
 
-async def send_db(to_id):
-    with open(DB_FILE_PATH, "rb") as f:
-        await com(to_id, MessageType.SEND_DB, "", discord.File(f))
+async def send_db(to_id, high_water_mark):
+    payload = await _db.make_sync_payload(high_water_mark)
+    await com(to_id, MessageType.SEND_DB, "", discord.File(io.BytesIO(payload), filename="dbsync.bin"))
 
-def update_workspace(workspace_bytes):
+async def update_workspace(workspace_bytes):
     global _open_lobbies
-    global _okib_channel
-    global _okib_message_id
-    global _list_content
-    global _okib_members
-    global _laterib_members
-    global _noib_members
-    global _gatherer
-    global _gathered
-    global _gather_time
 
     assert _discord_objs is not None
 
-    workspace_obj = pickle.loads(workspace_bytes)
-    logging.info("Updating workspace: {}".format(workspace_obj))
+    try:
+        workspace_obj = decode_workspace(workspace_bytes)
+    except ValueError as e:
+        logging.error("Failed to decode workspace: {}".format(e))
+        return False
+    logging.info("Updating workspace: %d lobbies, %d gathers", len(workspace_obj["open_lobbies"]), len(workspace_obj["gathers"]))
+    logging.debug("Workspace: %s", workspace_obj)
+
+    # Resolved up front, they may have to be fetched if the member list isn't cached
+    member_ids = []
+    for lobby_obj in workspace_obj["open_lobbies"]:
+        member_ids += lobby_obj["subscriber_ids"]
+    for gather_obj in workspace_obj["gathers"]:
+        member_ids += gather_obj["okib_member_ids"] + gather_obj["laterib_member_ids"] + gather_obj["noib_member_ids"]
+        if gather_obj["gatherer_id"] is not None:
+            member_ids.append(gather_obj["gatherer_id"])
+    members = await _members.fetch_many(_discord_objs.guild, member_ids)
 
     # Lobbies
-    _open_lobbies = workspace_obj["open_lobbies"]
+    _open_lobbies = []
+    for lobby_obj in workspace_obj["open_lobbies"]:
+        subscribers = [members.get(mid) for mid in lobby_obj["subscriber_ids"]]
+        if None in subscribers:
+            logging.warning("Failed to get a lobby subscriber from ID, {}".format(lobby_obj["subscriber_ids"]))
+            subscribers = [sub for sub in subscribers if sub is not None]
+        _open_lobbies.append(Lobby.from_workspace_dict(lobby_obj, subscribers))
     for key, value in workspace_obj["lobby_message_ids"].items():
         globals()[key] = value
 
     # OKIB
-    channel_id = workspace_obj["okib_channel_id"]
-    if channel_id != None:
-        _okib_channel = _client.get_channel(channel_id)
-        if _okib_channel == None:
-            logging.error("Failed to get OKIB channel from id {}".format(channel_id))
+    for gather in _gathers:
+        gather.list_updater.cancel()
+    _gathers.clear()
+    for gather_obj in workspace_obj["gathers"]:
+        channel = _client.get_channel(gather_obj["channel_id"])
+        if channel == None:
+            logging.error("Failed to get channel from id {}".format(gather_obj["channel_id"]))
             return False
 
-    _okib_message_id = workspace_obj["okib_message_id"]
-    _list_content = workspace_obj["list_content"]
-
-    _okib_members = [_discord_objs.guild.get_member(mid) for mid in workspace_obj["okib_member_ids"]]
-    if None in _okib_members:
-        logging.error("Failed to get an OKIB member from ID, {} from {}".format(_okib_members, workspace_obj["okib_member_ids"]))
-        return False
-    _laterib_members = [_discord_objs.guild.get_member(mid) for mid in workspace_obj["laterib_member_ids"]]
-    if None in _laterib_members:
-        logging.error("Failed to get a laterIB member from ID, {} from {}".format(_laterib_members, workspace_obj["laterib_member_ids"]))
-        return False
-    _noib_members = [_discord_objs.guild.get_member(mid) for mid in workspace_obj["noib_member_ids"]]
-    if None in _noib_members:
-        logging.error("Failed to get a member from ID, {} from {}".format(_noib_members, workspace_obj["noib_member_ids"]))
-        return False
-
-    gatherer_id = workspace_obj["gatherer_id"]
-    if gatherer_id != None:
-        _gatherer = _discord_objs.guild.get_member(gatherer_id)
-        if _gatherer == None:
-            logging.error("Failed to get member from id {}".format(gatherer_id))
+        gatherer = None
+        gatherer_id = gather_obj["gatherer_id"]
+        if gatherer_id != None:
+            gatherer = members.get(gatherer_id)
+            if gatherer == None:
+                logging.error("Failed to get member from id {}".format(gatherer_id))
+                return False
+
+        gather, missing_ids = Gather.from_workspace_dict(gather_obj, channel, gatherer, members.get)
+        if len(missing_ids) > 0:
+            logging.error("Failed to get OKIB members from IDs {}".format(missing_ids))
             return False
-
-    _gathered = workspace_obj["gathered"]
-    _gather_time = workspace_obj["gather_time"]
+        add_gather(gather)
     return True
 
 async def send_workspace(to_id):
@@ -299,36 +303,32 @@ async def send_workspace(to_id):
         if "lobbymsg" in key:
             lobby_message_ids[key] = value
 
-
     workspace_obj = {
         # Lobbies
-        "open_lobbies": _open_lobbies,
+        "open_lobbies": [lobby.to_workspace_dict() for lobby in _open_lobbies],
         "lobby_message_ids": lobby_message_ids,
 
         # OKIB
-        "okib_channel_id": None if _okib_channel == None else _okib_channel.id,
-        "okib_message_id": _okib_message_id,
-        "list_content": _list_content,
-        "okib_member_ids": [m.id for m in _okib_members],
-        "laterib_member_ids": [m.id for m in _laterib_members],
-        "noib_member_ids": [m.id for m in _noib_members],
-        "gatherer_id": None if _gatherer == None else _gatherer.id,
-        "gathered": _gathered,
-        "gather_time": _gather_time
+        "gathers": [gather.to_workspace_dict() for gather in _gathers],
     }
-    logging.info("Sending workspace: {}".format(workspace_obj))
+    logging.info("Sending workspace to %d: %d lobbies, %d gathers", to_id, len(workspace_obj["open_lobbies"]), len(workspace_obj["gathers"]))
+    logging.debug("Workspace: %s", workspace_obj)
 
-    workspace_bytes = io.BytesIO(pickle.dumps(workspace_obj))
+    workspace_bytes = io.BytesIO(encode_workspace(workspace_obj))
     await com(to_id, MessageType.SEND_WORKSPACE, "", discord.File(workspace_bytes))
 
 def update_source_and_reset():
+    # Imported here, gitpython is slow to import and only needed for updates
+    import git
+
     repo = git.Repo(ROOT_DIR)
     for remote in repo.remotes:
         if remote.name == "origin":
             logging.info("Pulling latest code from remote {}".format(remote))
             remote.pull()
 
-            new_version = get_source_version()
+            # Also caches the new version, so the next boot doesn't count commits
+            new_version = get_source_version(ROOT_DIR)
             logging.info("New version: {}".format(new_version))
             if new_version <= VERSION:
                 logging.error("Attempted to update, but version didn't upgrade ({} to {})".format(VERSION, new_version))
@@ -342,114 +342,65 @@ def reboot():
         logging.info("Exiting")
         exit()
 
-def parse_ensure_display_value(message):
-    kv = message.split("=")
-    value = None
-    if len(kv[1]) > 0:
-        data_type = kv[1][0]
-        value_str = kv[1][1:]
-        if data_type == "f":
-            value = float(value_str)
-        elif data_type == "i":
-            value = int(value_str)
-        elif data_type == "s":
-            value = value_str
-        else:
-            raise ValueError("Unhandled return type {}".format(data_type))
+async def parse_bot_com(from_id, message_type, message, attachment):
+    global _db_sync_failures
 
-    return (kv[0], value)
+    # The failover protocol's own messages are handled by _node, DB and workspace sync here
+    await apply_effects(_node.receive(from_id, message_type, message))
 
-async def parse_bot_com(from_id, message_type, message, attachment):
-    global _initialized
-    global _im_master
-    global _alive_instances
-    global _master_instance
-    global _callbacks
-    global _message_hub
-
-    if message_type == MessageType.CONNECT:
-        if _im_master:
-            await com(from_id, MessageType.CONNECT_ACK, str(VERSION) + "+")
-            # It is master's responsibility to send DB and workspace to synchronize newcomer
-            await send_db(from_id)
-            await send_workspace(from_id)
-        else:
-            await com(from_id, MessageType.CONNECT_ACK, str(VERSION))
-
-        version = int(message)
-        if version == VERSION:
-            _alive_instances.add(from_id)
-        elif version > VERSION:
-            _alive_instances.add(from_id)
-            logging.info("Bot instance {} running newer version {}, updating...".format(from_id, version))
-            update_source_and_reset()
-        else:
-            # TODO outdated version
-            pass
-        logging.info("After CONNECT message, instances {}".format(_alive_instances))
-    elif message_type == MessageType.CONNECT_ACK:
-        message_trim = message
-        if message[-1] == "+":
-            logging.info("Received connect ack from master instance {}".format(from_id))
-            message_trim = message[:-1]
-            _alive_instances.add(BOT_ID)
-            _master_instance = from_id
-            for callback in _callbacks: # clear init's self_promote callback
-                callback.cancel()
-            _callbacks = []
-        version = int(message_trim)
-        _alive_instances.add(from_id)
-        logging.info("After CONNECT_ACK message, instances {}, master {}".format(_alive_instances, _master_instance))
-    elif message_type == MessageType.LET_MASTER:
-        if _im_master:
-            logging.warning("I was unworthy :(")
-            _im_master = False
-        _master_instance = from_id
-    elif message_type == MessageType.ENSURE_DISPLAY:
-        for callback in _callbacks:
-            callback.cancel()
-        _callbacks = []
-        if message != "":
-            kv = parse_ensure_display_value(message)
-            globals()[kv[0]] = kv[1]
-        if from_id != _master_instance:
-            _alive_instances.remove(_master_instance)
-            _master_instance = from_id
-            logging.info("Master is now {}".format(from_id))
+    if message_type == MessageType.REQUEST_DB:
+        if _node.im_master:
+            await send_db(from_id, int(message))
     elif message_type == MessageType.SEND_DB:
-        db_bytes = await attachment.read()
-        await update_db(db_bytes)
-        await com(from_id, MessageType.SEND_DB_ACK)
-    elif message_type == MessageType.SEND_DB_ACK:
-        pass
+        payload = await attachment.read()
+        if await update_db(payload):
+            _db_sync_failures = 0
+            await com(from_id, MessageType.SEND_DB_ACK)
+        elif _db_sync_failures < DB_SYNC_RETRIES:
+            # Not acknowledged. A full snapshot (mark -1) doesn't depend on what our DB already has
+            _db_sync_failures += 1
+            logging.warning("Requesting a full DB snapshot from instance {}, retry {}/{}".format(from_id, _db_sync_failures, DB_SYNC_RETRIES))
+            await com(from_id, MessageType.REQUEST_DB, "-1")
+        else:
+            logging.error("DB sync from instance {} failed {} times, keeping the local DB".format(from_id, _db_sync_failures + 1))
+            _db_sync_failures = 0
     elif message_type == MessageType.SEND_WORKSPACE:
         workspace_bytes = await attachment.read()
-        if not update_workspace(workspace_bytes):
+        if not await update_workspace(workspace_bytes):
             pass # TODO eh, whatever...
         await com(from_id, MessageType.SEND_WORKSPACE_ACK)
         # This is the last step for bot instance connection
-        _initialized = True
-    elif message_type == MessageType.SEND_WORKSPACE_ACK:
-        pass
-    else:
-        raise Exception("Unhandled message type {}".format(message_type))
-
-    _message_hub.on_message(message_type, message)
-
-# Promotes this bot instance to master
-async def self_promote():
-    global _initialized
-    global _im_master
-    global _master_instance
+        _node.initialized = True
+
+# Carries out the work the failover protocol hands back, see failover.Effect
+async def apply_effects(effects):
+    for effect, *args in effects:
+        if effect == Effect.COM:
+            await com(*args)
+        elif effect == Effect.CONNECT_TIMER:
+            _timers.schedule(3, connect_timeout, category=TIMER_CATEGORY_CONNECT)
+        elif effect == Effect.CANCEL_CONNECT_TIMER:
+            _timers.cancel_category(TIMER_CATEGORY_CONNECT)
+        elif effect == Effect.SEND_WORKSPACE:
+            await send_workspace(args[0])
+        elif effect == Effect.REQUEST_DB:
+            await com(args[0], MessageType.REQUEST_DB, str(await _db.get_high_water_mark()))
+        elif effect == Effect.SET_RETURN_VALUE:
+            set_return_value(args[0], args[1])
+        elif effect == Effect.PERFORM:
+            action = args[0]
+            try:
+                await ensure_display(action.func, window=action.window, return_name=action.return_name, key=action.key)
+            except Exception as e:
+                logging.error("Failed to perform pending action: {}".format(e))
+                traceback.print_exc()
+        elif effect == Effect.UPDATE_SOURCE:
+            update_source_and_reset()
+        else:
+            raise Exception("Unhandled failover effect {}".format(effect))
 
-    _initialized = True
-    _im_master = True
-    _master_instance = BOT_ID
-    # Needed for initialization. Alternatively, can use function arg (what archi was doing)
-    if BOT_ID not in _alive_instances:
-        _alive_instances.add(BOT_ID)
-    await com(-1, MessageType.LET_MASTER)
-    logging.info("I'm in charge!")
+async def connect_timeout():
+    await apply_effects(_node.on_connect_timeout())
 
 # Wrapper around channel.send that only returns the int message ID
 async def send_message(channel, *args, **kwargs):
@@ -462,131 +413,103 @@ async def send_message_with_bell_reactions(channel, *args, **kwargs):
     await message.add_reaction(NOBELL_EMOJI)
     return message.id
 
-async def ensure_display_backup(func, *args, window=2, return_name=None, **kwargs):
-    global _master_instance
-    global _alive_instances
-    global _callbacks
-    global _is_master_timeout
-
-    logging.info("ensure_display_backup: _master_instance {}, _alive_instances {}".format(_master_instance, _alive_instances))
-
-    if _is_master_timeout:
-        if _master_instance == None:
-            _alive_instances.remove(max(_alive_instances))
-        else:
-            _alive_instances.remove(_master_instance)
-            _master_instance = None
-
-        if max(_alive_instances) == BOT_ID:
-            await self_promote()
-
-        _is_master_timeout = False
-        # All callbacks including this one now need to execute, but not resolve master's timeout
-        for callback in _callbacks:
-            callback.cancel()
-            await callback.callback()
-        _is_master_timeout = True
+def set_return_value(name, value):
+    # Gather list message IDs go to the gather registry, which indexes them for reactions
+    channel_id = Gather.parse_message_id_key(name)
+    if channel_id is not None:
+        if not _gathers.set_message_id(channel_id, value):
+            logging.warning("Got list message ID for unknown gather in channel {}".format(channel_id))
+    # Paged message IDs live in the paginator, and go away with its entries
+    elif is_page_message_key(name):
+        if not _paginator.set_message_id(name, value):
+            logging.warning("Got message ID for unknown paged message {}".format(name))
+    # New lobby messages return their ID followed by the roles they mention, see send_lobby_message
+    elif Lobby.parse_message_id_key(name) is not None and isinstance(value, list):
+        globals()[name] = value[0]
+        set_lobby_mention_role_ids(Lobby.parse_message_id_key(name), value[1:])
     else:
-        await ensure_display(func, *args, window=window, return_name=return_name, **kwargs)
+        globals()[name] = value
 
-async def ensure_display(func, *args, window=2, return_name=None, **kwargs):
-    global _callbacks
+async def ensure_display(func, *args, window=2, return_name=None, key=None, priority=Priority.COMMAND, coalesce_key=None, sheddable=False, **kwargs):
+    # key is a deterministic idempotency key (see action_key), so that no instance repeats an action already displayed.
+    # priority, coalesce_key and sheddable are passed to the scheduler, which the master's Discord calls go through.
+    if _node.is_displayed(key):
+        _log_display.info("Skipping already displayed action %s", key)
+        return
 
-    if _im_master:
-        result = await func(*args, **kwargs)
+    if _node.im_master:
+        start = time.perf_counter()
+        try:
+            with _metrics.histogram("discord_call_seconds", operation=getattr(func, "__qualname__", "unknown")).time():
+                result = await _scheduler.submit(
+                    functools.partial(func, *args, **kwargs), priority, get_route(func, args), coalesce_key, sheddable
+                )
+        except JobShed:
+            # Never displayed, so not acknowledged either
+            _log_display.info("Dropped shed action %s", key)
+            return
         message = ""
         if return_name is not None:
-            globals()[return_name] = result
-            message = return_name + "="
-            # TODO should we allow return_name to be set if result is None?
-            if result is not None:
-                if isinstance(result, float):
-                    message += "f"
-                elif isinstance(result, int):
-                    message += "i"
-                elif isinstance(result, str):
-                    message += "s"
-                else:
-                    raise ValueError("Unhandled return type {}".format(type(result)))
-                message += str(result)
+            set_return_value(return_name, result)
+            message = format_ensure_display_value(return_name, result)
 
-        await com(-1, MessageType.ENSURE_DISPLAY, message)
+        await apply_effects(_node.displayed(key, message))
+        # Includes the broadcast to other instances
+        _metrics.histogram("ensure_display_seconds").observe(time.perf_counter() - start)
     else:
-        # Only create a backup callback if no ENSURE_DISPLAY messages have been seen for the given
-        # timeout window. If a return_name is given, we require previous messages to have
-        # that return name as well.
-        if not _message_hub.got_message(MessageType.ENSURE_DISPLAY, window, return_name):
-            _callbacks.append(TimedCallback(window, ensure_display_backup, func, *args, window=window, return_name=return_name, **kwargs))
+        # Journaled until the master confirms it, and performed by the next master if it never does
+        _node.defer(functools.partial(func, *args, **kwargs), window, return_name, key)
 
 
 @_client.command()
 async def ping(ctx):
     if isinstance(ctx.channel, discord.channel.DMChannel):
         logging.info("pingpong")
-        await ensure_display(ctx.channel.send, "pong")
+        await ensure_display(ctx.channel.send, "pong", key=action_key("pong", ctx.message.id))
 
 
 @_client.command()
 async def update(ctx, bot_id):  # TODO default bot_id=None ??
-    global _master_instance
-    global _alive_instances
-
     bot_id = int(bot_id)
     if bot_id == BOT_ID:
         # No ensure_display here because this isn't a distributed action
         await ctx.channel.send("Updating code and restarting...")
         update_source_and_reset()
     else:
-        if bot_id in _alive_instances:
-            _alive_instances.remove(bot_id)
-        else:
-            logging.error("Updating instance not in alive instances: {}".format(_alive_instances))
+        await apply_effects(_node.forget(bot_id))
+
 
-        if _master_instance == bot_id:
-            _master_instance = None
-            if max(_alive_instances) == BOT_ID:
-                await self_promote()
+@_client.event
+async def on_connect():
+    _startup.mark("login")
 
 
 @_client.event
 async def on_ready():
     global _discord_objs
     global _com_channel
-    global _initialized
-    global _alive_instances
-    global _callbacks
-
-    guild_ib = None
-    guild_com = None
-    for guild in _client.guilds:
-        if guild.name == GUILD_NAME:
-            guild_ib = guild
-        if guild.id == COM_GUILD_ID:
-            guild_com = guild
 
+    _startup.mark("gateway")
+
+    guild_ib = _resolver.guild(_client, GUILD_NAME)
+    guild_com = _client.get_guild(COM_GUILD_ID)
     if guild_ib is None:
         raise Exception("IB guild not found: \"{}\"".format(GUILD_NAME))
     if guild_com is None:
         raise Exception("Com virtual guild not found")
 
-    channel_bnet = None
-    channel_ent = None
-    for channel in guild_ib.text_channels:
-        if channel.name == BNET_CHANNEL_NAME:
-            channel_bnet = channel
-        if channel.name == ENT_CHANNEL_NAME:
-            channel_ent = channel
+    channel_bnet = _resolver.text_channel(guild_ib, BNET_CHANNEL_NAME)
+    channel_ent = _resolver.text_channel(guild_ib, ENT_CHANNEL_NAME)
     if channel_bnet is None:
         raise Exception("Pub channel not found: \"{}\" in guild \"{}\"".format(BNET_CHANNEL_NAME, guild_ib.name))
     if channel_ent is None:
         raise Exception("ENT channel not found: \"{}\" in guild \"{}\"".format(ENT_CHANNEL_NAME, guild_ib.name))
 
-    channel_com = None
-    for channel in guild_com.text_channels:
-        if channel.id == COM_CHANNEL_ID:
-            channel_com = channel
+    channel_com = guild_com.get_channel(COM_CHANNEL_ID)
     if channel_com is None:
         raise Exception("Com channel not found")
+    _resolver.save()
+    logging.info("Resolved Discord objects, {} cached, {} scanned".format(_resolver.hits, _resolver.misses))
 
     _discord_objs = DiscordObjs(
         guild_ib, channel_bnet, channel_ent,
@@ -601,16 +524,71 @@ async def on_ready():
         emoji_noib=guild_ib.get_emoji(NOIB_EMOJI_ID),
     )
     replays_load_emojis(guild_ib.emojis)
+    _ranks.set_roles({Rank.PEON: _discord_objs.role_ent_ready, Rank.SHAMAN: _discord_objs.role_shaman})
 
     logging.info("Bot \"{}\" connected to Discord on guild \"{}\", pub channel \"{}\"".format(_client.user, guild_ib.name, channel_bnet.name))
     await _client.change_presence(activity=None)
     _com_channel = channel_com
 
-    logging.info("Connecting to bot network...")
-    await com(-1, MessageType.CONNECT, str(VERSION))
-    _callbacks.append(TimedCallback(3, self_promote))
+    await _db.open()
 
-    refresh_ib_lobbies.start()
+    logging.info("Connecting to bot network...")
+    await apply_effects(_node.connect())
+
+    # on_ready runs again after reconnects, when the loops are already running
+    if not refresh_ib_lobbies.is_running():
+        refresh_ib_lobbies.start()
+    if not heartbeat.is_running():
+        heartbeat.start()
+    if not _watchdog.is_running():
+        _watchdog.start(debug=WATCHDOG_ASYNCIO_DEBUG)
+    if METRICS_PORT is not None and not _metrics_server.is_running():
+        try:
+            await _metrics_server.start()
+        except OSError as e:
+            logging.error("Failed to start metrics server on port {}: {}".format(METRICS_PORT, e))
+
+    if not _startup.has_phase("on_ready"):
+        _startup.mark("on_ready")
+        logging.info(_startup.report())
+
+
+@tasks.loop(seconds=HEARTBEAT_INTERVAL)
+async def heartbeat():
+    await apply_effects(_node.heartbeat())
+    logging.debug("Timers: %s", _timers.stats())
+
+
+def collect_gauges(metrics):
+    timer_stats = _timers.stats()
+    metrics.gauge("timers_pending").set(timer_stats["pending"])
+    metrics.gauge("timers_max_lag_seconds").set(timer_stats["max_lag"])
+    metrics.gauge("asyncio_tasks").set(timer_stats["tasks"])
+    metrics.gauge("open_lobbies").set(len(_open_lobbies))
+    metrics.gauge("active_gathers").set(len(_gathers.active()))
+    metrics.gauge("alive_instances").set(len(_node.alive_instances))
+    metrics.gauge("event_loop_stalls").set(_watchdog.num_stalls)
+    metrics.gauge("process_rss_bytes").set(read_rss_bytes())
+    for cache, size in cache_sizes(_client, _members).items():
+        metrics.gauge("discord_cache_objects", cache=cache).set(size)
+    metrics.gauge("member_fetches").set(_members.fetches)
+    metrics.gauge("rank_cache_hits").set(_ranks.hits)
+    metrics.gauge("rank_cache_misses").set(_ranks.misses)
+    metrics.gauge("lobby_role_pings", result="sent").set(_role_pings.num_pinged)
+    metrics.gauge("lobby_role_pings", result="suppressed").set(_role_pings.num_suppressed)
+    for priority, count in _scheduler.queued_by_priority().items():
+        metrics.gauge("discord_calls_queued", priority=priority.name).set(count)
+    metrics.gauge("discord_calls_immediate").set(_scheduler.num_immediate)
+    metrics.gauge("discord_calls_delayed").set(_scheduler.num_queued)
+    metrics.gauge("discord_calls_coalesced").set(_scheduler.num_coalesced)
+    metrics.gauge("discord_calls_shed").set(_scheduler.num_shed)
+    metrics.gauge("discord_requests", scheduled="yes").set(_scheduler.num_calls - _scheduler.num_unscheduled_calls)
+    metrics.gauge("discord_requests", scheduled="no").set(_scheduler.num_unscheduled_calls)
+    metrics.gauge("log_records_dropped", reason="rate_limit").set(_log_rate_limit.num_dropped)
+    if _log_queue_handler is not None:
+        metrics.gauge("log_records_dropped", reason="queue_full").set(_log_queue_handler.num_dropped)
+
+_metrics.add_collector(collect_gauges)
 
 
 @_client.event
@@ -628,13 +606,18 @@ async def on_message(message):
         content = message_split[3]
         if from_id != BOT_ID and (to_id == -1 or to_id == BOT_ID):
             # from another bot instance
-            logging.info("Communication received from {} to {}, {}, content = {}".format(from_id, to_id, message_type, content))
+            _log_com.info(
+                "Communication received from %d to %d, %s, content = %s", from_id, to_id, message_type.name, content,
+                extra={"from_id": from_id, "to_id": to_id, "type": message_type.name}
+            )
 
+            _metrics.counter("com_messages_total", direction="in", type=message_type.name).inc()
             attachment = None
             if message.attachments:
                 attachment = message.attachments[0]
             await parse_bot_com(from_id, message_type, content, attachment)
     else:
+        _members.touch(message.author)
         await check_replay(message)
         await _client.process_commands(message)
 
@@ -652,309 +635,233 @@ OKIB_EMOJI_STRING = "<:okib:{}>".format(OKIB_EMOJI_ID)
 NOIB_EMOJI_STRING = "<:noib:{}>".format(NOIB_EMOJI_ID)
 OKIB_GATHER_EMOJI_STRING = "<:ib:{}><:ib2:{}>".format(IB_EMOJI_ID, IB2_EMOJI_ID)
 OKIB_GATHER_PLAYERS = 8 # not pointless - sometimes I use this for testing
+OKIB_LIST_UPDATE_WINDOW = 1.0
+
+_gathers = GatherRegistry()
+_dm_fanout = DmFanout()
 
-_okib_channel =  None
-_okib_message_id = None
-_list_content = ""
-_okib_members = []
-_laterib_members = []
-_noib_members = []
-_gatherer = None
-_gathered = False
-_gather_time = datetime.datetime.now()
-
-
-async def gather():
-    gather_list_string = " ".join([member.mention for member in _okib_members])
-    await _okib_channel.send(gather_list_string + " Time to play !")
-    await _okib_channel.send(OKIB_EMOJI_STRING)
-    for member in _okib_members:
-        try:
-            await member.send("Time to play !")
-        except Exception as e:
-            #Should be an logging.error there but since this might happen quite frequently i dont want it to show as "abnormal"
-            logging.warning("Error sending DM to {}, {}".format(member.name, e))
-            traceback.print_exc()
 
+async def deny_no_power(ctx):
+    await ensure_display(ctx.channel.send, NO_POWER_MSG, key=action_key("nopower", ctx.message.id))
 
-async def combinator3000(*args):
-    for f in args:
-        await f()
 
+async def announce_gather(gather):
+    okib_members = gather.state.members(MemberState.OKIB)
+    gather_list_string = " ".join([member.mention for member in okib_members])
+    await ActionGraph().add(
+        "ping", functools.partial(gather.channel.send, gather_list_string + " Time to play !")
+    ).add(
+        "emoji", functools.partial(gather.channel.send, OKIB_EMOJI_STRING), after=["ping"]
+    ).add(
+        "dms", functools.partial(_dm_fanout.send, okib_members, "Time to play !", description="Gather DM")
+    ).run()
 
-async def list_update():
-    global _list_content
 
-    okib_list_string = ", ".join([member.display_name for member in _okib_members])
-    noib_list_string = ", ".join([member.display_name for member in _noib_members])
-    _list_content = "{} asks : {}\n{} {}/{} : {}\n{} : {}".format(
-        _gatherer.display_name, OKIB_GATHER_EMOJI_STRING,
-        OKIB_EMOJI_STRING, len(_okib_members), OKIB_GATHER_PLAYERS, okib_list_string,
-        NOIB_EMOJI_STRING, noib_list_string
+async def delete_message(channel, message_id):
+    message = await channel.fetch_message(message_id)
+    await message.delete()
+
+
+async def edit_okib_list(gather):
+    if not gather.active or gather.message_id is None:
+        return
+    message = await gather.channel.fetch_message(gather.message_id)
+    await message.edit(content=gather.list_content)
+
+
+async def flush_okib_list(gather):
+    await ensure_display(edit_okib_list, gather, priority=Priority.GATHER, coalesce_key=gather.get_message_id_key())
+
+
+def add_gather(gather):
+    gather.list_updater = Debouncer(
+        _timers, OKIB_LIST_UPDATE_WINDOW, functools.partial(flush_okib_list, gather), category=TIMER_CATEGORY_OKIB_LIST
     )
+    return _gathers.add(gather)
 
 
-async def check_almost_gather():
-    #print(len(_okib_members)+round(0.1+len(_laterib_members)/2))
-    if len(_okib_members)+round(0.1+len(_laterib_members)/2) >= OKIB_GATHER_PLAYERS and not _gathered:
-        for member in _laterib_members:
-            try:
-                await member.send("Hey, you are :laterib: and our radar indicates that the lobby gather is almost completed !! \nThis might be a great time for you to think about :okib: ;)")
-            except Exception as e:
-                #Should be an logging.error there but since this might happen quite frequently i dont want it to show as "abnormal"
-                logging.warning("Error sending DM to {}, {}".format(member.name, e))
-                traceback.print_exc()
+def get_or_create_gather(channel):
+    gather = _gathers.get(channel.id)
+    if gather is None:
+        gather = add_gather(Gather(channel))
+    return gather
 
 
-def gather_check():
-    global _gathered
-    if len(_okib_members) >= OKIB_GATHER_PLAYERS and not _gathered:
-        return True
-    if len(_okib_members) < OKIB_GATHER_PLAYERS and _gathered:
-        _gathered = False
-        return False
+def list_update(gather):
+    gather.update_list(OKIB_GATHER_EMOJI_STRING, OKIB_EMOJI_STRING, NOIB_EMOJI_STRING, OKIB_GATHER_PLAYERS)
+
 
+async def check_almost_gather(gather):
+    num_okib = gather.state.count(MemberState.OKIB)
+    num_laterib = gather.state.count(MemberState.LATERIB)
+    if num_okib + round(0.1 + num_laterib / 2) >= OKIB_GATHER_PLAYERS and not gather.gathered:
+        await _dm_fanout.send(
+            gather.state.members(MemberState.LATERIB),
+            "Hey, you are :laterib: and our radar indicates that the lobby gather is almost completed !! \nThis might be a great time for you to think about :okib: ;)",
+            description="Almost gather DM"
+        )
 
-async def up(ctx):
-    global _okib_message_id
 
-    if _okib_message_id is not None:
-        message = await _okib_channel.fetch_message(_okib_message_id)
-        await message.delete()
+async def up(ctx, gather):
+    graph = ActionGraph()
+    if gather.message_id is not None:
+        graph.add("deleteold", functools.partial(delete_message, gather.channel, gather.message_id))
+    graph.add("send", functools.partial(ctx.send, gather.list_content))
+    # Reactions are chained so they always show up in the same order
+    graph.add("okib", lambda: graph.results["send"].add_reaction(_discord_objs.emoji_okib), after=["send"])
+    graph.add("laterib", lambda: graph.results["send"].add_reaction(_discord_objs.emoji_laterib), after=["okib"])
+    graph.add("noib", lambda: graph.results["send"].add_reaction(_discord_objs.emoji_noib), after=["laterib"])
+    graph.add("deletecommand", ctx.message.delete)
+    results = await graph.run()
 
-    okib_message = await ctx.send(_list_content)
-    await okib_message.add_reaction(_discord_objs.emoji_okib)
-    await okib_message.add_reaction(_discord_objs.emoji_laterib)
-    await okib_message.add_reaction(_discord_objs.emoji_noib)
-    await ctx.message.delete()
-    _okib_message_id = okib_message.id
-    return _okib_message_id
+    # Stored in the gather registry through ensure_display's return_name
+    return results["send"].id
 
 
 @_client.command()
 async def okib(ctx, arg=None):
-    global _okib_channel
-    global _okib_message_id
-    global _okib_members
-    global _laterib_members
-    global _noib_members
-    global _gatherer
-    global _gathered
-    global _gather_time
-
     assert _discord_objs is not None
 
+    gather = _gathers.get(ctx.channel.id)
+    gatherer = None if gather is None else gather.gatherer
+
     adv = False
     #PUB OKIB
     if ctx.channel == _discord_objs.channel_bnet:
-        if ctx.message.author.roles[-1] < _discord_objs.role_ent_ready:
-            await ensure_display(ctx.channel.send, NO_POWER_MSG)
+        if not _ranks.at_least(ctx.message.author, Rank.PEON):
+            await deny_no_power(ctx)
             return
     #/PUB OKIB
-    elif ctx.message.author.roles[-1] < _discord_objs.role_ent_ready:
-        await ensure_display(ctx.channel.send, NO_POWER_MSG)
+    elif not _ranks.at_least(ctx.message.author, Rank.PEON):
+        await deny_no_power(ctx)
         return
-    if ctx.message.author.roles[-1] >= _discord_objs.role_shaman or ctx.message.author == _gatherer:
+    if _ranks.at_least(ctx.message.author, Rank.SHAMAN) or ctx.message.author == gatherer:
         adv = True
     if adv == False and arg != None:
-        await ensure_display(ctx.channel.send, NO_POWER_MSG)
-        return
-
-    if  _okib_channel is not None and _okib_channel != ctx.channel:
-        await ensure_display(ctx.channel.send, "gathering is already in progress in channel " + _okib_channel.mention)
+        await deny_no_power(ctx)
         return
 
+    gather = get_or_create_gather(ctx.channel)
     modify = False
     for user in ctx.message.mentions:
-        if user not in _okib_members:
-            _okib_members.append(user)
-            modify = True
-        if user in _noib_members:
-            _noib_members.remove(user)
+        if gather.state.set(user, MemberState.OKIB):
             modify = True
-        if user in _laterib_members:
-            _laterib_members.remove(user)
-
-    if _okib_channel is None:
-        _gatherer = ctx.message.author
-        _gather_time = datetime.datetime.now()
-        # Check for option
-        if adv and arg == 'retrieve':
-            pass
-        else:
-            _gathered = False
-            _okib_members = []
-            _laterib_members = []
-            _noib_members = []
-            for user in ctx.message.mentions:
-                if user not in _okib_members:
-                    _okib_members.append(user)
-                if user in _noib_members:
-                    _noib_members.remove(user)
-                if user in _laterib_members:
-                    _laterib_members.remove(user)
-
-        _okib_channel = ctx.channel
-        await list_update()
-        await ensure_display(up, ctx, return_name="_okib_message_id")
+
+    if not gather.active:
+        gather.start(ctx.message.author, ctx.message.mentions, retrieve=(adv and arg == 'retrieve'))
+        list_update(gather)
+        await ensure_display(up, ctx, gather, return_name=gather.get_message_id_key(), key=action_key("up", ctx.message.id), priority=Priority.GATHER)
         modify = False
     elif arg == None:
-        await ensure_display(up, ctx, return_name="_okib_message_id")
+        await ensure_display(up, ctx, gather, return_name=gather.get_message_id_key(), key=action_key("up", ctx.message.id), priority=Priority.GATHER)
 
     if arg == 'retrieve':
-        await list_update()
-        gather_check()
-        if _gathered:
-            await ensure_display(up, ctx, return_name="_okib_message_id")
+        list_update(gather)
+        gather.check_gathered(OKIB_GATHER_PLAYERS)
+        if gather.gathered:
+            await ensure_display(up, ctx, gather, return_name=gather.get_message_id_key(), key=action_key("upretrieve", ctx.message.id), priority=Priority.GATHER)
     elif modify:
-        await list_update()
-        if gather_check():
-            await ensure_display(functools.partial(
-                combinator3000,
-                ctx.message.delete,
-                functools.partial(
-                    (await _okib_channel.fetch_message(_okib_message_id)).edit,
-                    content=_list_content),
-                gather
-            ))
-            _gathered = True
+        list_update(gather)
+        if gather.check_gathered(OKIB_GATHER_PLAYERS):
+            gather.gathered = True
+            await ensure_display(ActionGraph().add(
+                "deletecommand", ctx.message.delete
+            ).add(
+                "edit", functools.partial(edit_okib_list, gather)
+            ).add(
+                "gather", functools.partial(announce_gather, gather)
+            ).run, key=action_key("okibgather", ctx.message.id), priority=Priority.GATHER)
         else:
-            await ensure_display(functools.partial(
-                combinator3000,
-                ctx.message.delete,
-                check_almost_gather,
-                functools.partial(
-                    (await _okib_channel.fetch_message(_okib_message_id)).edit,
-                    content=_list_content
-                )
-            ))
+            await ensure_display(ActionGraph().add(
+                "deletecommand", ctx.message.delete
+            ).add(
+                "almostgather", functools.partial(check_almost_gather, gather)
+            ).add(
+                "edit", functools.partial(edit_okib_list, gather)
+            ).run, key=action_key("okibedit", ctx.message.id), priority=Priority.GATHER)
 
 
 @_client.command()
 async def noib(ctx):
-    global _okib_members
-    global _laterib_members
-    global _noib_members
-    global _okib_channel
-    global _okib_message_id
-
     assert _discord_objs is not None
 
+    gather = _gathers.get(ctx.channel.id)
+
     #PUB OKIB
-    if ctx.channel == _discord_objs.channel_bnet and ctx.message.author.roles[-1] >= _discord_objs.role_ent_ready:
+    if ctx.channel == _discord_objs.channel_bnet and _ranks.at_least(ctx.message.author, Rank.PEON):
         pass
     #/PUB OKIB
-    elif ctx.message.author.roles[-1] < _discord_objs.role_ent_ready:
-        await ensure_display(ctx.channel.send, NO_POWER_MSG)
+    elif not _ranks.at_least(ctx.message.author, Rank.PEON):
+        await deny_no_power(ctx)
+        return
+    if gather is None:
         return
-    if ctx.message.author.roles[-1] < _discord_objs.role_shaman and ctx.message.author != _gatherer:
-        if datetime.datetime.now() < (_gather_time + datetime.timedelta(hours=2)):
-            await ensure_display(ctx.channel.send, NO_POWER_MSG)
+    if not _ranks.at_least(ctx.message.author, Rank.SHAMAN) and ctx.message.author != gather.gatherer:
+        if datetime.datetime.now() < (gather.time + datetime.timedelta(hours=2)):
+            await deny_no_power(ctx)
             return
         pass
 
     if not ctx.message.mentions:
-        if _okib_message_id is not None:
-            await ensure_display(functools.partial(
-                combinator3000,
-                ctx.message.delete,
-                (await _okib_channel.fetch_message(_okib_message_id)).delete
-            ))
-        _okib_message_id = None
-        _okib_channel = None
+        if gather.message_id is not None:
+            await ensure_display(ActionGraph().add(
+                "deletecommand", ctx.message.delete
+            ).add(
+                "deletelist", functools.partial(delete_message, gather.channel, gather.message_id)
+            ).run, key=action_key("noibclose", ctx.message.id), priority=Priority.GATHER)
+        _gathers.set_message_id(gather.channel_id, None)
+        gather.active = False
+        gather.list_updater.cancel()
 
     modify = False
     for user in ctx.message.mentions:
-        if user not in _noib_members:
-            _noib_members.append(user)
+        if gather.state.set(user, MemberState.NOIB):
             modify = True
-        if user in _okib_members:
-            _okib_members.remove(user)
-            modify = True
-        if user in _laterib_members:
-            _laterib_members.remove(user)
 
     if modify:
-        await list_update()
-        gather_check()
-        await ensure_display(functools.partial(
-            combinator3000,
-            ctx.message.delete,
-            functools.partial(
-                (await _okib_channel.fetch_message(_okib_message_id)).edit,
-                content=_list_content)
-        ))
+        list_update(gather)
+        gather.check_gathered(OKIB_GATHER_PLAYERS)
+        await ensure_display(ActionGraph().add(
+            "deletecommand", ctx.message.delete
+        ).add(
+            "edit", functools.partial(edit_okib_list, gather)
+        ).run, key=action_key("noibedit", ctx.message.id), priority=Priority.GATHER)
 
 
 async def okib_on_reaction_add(channel_id, message_id, emoji, member):
-    global _okib_members
-    global _laterib_members
-    global _noib_members
-    global _gathered
-
-    if message_id == _okib_message_id and member.bot == False:
+    gather = _gathers.find_by_message(message_id)
+    if gather is not None and member.bot == False:
         modify = False
-        if member.roles[-1] >= _discord_objs.role_ent_ready or _okib_channel == _discord_objs.channel_bnet:
+        if gather.channel == _discord_objs.channel_bnet or _ranks.at_least(member, Rank.PEON):
             try:
                 if emoji == _discord_objs.emoji_okib:
-                    if member not in _okib_members:
-                        _okib_members.append(member)
-                        modify = True
-                    if member in _noib_members:
-                        _noib_members.remove(member)
-                        modify = True
-                    if member in _laterib_members:
-                        _laterib_members.remove(member)
-
+                    modify = gather.state.set(member, MemberState.OKIB)
                 elif emoji == _discord_objs.emoji_noib:
-                    if member not in _noib_members:
-                        _noib_members.append(member)
-                        modify = True
-                    if member in _okib_members:
-                        _okib_members.remove(member)
-                        modify = True
-                    if member in _laterib_members:
-                        _laterib_members.remove(member)
+                    modify = gather.state.set(member, MemberState.NOIB)
                 elif emoji == _discord_objs.emoji_laterib:
-                    if member not in _laterib_members:
-                        _laterib_members.append(member)
-                    if member in _noib_members:
-                        _noib_members.remove(member)
-                        modify = True
-                    if member in _okib_members:
-                        _okib_members.remove(member)
-                        modify = True
+                    modify = gather.state.set(member, MemberState.LATERIB)
             except AttributeError as e:
                 traceback.print_exc()
                 pass
 
             if modify:
-                await list_update()
-                #remove&edit
-                if gather_check():
-                    await ensure_display(functools.partial(
-                        combinator3000,
-                        gather,
-                        functools.partial(
-                            (await _okib_channel.fetch_message(_okib_message_id)).edit,
-                            content=_list_content
-                        ),
-                        functools.partial(remove_reaction, channel_id, message_id, emoji, member)
-                    ))
-                    _gathered = True
+                list_update(gather)
+                # Membership is already up to date in memory. The list message edit is coalesced with other
+                # reactions in the same window, and this reaction's removal doesn't wait for it.
+                gather.list_updater.request()
+                remove_task = asyncio.ensure_future(
+                    ensure_display(remove_reaction, channel_id, message_id, emoji, member, priority=Priority.GATHER)
+                )
+                if gather.check_gathered(OKIB_GATHER_PLAYERS):
+                    # Set before awaiting, so concurrent reactions can't trigger a second gather
+                    gather.gathered = True
+                    await ensure_display(announce_gather, gather, priority=Priority.GATHER)
                 else:
-                    await ensure_display(functools.partial(
-                        combinator3000,
-                        functools.partial(
-                            (await _okib_channel.fetch_message(_okib_message_id)).edit,
-                            content=_list_content
-                        ),
-                        functools.partial(remove_reaction, channel_id, message_id, emoji, member),
-                        check_almost_gather
-                    ))
+                    await ensure_display(check_almost_gather, gather, priority=Priority.GATHER)
+                await remove_task
                 return
         #justremove
-        await ensure_display(remove_reaction, channel_id, message_id, emoji, member)
+        await ensure_display(remove_reaction, channel_id, message_id, emoji, member, priority=Priority.GATHER)
 
 
 # async def pub_host_promote(member):
@@ -1009,45 +916,73 @@ async def okib_on_reaction_add(channel_id, message_id, emoji, member):
 #                 await shaman_promote(after)
 
 
-def nonquery(query):
-    conn = sqlite3.connect(DB_FILE_PATH)
-    cursor = conn.cursor()
-    cursor.execute(query)
-    conn.commit()
-    conn.close()
-
-
 @_client.command()
+@requires_rank(_ranks, Rank.SHAMAN, on_denied=deny_no_power)
 async def warn(ctx, arg1, *, arg2=""):
-    if ctx.message.author.roles[-1] < _discord_objs.role_shaman:
-        await ensure_display(ctx.channel.send, NO_POWER_MSG)
-        return
-
+    now = datetime.datetime.now()
+    await _db.add_warnings([
+        (user.id, arg2, now, ctx.message.author.display_name) for user in ctx.message.mentions
+    ])
     for user in ctx.message.mentions:
-        sqlquery = "INSERT INTO Events (Event_type,Player_id,Reason,Datetime,Warner) VALUES (666,{},\"{}\",\"{}\",\"{}\")".format(user.id, arg2, datetime.datetime.now(), ctx.message.author.display_name)
-        nonquery(sqlquery)
-        await ensure_display(ctx.channel.send, "User <@!{}> has been warned !".format(user.id))
+        await ensure_display(ctx.channel.send, "User <@!{}> has been warned !".format(user.id), key=action_key("warned", ctx.message.id, user.id))
 
 
 @_client.command()
+@requires_rank(_ranks, Rank.PEON, on_denied=deny_no_power)
 async def pedigree(ctx):
-    if ctx.message.author.roles[-1] < _discord_objs.role_ent_ready:
-        await ensure_display(ctx.channel.send, NO_POWER_MSG)
+    lines = []
+    for user in ctx.message.mentions:
+        rows = await _db.get_warnings(user.id)
+        if len(rows) == 0:
+            lines.append("User <@!{}> has never been warned yet !".format(user.id))
+            continue
+        lines.append("User <@!{}> has been warned {} times:".format(user.id, len(rows)))
+        for row in rows:
+            lines.append("{} => warned by {} for the following reason: {}".format(format_event_datetime(row[2]), row[3], row[1]))
+    if len(lines) == 0:
         return
 
-    conn = sqlite3.connect(DB_FILE_PATH)
-    cursor = conn.cursor()
-    for user in ctx.message.mentions:
-        sqlquery = "SELECT player_id,Reason,Datetime,Warner FROM Events WHERE Event_type = 666 AND Player_id = " + str(user.id)
-        cursor.execute(sqlquery)
-        row = cursor.fetchone()
-        if row is None:
-            await ensure_display(ctx.channel.send, "User <@!{}> has never been warned yet !".format(user.id))
-        else:
-            while row:
-                await ensure_display(ctx.channel.send, "{} => User <@!{}> has been warned by {} for the following reason:\n{}".format(row[2], row[0], row[3], row[1]))
-                row = cursor.fetchone()
-    conn.close()
+    # All results go in a single paged embed, turning pages is served from the cache
+    paged = PagedMessage("Pedigree", paginate_lines(lines), page_message_key(ctx.message.id))
+    _paginator.add(paged)
+    await ensure_display(send_paged_message, ctx.channel, paged, return_name=paged.message_key, key=action_key("pedigree", ctx.message.id))
+
+
+async def send_paged_message(channel, paged):
+    message = await channel.send(embed=paged.to_embed())
+    if len(paged.pages) > 1:
+        await message.add_reaction(PREV_PAGE_EMOJI)
+        await message.add_reaction(NEXT_PAGE_EMOJI)
+    return message.id
+
+
+# Every instance answers with its own numbers, so reports don't go through ensure_display
+async def send_instance_report(ctx, paged):
+    _paginator.add(paged)
+    _paginator.set_message_id(paged.message_key, await send_paged_message(ctx.channel, paged))
+
+
+async def edit_paged_message(channel_id, message_id, embed):
+    channel = _client.get_channel(channel_id)
+    message = await channel.fetch_message(message_id)
+    await message.edit(embed=embed)
+
+
+async def pages_on_reaction_add(channel_id, message_id, emoji, member):
+    if member.bot or not emoji.is_unicode_emoji() or (emoji.name != PREV_PAGE_EMOJI and emoji.name != NEXT_PAGE_EMOJI):
+        return
+
+    paged = _paginator.find(message_id)
+    if paged is None:
+        return
+    if paged.local:
+        if paged.turn(emoji.name):
+            await edit_paged_message(channel_id, message_id, paged.to_embed())
+        await remove_reaction(channel_id, message_id, emoji, member)
+        return
+    if paged.turn(emoji.name):
+        await ensure_display(edit_paged_message, channel_id, message_id, paged.to_embed())
+    await ensure_display(remove_reaction, channel_id, message_id, emoji, member)
 
 
 # ==== MISC ========================================================================================
@@ -1066,13 +1001,14 @@ async def check_replay(message):
     timeout = aiohttp.ClientTimeout(total=ENSURE_DISPLAY_WINDOW)
     async with aiohttp.ClientSession(timeout=timeout) as session:
         logging.info("Uploading replay {}".format(att.filename))
-        response = await session.post("https://api.wc3stats.com/upload", data={
-            "file": replay
-        })
+        with _metrics.histogram("replay_upload_seconds").time():
+            response = await session.post("https://api.wc3stats.com/upload", data={
+                "file": replay
+            })
         if response.status != 200:
             logging.error("Replay upload failed")
             logging.error(await response.text())
-            await ensure_display(message.channel.send, "Failed to upload replay `{}` with status `{}`".format(att.filename, response.status), window=ENSURE_DISPLAY_WINDOW)
+            await ensure_display(message.channel.send, "Failed to upload replay `{}` with status `{}`".format(att.filename, response.status), window=ENSURE_DISPLAY_WINDOW, key=action_key("replay", message.id))
             return
 
         response_json = await response.json()
@@ -1083,17 +1019,17 @@ async def check_replay(message):
         except Exception as e:
             logging.error("Failed to parse replay data, id {}".format(replay_id))
             traceback.print_exc()
-            await ensure_display(message.channel.send, content=fallback_message, embed=None, window=ENSURE_DISPLAY_WINDOW)
+            await ensure_display(message.channel.send, content=fallback_message, embed=None, window=ENSURE_DISPLAY_WINDOW, key=action_key("replay", message.id))
             return
 
         content = "Uploaded replay `{}`:".format(att.filename)
         embed = replay_data.to_discord_embed()
-        await ensure_display(message.channel.send, content=content, embed=embed, window=ENSURE_DISPLAY_WINDOW)
+        await ensure_display(message.channel.send, content=content, embed=embed, window=ENSURE_DISPLAY_WINDOW, key=action_key("replay", message.id))
 
 
 @_client.command()
 async def unsub(ctx, arg1=None):
-    await ensure_display(functools.partial(unsub2, ctx, arg1))
+    await ensure_display(functools.partial(unsub2, ctx, arg1), key=action_key("unsub", ctx.message.id))
 
 
 async def unsub2(ctx,arg1):
@@ -1110,7 +1046,7 @@ async def unsub2(ctx,arg1):
 
 @_client.command()
 async def sub(ctx, arg1=None):
-    await ensure_display(functools.partial(sub2, ctx, arg1))
+    await ensure_display(functools.partial(sub2, ctx, arg1), key=action_key("sub", ctx.message.id))
 
 
 async def sub2(ctx, arg1):
@@ -1126,89 +1062,98 @@ async def sub2(ctx, arg1):
 
 
 @_client.command()
+@requires_rank(_ranks, Rank.SHAMAN)
 async def update_constants(ctx):
-    if ctx.message.author.roles[-1] < _discord_objs.role_shaman:
-        return
-    else:
-        if len(ctx.message.attachments) > 0:
-            try:
-                B = await ctx.message.attachments[0].read()
-            except Exception:
-                await ctx.message.channel.send(sys.exc_info())
-                return
-            f = open(CONSTANTS_PATH, "wb")
-            f.write(B)
-            f.close()
-            await ctx.message.channel.send("file updated, now rebooting")
-            reboot()
+    if len(ctx.message.attachments) > 0:
+        try:
+            B = await ctx.message.attachments[0].read()
+        except Exception:
+            await ctx.message.channel.send(sys.exc_info())
+            return
+        f = open(CONSTANTS_PATH, "wb")
+        f.write(B)
+        f.close()
+        await ctx.message.channel.send("file updated, now rebooting")
+        reboot()
 
 
 @_client.command()
+@requires_rank(_ranks, Rank.SHAMAN)
 async def get_constants(ctx):
-    if ctx.message.author.roles[-1] < _discord_objs.role_shaman:
-        return
-    else:
-        f = open(CONSTANTS_PATH, "rb")
-        await ctx.message.channel.send("Here you are", file=discord.File(f.name))
-        f.close()
+    f = open(CONSTANTS_PATH, "rb")
+    await ctx.message.channel.send("Here you are", file=discord.File(f.name))
+    f.close()
+
+
+@_client.command()
+@requires_rank(_ranks, Rank.SHAMAN)
+async def stats(ctx):
+    lines = ["Bot {}{}, version {}".format(BOT_ID, " (master)" if _node.im_master else "", VERSION)]
+    lines += _metrics.summary_lines()
+    await send_instance_report(ctx, PagedMessage("Stats", paginate_lines(lines), page_message_key(ctx.message.id), local=True))
+
+
+@_client.command()
+@requires_rank(_ranks, Rank.SHAMAN)
+async def memory(ctx):
+    lines = [
+        "Bot {}, RSS {:.1f} MiB, low memory mode {}".format(BOT_ID, read_rss_bytes() / (1024 * 1024), "on" if LOW_MEMORY_MODE else "off"),
+        "Member LRU: {}/{} members, {} hits, {} misses, {} fetched".format(
+            len(_members), MEMBER_LRU_SIZE, _members.hits, _members.misses, _members.fetches
+        ),
+    ]
+    lines += ["Cached {}: {}".format(cache, size) for cache, size in cache_sizes(_client).items()]
+    await send_instance_report(ctx, PagedMessage("Memory", paginate_lines(lines), page_message_key(ctx.message.id), local=True))
+
+
+@_client.command()
+@requires_rank(_ranks, Rank.SHAMAN)
+async def lag(ctx):
+    lag_histogram = _metrics.histogram("event_loop_lag_seconds")
+    lines = [
+        "Bot {}: loop lag p50={:.3f}s p95={:.3f}s max={:.3f}s, {} stalls over {}s".format(
+            BOT_ID, lag_histogram.quantile(0.5), lag_histogram.quantile(0.95), lag_histogram.max,
+            _watchdog.num_stalls, WATCHDOG_THRESHOLD
+        )
+    ]
+    lines += _watchdog.report_lines()
+    await send_instance_report(ctx, PagedMessage("Event loop stalls", paginate_lines(lines), page_message_key(ctx.message.id), local=True))
 
 
 @_client.command()
-async def get_logs(ctx, arg=None):
-    if ctx.message.author.roles[-1] < _discord_objs.role_shaman:
+@requires_rank(_ranks, Rank.SHAMAN)
+async def get_logs(ctx, arg=None, minutes=None):
+    """
+    Uploads the logs from `minutes` minutes starting at the timestamp `arg`, or the last `minutes` minutes.
+    """
+    logging.info("get_logs arg={} minutes={}".format(arg, minutes))
+    try:
+        minutes = LOG_EXCERPT_MINUTES if minutes is None else int(minutes)
+    except ValueError:
+        await ctx.message.channel.send("Invalid number of minutes: {}".format(minutes))
         return
 
-    logging.info("get_logs arg={}".format(arg))
-    arg_timestamp = None
-    if arg is not None:
+    if arg is None:
+        end = datetime.datetime.now()
+        start = end - datetime.timedelta(minutes=minutes)
+    else:
         try:
-            arg_timestamp = datetime.datetime.strptime(arg, LOG_FILE_TIMESTAMP_FORMAT)
+            start = datetime.datetime.strptime(arg, LOG_FILE_TIMESTAMP_FORMAT)
         except ValueError as e:
             logging.error(e)
             await ctx.message.channel.send("Invalid timestamp: {}".format(arg))
             return
+        end = start + datetime.timedelta(minutes=minutes)
 
-    log_file_timestamps = []
-    for log_file in os.listdir(LOGS_DIR):
-        try:
-            dot_index = log_file.index(".")
-        except ValueError as e:
-            logging.error("log file {} index error {}".format(log_file, e))
-            continue
-        timestamp_str = log_file[dot_index+1:-4]
-        try:
-            timestamp = datetime.datetime.strptime(timestamp_str, LOG_FILE_TIMESTAMP_FORMAT)
-        except ValueError as e:
-            logging.error("log file {} strptime error {}".format(log_file, e))
-            continue
-        log_file_timestamps.append({
-            "timestamp": timestamp,
-            "file": log_file
-        })
-
-    if len(log_file_timestamps) == 0:
-        await ctx.message.channel.send("No log files found")
+    # Decompressing old segments takes a while, keep it off the event loop
+    excerpt = await asyncio.get_running_loop().run_in_executor(None, _log_store.excerpt, start, end)
+    if excerpt is None:
+        await ctx.message.channel.send("No logs for {}".format(arg if arg is not None else "the last {} minutes".format(minutes)))
         return
 
-    log_file_timestamps.sort(key=lambda v: v["timestamp"])
-    to_return = None
-    if arg_timestamp is None:
-        to_return = log_file_timestamps[-1]
-    else:
-        for log_file_timestamp in log_file_timestamps:
-            if arg_timestamp >= log_file_timestamp["timestamp"]:
-                to_return = log_file_timestamp
-            else:
-                break
-
-    if to_return is None:
-        await ctx.message.channel.send("No log files for {}".format(arg))
-        return
-
-    full_path = os.path.join(LOGS_DIR, to_return["file"])
-    logging.info("responding with log file {}".format(full_path))
-    with open(full_path) as f:
-        await ctx.message.channel.send("Here you are", file=discord.File(f.name))
+    file_name = "v{}.{}.{}m.log.gz".format(VERSION, start.strftime(LOG_FILE_TIMESTAMP_FORMAT), minutes)
+    logging.info("responding with log excerpt {}, {} bytes".format(file_name, len(excerpt)))
+    await ctx.message.channel.send("Here you are", file=discord.File(io.BytesIO(excerpt), filename=file_name))
 
 # ==== LOBBIES =====================================================================================
 
@@ -1217,6 +1162,10 @@ QUERY_RETRIES_BEFORE_WARNING = 10
 ENSURE_DISPLAY_WINDOW = LOBBY_REFRESH_RATE * 2
 
 _update_lobbies_lock = asyncio.Lock()
+_role_pings = RolePingLimiter(LOBBY_ROLE_PING_INTERVAL)
+# Lobby ID: role IDs mentioned by its message, for the next lobby refresh to apply
+_pending_mention_role_ids = {}
+MAX_PENDING_MENTION_ROLE_IDS = 64
 
 def lobby_get_message_id(lobby):
     key = lobby.get_message_id_key()
@@ -1224,21 +1173,60 @@ def lobby_get_message_id(lobby):
         return None
     return globals()[key]
 
+def lobby_region_roles(lobby):
+    """
+    The subscribers of the lobby's region (see sub/unsub), if its server has one.
+    """
+    region_roles = {
+        "eu": _discord_objs.role_eu,
+        "na": _discord_objs.role_na,
+        "kr": _discord_objs.role_kr,
+    }
+    role = region_roles.get(lobby.get_region())
+    return [role] if role is not None else []
+
+def lobby_mention_roles(lobby):
+    roles = [_discord_objs.guild.get_role(role_id) for role_id in lobby.mention_role_ids]
+    return [role for role in roles if role is not None]
+
+def set_lobby_mention_role_ids(lobby_id, role_ids):
+    for lobby in _open_lobbies:
+        if lobby.id == lobby_id:
+            lobby.mention_role_ids = role_ids
+    # Also for the next refresh, in case one is underway or this instance hasn't seen the lobby yet
+    _pending_mention_role_ids[lobby_id] = role_ids
+    while len(_pending_mention_role_ids) > MAX_PENDING_MENTION_ROLE_IDS:
+        del _pending_mention_role_ids[next(iter(_pending_mention_role_ids))]
+
+# Picks the roles to mention when the message is actually sent (on the master), so the ping rate limit is
+# only tracked in one place. Bnet lobbies always mention the bnet lobby role, like they did before regions, and
+# their region's role at most once per LOBBY_ROLE_PING_INTERVAL. ENT lobbies mention no roles.
+# Returns the message ID followed by the mentioned role IDs, which reach every instance through ensure_display,
+# so that whoever edits the message later keeps the mentions.
+async def send_lobby_message(channel, lobby):
+    roles = []
+    if not lobby.is_ent:
+        roles = [_discord_objs.role_bnet_lobby] + _role_pings.take(lobby_region_roles(lobby))
+        roles = [role for role in roles if role is not None]
+    lobby.mention_role_ids = [role.id for role in roles]
+    message_info = lobby.to_discord_message_info(roles, True)
+    message_id = await send_message_with_bell_reactions(channel, content=message_info["message"], embed=message_info["embed"])
+    return [message_id] + lobby.mention_role_ids
+
 async def lobby_create_message(lobby):
     assert _discord_objs is not None
 
     channel = _discord_objs.channel_ent if lobby.is_ent else _discord_objs.channel_bnet
     try:
-        message_info = lobby.to_discord_message_info(_discord_objs.role_bnet_lobby, True)
-        if message_info is None:
-            logging.info("Lobby skipped: {}".format(lobby))
+        # Skipped lobbies don't use up a role's ping
+        if lobby.to_discord_message_info([], True) is None:
+            _log_lobbies.info("Lobby skipped: %s", lobby)
             return
 
-        logging.info("Creating lobby: {}".format(lobby))
+        _log_lobbies.info("Creating lobby: %s", lobby, extra={"lobby_id": lobby.id})
         key = lobby.get_message_id_key()
-        await ensure_display(send_message_with_bell_reactions,
-            channel, content=message_info["message"], embed=message_info["embed"],
-            window=ENSURE_DISPLAY_WINDOW, return_name=key
+        await ensure_display(send_lobby_message, channel, lobby,
+            window=ENSURE_DISPLAY_WINDOW, return_name=key, key=action_key("lobbycreate", lobby.id), priority=Priority.LOBBY_CREATE
         )
     except Exception as e:
         logging.error("Failed to send message for lobby \"{}\", {}".format(lobby, e))
@@ -1258,9 +1246,9 @@ async def lobby_update_message(lobby, is_open=True):
 
         if message is not None:
             try:
-                message_info = lobby.to_discord_message_info(_discord_objs.role_bnet_lobby, is_open)
+                message_info = lobby.to_discord_message_info(lobby_mention_roles(lobby), is_open)
                 if message_info is None:
-                    logging.info("Lobby skipped: {}".format(lobby))
+                    _log_lobbies.info("Lobby skipped: %s", lobby)
                     return
             except Exception as e:
                 logging.error("Failed to get lobby as message info for \"{}\", {}".format(
@@ -1269,8 +1257,13 @@ async def lobby_update_message(lobby, is_open=True):
                 traceback.print_exc()
                 return
 
-            logging.info("Updating lobby (open={}): {}".format(is_open, lobby))
-            await ensure_display(message.edit, content=message_info["message"], embed=message_info["embed"], window=ENSURE_DISPLAY_WINDOW)
+            _log_lobbies.info("Updating lobby (open=%s): %s", is_open, lobby, extra={"lobby_id": lobby.id})
+            # Only the latest state of a lobby matters. Slot count updates are cosmetic and can be dropped under
+            # load, the final closed state can't.
+            await ensure_display(
+                message.edit, content=message_info["message"], embed=message_info["embed"], window=ENSURE_DISPLAY_WINDOW,
+                priority=Priority.LOBBY_EDIT, coalesce_key=lobby.get_message_id_key(), sheddable=is_open
+            )
     else:
         logging.error("Missing message ID on update for lobby {}".format(lobby))
 
@@ -1279,7 +1272,7 @@ async def lobby_update_message(lobby, is_open=True):
             logging.info("Lobby closed, notifying {} subscribers".format(len(lobby.subscribers)))
             subscribers_string = "Lobby started/unhosted: **{}**\n".format(lobby.name)
             subscribers_string += ", ".join([sub.mention for sub in lobby.subscribers])
-            await ensure_display(channel.send, subscribers_string)
+            await ensure_display(channel.send, subscribers_string, key=action_key("lobbyclosed", lobby.id), priority=Priority.LOBBY_CREATE)
 
         key = lobby.get_message_id_key()
         if key in globals():
@@ -1298,7 +1291,7 @@ async def lobby_delete_message(lobby):
             traceback.print_exc()
 
         if message is not None:
-            await ensure_display(message.delete, window=ENSURE_DISPLAY_WINDOW)
+            await ensure_display(message.delete, window=ENSURE_DISPLAY_WINDOW, key=action_key("lobbydelete", message_id), priority=Priority.LOBBY_EDIT)
     else:
         logging.error("Missing message ID on delete for lobby {}".format(lobby))
 
@@ -1306,49 +1299,17 @@ async def lobby_delete_message(lobby):
     if key in globals():
         del globals()[key]
 
-def get_lobby_changes(prev_lobbies, api_lobbies):
-    lobbies = []
-    is_prev_lobby_closed = [(lobby not in api_lobbies) for lobby in prev_lobbies]
-    is_lobby_new = []
-    is_lobby_updated = []
-    for lobby in api_lobbies:
-        is_new = lobby not in prev_lobbies
-        is_updated = not is_new
-        if not is_new:
-            for lobby2 in prev_lobbies:
-                if lobby2 == lobby:
-                    lobby.subscribers = lobby2.subscribers
-                    is_updated = lobby2.is_updated(lobby)
-                    break
-
-        lobbies.append(lobby)
-        is_lobby_new.append(is_new)
-        is_lobby_updated.append(is_updated)
-
-    return (lobbies, is_prev_lobby_closed, is_lobby_new, is_lobby_updated)
-
 async def report_lobbies(prev_lobbies, api_lobbies):
-    changes = get_lobby_changes(prev_lobbies, api_lobbies)
-    lobbies = changes[0]
-
-    # Update messages for closed lobbies
-    for i in range(len(prev_lobbies)):
-        if changes[1][i]:
-            await lobby_update_message(prev_lobbies[i], is_open=False)
-
-    # Create/update messages for open lobbies
-    for i in range(len(lobbies)):
-        assert not (changes[2][i] and changes[3][i])
-        if changes[2][i]:
-            await lobby_create_message(lobbies[i])
-        if changes[3][i]:
-            await lobby_update_message(lobbies[i])
-
+    lobbies, graph = plan_lobby_updates(prev_lobbies, api_lobbies, lobby_create_message, lobby_update_message)
+    _metrics.histogram("lobbies_diffed", buckets=COUNT_BUCKETS).observe(len(graph))
+    if len(graph) > 0:
+        await graph.run()
     return lobbies
 
 async def update_bnet_lobbies(session, prev_lobbies):
-    response = await session.get("https://api.wc3stats.com/gamelist")
-    response_json = await response.json()
+    with _metrics.histogram("lobby_api_seconds", source="wc3stats").time():
+        response = await session.get("https://api.wc3stats.com/gamelist")
+        response_json = await response.json()
     if "body" not in response_json:
         raise Exception("wc3stats API response has no 'body'")
     body = response_json["body"]
@@ -1357,18 +1318,19 @@ async def update_bnet_lobbies(session, prev_lobbies):
 
     lobbies = [Lobby(obj, is_ent=False) for obj in body]
     ib_lobbies = [lobby for lobby in lobbies if lobby.is_ib()]
-    logging.debug("wc3stats: {}/{} IB lobbies".format(len(ib_lobbies), len(lobbies)))
+    _log_lobbies.debug("wc3stats: %d/%d IB lobbies", len(ib_lobbies), len(lobbies))
     return await report_lobbies(prev_lobbies, ib_lobbies)
 
 async def update_ent_lobbies(session, prev_lobbies):
-    response = await session.get("https://host.entgaming.net/allgames")
-    response_json = await response.json()
+    with _metrics.histogram("lobby_api_seconds", source="ent").time():
+        response = await session.get("https://host.entgaming.net/allgames")
+        response_json = await response.json()
     if not isinstance(response_json, list):
         raise Exception("ENT API response type is {}, not list".format(type(response_json)))
 
     lobbies = [Lobby(obj, is_ent=True) for obj in response_json]
     ib_lobbies = [lobby for lobby in lobbies if lobby.is_ib()]
-    logging.debug("ENT: {}/{} IB lobbies".format(len(ib_lobbies), len(lobbies)))
+    _log_lobbies.debug("ENT: %d/%d IB lobbies", len(ib_lobbies), len(lobbies))
     return await report_lobbies(prev_lobbies, ib_lobbies)
 
 async def update_ib_lobbies():
@@ -1382,11 +1344,12 @@ async def update_ib_lobbies():
     # Query API
     timeout = aiohttp.ClientTimeout(total=LOBBY_REFRESH_RATE/2)
     async with aiohttp.ClientSession(timeout=timeout) as session:
-        result = await asyncio.gather(
-            update_bnet_lobbies(session, prev_bnet_lobbies),
-            update_ent_lobbies(session, prev_ent_lobbies),
-            return_exceptions=True
-        )
+        with _metrics.histogram("lobby_tick_seconds").time():
+            result = await asyncio.gather(
+                update_bnet_lobbies(session, prev_bnet_lobbies),
+                update_ent_lobbies(session, prev_ent_lobbies),
+                return_exceptions=True
+            )
 
     new_bnet_lobbies = prev_bnet_lobbies
     if isinstance(result[0], list):
@@ -1396,6 +1359,7 @@ async def update_ib_lobbies():
             await _client.change_presence(activity=None)
     else:
         logging.error("Failed to update bnet lobbies")
+        _metrics.counter("lobby_api_errors_total", source="wc3stats").inc()
         _wc3stats_down_tries += 1
         if _wc3stats_down_tries > QUERY_RETRIES_BEFORE_WARNING:
             await _client.change_presence(activity=discord.Activity(
@@ -1411,6 +1375,7 @@ async def update_ib_lobbies():
             await _client.change_presence(activity=None)
     else:
         logging.error("Failed to update ENT lobbies")
+        _metrics.counter("lobby_api_errors_total", source="ent").inc()
         _ent_down_tries += 1
         if _ent_down_tries > QUERY_RETRIES_BEFORE_WARNING:
             await _client.change_presence(activity=discord.Activity(
@@ -1419,6 +1384,10 @@ async def update_ib_lobbies():
             ))
 
     _open_lobbies = new_bnet_lobbies + new_ent_lobbies
+    for lobby in _open_lobbies:
+        role_ids = _pending_mention_role_ids.pop(lobby.id, None)
+        if role_ids is not None:
+            lobby.mention_role_ids = role_ids
 
 @_client.command()
 async def getgames(ctx):
@@ -1430,7 +1399,7 @@ async def getgames(ctx):
         is_ent_channel = False
     else:
         return
-    await ensure_display(ctx.message.delete)
+    await ensure_display(ctx.message.delete, key=action_key("getgames", ctx.message.id))
 
     async with _update_lobbies_lock:
         # Clear all posted messages for open lobbies and trigger a refresh
@@ -1443,7 +1412,7 @@ async def getgames(ctx):
 
 @tasks.loop(seconds=LOBBY_REFRESH_RATE)
 async def refresh_ib_lobbies():
-    if not _initialized:
+    if not _node.initialized:
         return
 
     logging.debug("Refreshing lobby list")
@@ -1462,11 +1431,11 @@ async def lobbies_on_reaction_add(channel_id, message_id, emoji, member):
                 match_lobby = True
                 updated = False
                 if emoji.name == BELL_EMOJI and member not in lobby.subscribers:
-                    logging.info("User {} subbed to lobby {}".format(member.display_name, lobby))
+                    _log_lobbies.info("User %s subbed to lobby %s", member.display_name, lobby, extra={"lobby_id": lobby.id})
                     lobby.subscribers.append(member)
                     updated = True
                 if emoji.name == NOBELL_EMOJI and member in lobby.subscribers:
-                    logging.info("User {} unsubbed from lobby {}".format(member.display_name, lobby))
+                    _log_lobbies.info("User %s unsubbed from lobby %s", member.display_name, lobby, extra={"lobby_id": lobby.id})
                     lobby.subscribers.remove(member)
                     updated = True
 
@@ -1474,28 +1443,53 @@ async def lobbies_on_reaction_add(channel_id, message_id, emoji, member):
                     await lobby_update_message(lobby)
 
     if match_lobby:
-        await ensure_display(remove_reaction, channel_id, message_id, emoji, member)
+        await ensure_display(remove_reaction, channel_id, message_id, emoji, member, priority=Priority.LOBBY_EDIT)
 
 # ==== MAIN ========================================================================================
 
+@_client.event
+async def on_member_update(before, after):
+    # Role changes change the rank
+    _ranks.invalidate(after.id)
+    _members.touch(after)
+
+@_client.event
+async def on_guild_role_update(before, after):
+    # Moving a role can change the rank of everyone above or below it
+    _ranks.clear()
+
+@_client.event
+async def on_guild_role_delete(role):
+    _ranks.clear()
+
 @_client.event
 async def on_raw_reaction_add(payload):
+    _members.touch(payload.member)
     await okib_on_reaction_add(payload.channel_id, payload.message_id, payload.emoji, payload.member)
     await lobbies_on_reaction_add(payload.channel_id, payload.message_id, payload.emoji, payload.member)
+    await pages_on_reaction_add(payload.channel_id, payload.message_id, payload.emoji, payload.member)
 
 
 if __name__ == "__main__":
-    if not os.path.exists(LOGS_DIR):
-        os.makedirs(LOGS_DIR)
-
-    datetime_now = datetime.datetime.now()
-    log_file_path = os.path.join(LOGS_DIR, "v{}.{}.log".format(VERSION, datetime_now.strftime(LOG_FILE_TIMESTAMP_FORMAT)))
-    print("Log file: {}".format(log_file_path))
-
-    logging.basicConfig(
-        filename=log_file_path, level=logging.INFO,
-        format="%(asctime)s %(levelname)s: %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+    _log_store.load()
+    print("Logs: {}, {} segments".format(LOGS_DIR, len(_log_store)))
+
+    # Records are queued on the loop thread and formatted and written by a listener thread
+    log_handler = SegmentedLogHandler(_log_store, LOG_SEGMENT_MAX_BYTES, LOG_SEGMENT_MAX_AGE)
+    log_handler.setFormatter(JsonFormatter())
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s: %(message)s", datefmt=LOG_LINE_TIMESTAMP_FORMAT))
+    logging.getLogger().setLevel(logging.INFO)
+    _log_queue_handler, _ = start_queue_logging(
+        logging.getLogger(), [log_handler, stdout_handler], LOG_QUEUE_SIZE, filters=[_log_rate_limit]
     )
-    logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
 
+    # Stalls have their own log, with the stack samples. asyncio's slow callback warnings go there too.
+    watchdog_handler = logging.handlers.RotatingFileHandler(WATCHDOG_LOG_PATH, maxBytes=1024*1024, backupCount=2)
+    watchdog_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s: %(message)s", datefmt=LOG_LINE_TIMESTAMP_FORMAT))
+    watchdog_queue_handler, _ = start_queue_logging(logging.getLogger("watchdog"), [watchdog_handler], LOG_QUEUE_SIZE)
+    logging.getLogger("asyncio").addHandler(watchdog_queue_handler)
+    logging.getLogger("watchdog").propagate = False
+
+    _startup.mark("init")
     _client.run(BOT_TOKEN)
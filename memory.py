@@ -0,0 +1,136 @@
+import asyncio
+import collections
+import logging
+import sys
+
+import discord
+
+# Most user IDs a gateway member request can ask for
+MEMBER_QUERY_BATCH_SIZE = 100
+
+
+class MemberLRU:
+    """
+    The members the bot deals with (command authors, reactors, gather and lobby members), for when the client
+    doesn't cache the guild's member list. Missing members are fetched from the API, and the least recently
+    used ones are evicted past `max_size`.
+    """
+    def __init__(self, max_size=512):
+        self._max_size = max_size
+        self._members = collections.OrderedDict()
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+
+    def __len__(self):
+        return len(self._members)
+
+    def touch(self, member):
+        """
+        Records a member seen in an event, keeping the freshest object (roles may have changed).
+        """
+        # Users (from DMs) and missing members don't belong here
+        if getattr(member, "guild", None) is None:
+            return
+        self._members[member.id] = member
+        self._members.move_to_end(member.id)
+        while len(self._members) > self._max_size:
+            self._members.popitem(last=False)
+
+    def get(self, member_id):
+        member = self._members.get(member_id)
+        if member is not None:
+            self._members.move_to_end(member_id)
+        return member
+
+    async def fetch(self, guild, member_id):
+        """
+        Returns the member from the client cache, the LRU, or the API, in that order. None if not in the guild.
+        """
+        member = self._cached(guild, member_id)
+        if member is not None:
+            self.hits += 1
+            return member
+
+        self.misses += 1
+        self.fetches += 1
+        try:
+            member = await guild.fetch_member(member_id)
+        except discord.NotFound:
+            return None
+        except discord.HTTPException as e:
+            logging.error("Failed to fetch member {}: {}".format(member_id, e))
+            return None
+        self.touch(member)
+        return member
+
+    def _cached(self, guild, member_id):
+        member = guild.get_member(member_id)
+        return member if member is not None else self.get(member_id)
+
+    async def fetch_many(self, guild, member_ids):
+        """
+        Returns a dict of member ID to member, for those that could be found. Missing members are requested
+        over the gateway in batches, rather than with one API call each.
+        """
+        members = {}
+        missing = []
+        for member_id in set(member_ids):
+            member = self._cached(guild, member_id)
+            if member is not None:
+                self.hits += 1
+                members[member_id] = member
+            else:
+                missing.append(member_id)
+
+        for i in range(0, len(missing), MEMBER_QUERY_BATCH_SIZE):
+            batch = missing[i:i + MEMBER_QUERY_BATCH_SIZE]
+            self.misses += len(batch)
+            self.fetches += len(batch)
+            try:
+                found = await guild.query_members(user_ids=batch, cache=False)
+            except (asyncio.TimeoutError, discord.ClientException) as e:
+                logging.warning("Failed to query {} members, fetching them one by one: {}".format(len(batch), e))
+                found = []
+                for member_id in batch:
+                    member = await self.fetch(guild, member_id)
+                    if member is not None:
+                        found.append(member)
+            for member in found:
+                self.touch(member)
+                members[member.id] = member
+        return members
+
+
+def read_rss_bytes():
+    """
+    Current resident set size. Falls back to the peak RSS where /proc isn't available.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def cache_sizes(client, member_lru=None):
+    """
+    Object counts in discord.py's caches, and the member LRU.
+    """
+    sizes = {
+        "guilds": len(client.guilds),
+        "users": len(client.users),
+        "members": sum([len(guild.members) for guild in client.guilds]),
+        "messages": len(client.cached_messages),
+        "emojis": len(client.emojis),
+    }
+    if member_lru is not None:
+        sizes["member_lru"] = len(member_lru)
+    return sizes
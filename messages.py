@@ -0,0 +1,130 @@
+import datetime
+from enum import Enum, unique
+
+
+@unique
+class MessageType(Enum):
+    CONNECT = "connect"
+    CONNECT_ACK = "connectack"
+    LET_MASTER = "letmaster"
+    ENSURE_DISPLAY = "ensure"
+    REQUEST_DB = "reqdb"
+    SEND_DB = "senddb"
+    SEND_DB_ACK = "senddback"
+    SEND_WORKSPACE = "sendws"
+    SEND_WORKSPACE_ACK = "sendwsack"
+    HEARTBEAT = "heartbeat"
+
+
+class Message:
+    def __init__(self, timestamp, message):
+        self.timestamp = timestamp
+        self.message = message
+
+
+class MessageHub:
+    MAX_AGE_SECONDS = 5 * 60
+
+    def __init__(self):
+        self._message_queues = {}
+        for message_type in MessageType:
+            self._message_queues[message_type] = []
+
+    def on_message(self, message_type, message, now=None):
+        assert isinstance(message_type, MessageType)
+        assert isinstance(message, str)
+        assert message_type in self._message_queues
+
+        # TODO should I use the "real" message timestamp?
+        timestamp_now = datetime.datetime.now() if now is None else now
+        msg = Message(timestamp_now, message)
+        self._message_queues[message_type].append(msg)
+
+        # Trim old messages based on max age
+        timestamp_cutoff = timestamp_now - datetime.timedelta(seconds=MessageHub.MAX_AGE_SECONDS)
+        for message_type in self._message_queues.keys():
+            self._message_queues[message_type] = [
+                m for m in self._message_queues[message_type] if m.timestamp > timestamp_cutoff
+            ]
+
+    def got_message(self, message_type, window_seconds, return_name=None, now=None):
+        assert isinstance(message_type, MessageType)
+        assert message_type in self._message_queues
+
+        now = datetime.datetime.now() if now is None else now
+        timestamp_cutoff = now - datetime.timedelta(seconds=window_seconds)
+        messages_in_window = [
+            m for m in self._message_queues[message_type] if m.timestamp > timestamp_cutoff
+        ]
+        if return_name is None:
+            return len(messages_in_window) > 0
+        else:
+            assert message_type == MessageType.ENSURE_DISPLAY
+            for m in messages_in_window:
+                if ensure_display_return_name(m.message) == return_name:
+                    return True
+            return False
+
+
+def parse_ensure_display_value(message):
+    kv = message.partition("=")
+    if kv[1] == "":
+        raise ValueError("Return value without a name: {}".format(message))
+    value = None
+    if len(kv[2]) > 0:
+        data_type = kv[2][0]
+        value_str = kv[2][1:]
+        if data_type == "f":
+            value = float(value_str)
+        elif data_type == "i":
+            value = int(value_str)
+        elif data_type == "s":
+            value = value_str
+        elif data_type == "l":
+            value = [int(v) for v in value_str.split(",") if v != ""]
+        else:
+            raise ValueError("Unhandled return type {}".format(data_type))
+
+    return (kv[0], value)
+
+def format_ensure_display_value(name, value):
+    message = name + "="
+    # TODO should we allow return_name to be set if value is None?
+    if value is not None:
+        if isinstance(value, float):
+            message += "f"
+        elif isinstance(value, int):
+            message += "i"
+        elif isinstance(value, str):
+            message += "s"
+        elif isinstance(value, list):
+            # Lists of IDs
+            message += "l"
+            value = ",".join([str(int(v)) for v in value])
+        else:
+            raise ValueError("Unhandled return type {}".format(type(value)))
+        message += str(value)
+    return message
+
+# ENSURE_DISPLAY messages are "<term>:<key>|<name>=<value>", where the term is the master's (see failover.FailoverNode),
+# and both the idempotency key and the return value are optional
+def format_ensure_display_message(term, key, value_message=""):
+    return "{}:{}|{}".format(term, "" if key is None else key, value_message)
+
+def parse_ensure_display_message(message):
+    """
+    Returns (term, key, (name, value) or None). The term is 0 if it's missing or malformed, like on messages from
+    instances still on the old format. Raises ValueError if the return value is malformed.
+    """
+    head, _, value = message.partition("|")
+    term, _, key = head.rpartition(":")
+    return (
+        int(term) if term.isdigit() else 0,
+        None if key == "" else key,
+        None if value == "" else parse_ensure_display_value(value)
+    )
+
+# Only parses the return name, for MessageHub.got_message
+def ensure_display_return_name(message):
+    value = message.partition("|")[2]
+    return None if value == "" else value.partition("=")[0]
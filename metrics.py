@@ -0,0 +1,217 @@
+import asyncio
+import bisect
+import contextlib
+import logging
+import time
+
+from aiohttp import web
+
+# Upper bounds in seconds, for latencies
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Upper bounds for small counts, like the number of lobbies changed in a tick
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. Observing is a binary search over the bucket bounds, and memory doesn't grow
+    with the number of observations.
+    """
+    kind = "histogram"
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # The last count is for values above every bound (+Inf)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    @contextlib.contextmanager
+    def time(self):
+        """
+        Observes the wall time spent in the with block, including awaits inside it.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q):
+        """
+        Estimates the q-quantile as the upper bound of the bucket it falls in (the max for the last bucket).
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for i, bucket_count in enumerate(self.bucket_counts):
+            total += bucket_count
+            if total >= rank and bucket_count > 0:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(["{}=\"{}\"".format(k, v) for k, v in pairs]) + "}"
+
+
+def _format_number(value):
+    if isinstance(value, float) and value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return str(value)
+
+
+class MetricsRegistry:
+    """
+    Named metrics with optional labels. Getting a metric creates it on first use, so call sites just do
+    e.g. metrics.counter("com_messages_total", direction="in").inc(). Collectors are called before rendering,
+    to refresh gauges that are cheaper to read on demand than to keep up to date.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._kinds = {}
+        self._collectors = []
+
+    def __len__(self):
+        return len(self._metrics)
+
+    def _get(self, cls, name, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            kind = self._kinds.setdefault(name, cls.kind)
+            if kind != cls.kind:
+                raise ValueError("Metric {} is a {}, not a {}".format(name, kind, cls.kind))
+            metric = cls(*args)
+            self._metrics[key] = metric
+        return metric
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS, **labels):
+        return self._get(Histogram, name, labels, buckets)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def collect(self):
+        for collector in self._collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                logging.error("Metrics collector failed: {}".format(e))
+        return sorted(self._metrics.items(), key=lambda item: item[0])
+
+    def render_prometheus(self):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        last_name = None
+        for (name, labels), metric in self.collect():
+            if name != last_name:
+                lines.append("# TYPE {} {}".format(name, metric.kind))
+                last_name = name
+            if metric.kind == "histogram":
+                cumulative = 0
+                for bound, bucket_count in zip(list(metric.buckets) + ["+Inf"], metric.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append("{}_bucket{} {}".format(name, _format_labels(labels, [("le", bound)]), cumulative))
+                lines.append("{}_sum{} {}".format(name, _format_labels(labels), _format_number(metric.sum)))
+                lines.append("{}_count{} {}".format(name, _format_labels(labels), metric.count))
+            else:
+                lines.append("{}{} {}".format(name, _format_labels(labels), _format_number(metric.value)))
+        return "\n".join(lines) + "\n"
+
+    def summary_lines(self):
+        """
+        One human-readable line per metric, for chat.
+        """
+        lines = []
+        for (name, labels), metric in self.collect():
+            if metric.kind == "histogram":
+                if metric.count == 0:
+                    continue
+                lines.append("{}{}: n={} avg={:.3f} p50={:.3f} p95={:.3f} max={:.3f}".format(
+                    name, _format_labels(labels), metric.count, metric.sum / metric.count,
+                    metric.quantile(0.5), metric.quantile(0.95), metric.max
+                ))
+            else:
+                lines.append("{}{}: {}".format(name, _format_labels(labels), _format_number(metric.value)))
+        return lines
+
+
+class MetricsServer:
+    """
+    Serves the registry on GET /metrics. Meant to bind to localhost, for a local Prometheus or curl.
+    """
+    def __init__(self, registry, host, port):
+        self._registry = registry
+        self._host = host
+        self._port = port
+        self._runner = None
+
+    def is_running(self):
+        return self._runner is not None
+
+    async def _handle_metrics(self, request):
+        return web.Response(text=self._registry.render_prometheus(), content_type="text/plain")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self._host, self._port)
+        await site.start()
+        logging.info("Serving metrics on http://{}:{}/metrics".format(self._host, self._port))
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def measure_loop_lag(interval):
+    """
+    Sleeps for `interval` seconds and returns how late the event loop woke up.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await asyncio.sleep(interval)
+    return max(loop.time() - start - interval, 0.0)
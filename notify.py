@@ -0,0 +1,130 @@
+import asyncio
+import datetime
+import logging
+import time
+
+import discord
+
+
+class FanoutResult:
+    def __init__(self):
+        self.sent = []
+        self.failed = []
+        self.skipped = []
+        self.latencies = []
+        self.elapsed = 0.0
+
+    def summary(self):
+        max_latency = max(self.latencies) if len(self.latencies) > 0 else 0.0
+        return "sent {}, failed {}, skipped {} (DMs closed), {:.2f}s total, {:.2f}s max latency".format(
+            len(self.sent), len(self.failed), len(self.skipped), self.elapsed, max_latency
+        )
+
+
+class DmFanout:
+    """
+    Sends the same DM to many members concurrently, with a bounded number of sends in flight and a minimum
+    spacing between send starts to stay clear of Discord's DM rate limits. Members whose DMs are closed are
+    remembered for a while and skipped.
+    """
+    MAX_CONCURRENT = 4
+    MIN_INTERVAL_SECONDS = 0.1
+    CLOSED_DM_TTL_SECONDS = 6 * 60 * 60
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT, min_interval=MIN_INTERVAL_SECONDS, closed_dm_ttl=CLOSED_DM_TTL_SECONDS):
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._min_interval = min_interval
+        self._closed_dm_ttl = datetime.timedelta(seconds=closed_dm_ttl)
+        self._closed_dms = {}
+        self._next_start = 0.0
+
+    def is_dm_closed(self, member_id):
+        expiry = self._closed_dms.get(member_id)
+        if expiry is None:
+            return False
+        if datetime.datetime.now() >= expiry:
+            del self._closed_dms[member_id]
+            return False
+        return True
+
+    def mark_dm_closed(self, member_id):
+        self._closed_dms[member_id] = datetime.datetime.now() + self._closed_dm_ttl
+
+    async def _wait_turn(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        start = max(now, self._next_start)
+        self._next_start = start + self._min_interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def _send_one(self, member, content, result):
+        async with self._semaphore:
+            await self._wait_turn()
+            start = time.perf_counter()
+            try:
+                await member.send(content)
+                result.sent.append(member)
+            except discord.Forbidden as e:
+                # DMs closed or bot blocked, no point retrying for a while
+                self.mark_dm_closed(member.id)
+                result.failed.append((member, e))
+            except Exception as e:
+                result.failed.append((member, e))
+            result.latencies.append(time.perf_counter() - start)
+
+    async def send(self, members, content, description="DM"):
+        """
+        DMs `content` to all members and returns a FanoutResult. Failures are logged once, in the summary.
+        """
+        result = FanoutResult()
+        start = time.perf_counter()
+        to_send = []
+        for member in members:
+            if self.is_dm_closed(member.id):
+                result.skipped.append(member)
+            else:
+                to_send.append(member)
+
+        await asyncio.gather(*[self._send_one(member, content, result) for member in to_send])
+        result.elapsed = time.perf_counter() - start
+
+        logging.info("{} fan-out: {}".format(description, result.summary()))
+        if len(result.failed) > 0:
+            # Should be an logging.error there but since this might happen quite frequently i dont want it to show as "abnormal"
+            logging.warning("{} fan-out failed for {}".format(
+                description, ", ".join(["{} ({})".format(member.name, e) for member, e in result.failed])
+            ))
+        return result
+
+
+class RolePingLimiter:
+    """
+    Lets each role be mentioned at most once every `min_interval` seconds, so a burst of lobbies in one region
+    doesn't ping its subscribers for every one of them.
+    """
+    MIN_INTERVAL_SECONDS = 5 * 60
+
+    def __init__(self, min_interval=MIN_INTERVAL_SECONDS, clock=time.monotonic):
+        self._min_interval = min_interval
+        self._clock = clock
+        self._last_ping = {}
+        # metrics
+        self.num_pinged = 0
+        self.num_suppressed = 0
+
+    def take(self, roles):
+        """
+        Returns the roles that can be pinged now, and counts them as pinged.
+        """
+        now = self._clock()
+        allowed = []
+        for role in roles:
+            last = self._last_ping.get(role.id)
+            if last is not None and now - last < self._min_interval:
+                self.num_suppressed += 1
+                continue
+            self._last_ping[role.id] = now
+            allowed.append(role)
+        self.num_pinged += len(allowed)
+        return allowed
@@ -0,0 +1,124 @@
+import collections
+import datetime
+
+import discord
+
+PREV_PAGE_EMOJI = "\u25C0"
+NEXT_PAGE_EMOJI = "\u25B6"
+
+# Discord embed limits. The description limit is the binding one, titles and footers here are short.
+EMBED_DESCRIPTION_MAX = 4096
+EMBED_TITLE_MAX = 256
+
+# Prefix of the ensure_display return names carrying the posted message's ID
+PAGE_MESSAGE_KEY_PREFIX = "pagemsg"
+
+
+def page_message_key(command_message_id):
+    return PAGE_MESSAGE_KEY_PREFIX + str(command_message_id)
+
+
+def is_page_message_key(key):
+    return key.startswith(PAGE_MESSAGE_KEY_PREFIX)
+
+
+def paginate_lines(lines, max_chars=EMBED_DESCRIPTION_MAX):
+    """
+    Packs lines into as few pages as possible, each at most max_chars long. Lines that don't fit on a page of
+    their own are truncated.
+    """
+    pages = []
+    page = ""
+    for line in lines:
+        if len(line) > max_chars:
+            line = line[:max_chars - 3] + "..."
+        if len(page) == 0:
+            page = line
+        elif len(page) + 1 + len(line) <= max_chars:
+            page += "\n" + line
+        else:
+            pages.append(page)
+            page = line
+    if len(page) > 0 or len(pages) == 0:
+        pages.append(page)
+    return pages
+
+
+class PagedMessage:
+    def __init__(self, title, pages, message_key, local=False):
+        self.title = title[:EMBED_TITLE_MAX]
+        self.pages = pages
+        self.page = 0
+        # Return name of the posted message's ID, set on all instances through ensure_display (see page_message_key)
+        self.message_key = message_key
+        self.message_id = None
+        # Posted by this instance alone (per-instance reports), which then turns its pages itself
+        self.local = local
+        self.created = datetime.datetime.now()
+
+    def to_embed(self):
+        embed = discord.Embed(title=self.title, description=self.pages[self.page])
+        if len(self.pages) > 1:
+            embed.set_footer(text="Page {}/{}".format(self.page + 1, len(self.pages)))
+        return embed
+
+    def turn(self, emoji_name):
+        """
+        Moves to the previous/next page for the given reaction emoji. Returns whether the page changed.
+        """
+        if emoji_name == PREV_PAGE_EMOJI and self.page > 0:
+            self.page -= 1
+            return True
+        if emoji_name == NEXT_PAGE_EMOJI and self.page < len(self.pages) - 1:
+            self.page += 1
+            return True
+        return False
+
+
+class Paginator:
+    """
+    Cache of recently posted paged messages, so that page turns are served without re-running the query.
+    """
+    MAX_MESSAGES = 64
+    MAX_AGE_SECONDS = 30 * 60
+
+    def __init__(self):
+        self._messages = collections.OrderedDict()
+        self._by_message_id = {}
+
+    def __len__(self):
+        return len(self._messages)
+
+    def add(self, paged):
+        self._messages[paged.message_key] = paged
+        self._trim()
+
+    def _trim(self):
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=Paginator.MAX_AGE_SECONDS)
+        while len(self._messages) > 0:
+            paged = next(iter(self._messages.values()))
+            if len(self._messages) <= Paginator.MAX_MESSAGES and paged.created > cutoff:
+                break
+            evicted = self._messages.popitem(last=False)[1]
+            if evicted.message_id is not None:
+                self._by_message_id.pop(evicted.message_id, None)
+
+    def set_message_id(self, message_key, message_id):
+        """
+        Records the ID of the posted message. Returns False if the paged message isn't cached (anymore).
+        """
+        paged = self._messages.get(message_key)
+        if paged is None:
+            return False
+        if paged.message_id is not None:
+            self._by_message_id.pop(paged.message_id, None)
+        paged.message_id = message_id
+        if message_id is not None:
+            self._by_message_id[message_id] = paged
+        return True
+
+    def find(self, message_id):
+        """
+        Returns the paged message posted as message_id, or None.
+        """
+        return self._by_message_id.get(message_id)
@@ -0,0 +1,87 @@
+import enum
+import functools
+import time
+
+
+class Rank(enum.IntEnum):
+    NONE = 0
+    PEON = 1
+    SHAMAN = 2
+
+
+class RankResolver:
+    """
+    A member's rank is the highest rank whose role is at or below the member's top role, like the inline
+    `author.roles[-1] >= role` checks did. Ranks are cached by member ID, along with the top role they were
+    computed from, and the cache is invalidated on member and role updates. Member updates aren't delivered for
+    members the client doesn't cache (low memory mode), so an entry is also recomputed when the member passed in
+    has a different top role, and expires after `ttl` seconds.
+    """
+    def __init__(self, ttl=600, clock=time.monotonic):
+        self._rank_roles = []
+        self._ranks = {}
+        self._ttl = ttl
+        self._clock = clock
+        # metrics
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._ranks)
+
+    def set_roles(self, rank_roles):
+        """
+        rank_roles maps each rank (above NONE) to its Discord role.
+        """
+        self._rank_roles = sorted([(rank, role) for rank, role in rank_roles.items() if role is not None], reverse=True)
+        self.clear()
+
+    def clear(self):
+        self._ranks.clear()
+
+    def invalidate(self, member_id):
+        self._ranks.pop(member_id, None)
+
+    def _compute(self, top_role):
+        if top_role is None:
+            return Rank.NONE
+        for rank, role in self._rank_roles:
+            if top_role >= role:
+                return rank
+        return Rank.NONE
+
+    def rank(self, member):
+        roles = getattr(member, "roles", None)
+        # Users outside the guild (DMs) have no roles, and no rank
+        if roles is None:
+            return Rank.NONE
+        top_role = roles[-1] if len(roles) > 0 else None
+        now = self._clock()
+        entry = self._ranks.get(member.id)
+        if entry is not None and entry[1] > now and entry[2] == top_role:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        rank = self._compute(top_role)
+        self._ranks[member.id] = (rank, now + self._ttl, top_role)
+        return rank
+
+    def at_least(self, member, rank):
+        return self.rank(member) >= rank
+
+
+def requires_rank(resolver, rank, on_denied=None):
+    """
+    Command decorator: the command only runs if the author has at least `rank`. Otherwise on_denied(ctx) is
+    awaited, if given. Goes below the command decorator.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(ctx, *args, **kwargs):
+            if not resolver.at_least(ctx.message.author, rank):
+                if on_denied is not None:
+                    await on_denied(ctx)
+                return
+            return await func(ctx, *args, **kwargs)
+        return wrapper
+    return decorator
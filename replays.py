@@ -27,6 +27,20 @@ class Class(Enum):
     WARLOCK = "Warlock"
     WARRIOR = "Warrior"
 
+# Guild emoji name for each class
+CLASS_EMOJI_NAMES = {
+    "dk": Class.DK,
+    "druid": Class.DRUID,
+    "fm": Class.FM,
+    "im": Class.IM,
+    "pala": Class.PALADIN,
+    "priest": Class.PRIEST,
+    "ranger": Class.RANGER,
+    "rog": Class.ROGUE,
+    "wl": Class.WARLOCK,
+    "demonwar": Class.WARRIOR,
+}
+
 @unique
 class Boss(Enum):
     FIRE = "fire"
@@ -199,27 +213,10 @@ def replays_load_emojis(guild_emojis):
     _class_emoji = {}
 
     for emoji in guild_emojis:
-        if emoji.name == "dk":
-            _class_emoji[Class.DK] = emoji
-        if emoji.name == "druid":
-            _class_emoji[Class.DRUID] = emoji
-        if emoji.name == "fm":
-            _class_emoji[Class.FM] = emoji
-        if emoji.name == "im":
-            _class_emoji[Class.IM] = emoji
-        if emoji.name == "pala":
-            _class_emoji[Class.PALADIN] = emoji
-        if emoji.name == "priest":
-            _class_emoji[Class.PRIEST] = emoji
-        if emoji.name == "ranger":
-            _class_emoji[Class.RANGER] = emoji
-        if emoji.name == "rog":
-            _class_emoji[Class.ROGUE] = emoji
-        if emoji.name == "wl":
-            _class_emoji[Class.WARLOCK] = emoji
-        if emoji.name == "demonwar":
-            _class_emoji[Class.WARRIOR] = emoji
-
-    if len(_class_emoji) != 10:
-        raise Exception("Missing class emoji, {}/10: ".format(len(_class_emoji)))
+        class_ = CLASS_EMOJI_NAMES.get(emoji.name)
+        if class_ is not None:
+            _class_emoji[class_] = emoji
+
+    if len(_class_emoji) != len(CLASS_EMOJI_NAMES):
+        raise Exception("Missing class emoji, {}/{}: ".format(len(_class_emoji), len(CLASS_EMOJI_NAMES)))
     logging.info("Loaded all class emoji for replays module")
@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+
+RESOLVER_CACHE_FILE_NAME = ".discord_ids.json"
+
+
+class DiscordResolver:
+    """
+    Finds guilds and channels by name. Resolved IDs are cached in a file, so later boots and reconnects look
+    objects up by ID in the client's cache (a dict lookup), and only scan by name when an ID is missing or stale.
+    """
+    def __init__(self, cache_path):
+        self._cache_path = cache_path
+        self._ids = None
+        self._dirty = False
+        # metrics
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        if self._ids is not None:
+            return
+        self._ids = {}
+        try:
+            with open(self._cache_path, "r") as f:
+                ids = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(ids, dict):
+            self._ids = {k: v for k, v in ids.items() if isinstance(v, int) and not isinstance(v, bool)}
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp_path = self._cache_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self._ids, f)
+            os.replace(tmp_path, self._cache_path)
+            self._dirty = False
+        except OSError as e:
+            logging.warning("Failed to write Discord ID cache {}: {}".format(self._cache_path, e))
+
+    def _resolve(self, key, name, get_by_id, scan):
+        self._load()
+        obj_id = self._ids.get(key)
+        if obj_id is not None:
+            obj = get_by_id(obj_id)
+            # Renamed objects are stale, the name is what the config refers to
+            if obj is not None and obj.name == name:
+                self.hits += 1
+                return obj
+
+        self.misses += 1
+        obj = scan().get(name)
+        if obj is not None:
+            self._ids[key] = obj.id
+            self._dirty = True
+        elif key in self._ids:
+            del self._ids[key]
+            self._dirty = True
+        return obj
+
+    def guild(self, client, name):
+        return self._resolve(
+            "guild/" + name, name, client.get_guild,
+            lambda: {guild.name: guild for guild in client.guilds}
+        )
+
+    def text_channel(self, guild, name):
+        return self._resolve(
+            "channel/{}/{}".format(guild.id, name), name, guild.get_channel,
+            lambda: {channel.name: channel for channel in guild.text_channels}
+        )
@@ -0,0 +1,357 @@
+import asyncio
+import contextlib
+import contextvars
+import enum
+import logging
+import time
+
+
+class Priority(enum.IntEnum):
+    """
+    Outbound Discord call classes, most important first. COM messages aren't queued at all, see DiscordScheduler.
+    """
+    GATHER = 0
+    COMMAND = 1
+    LOBBY_CREATE = 2
+    LOBBY_EDIT = 3
+
+
+# Route kind: (calls, per seconds). Estimates of Discord's per-channel buckets, which discord.py doesn't expose.
+DEFAULT_ROUTE_LIMITS = {
+    "send": (5, 5.0),
+    "edit": (5, 5.0),
+    "delete": (5, 5.0),
+    "fetch": (5, 1.0),
+    "reaction": (4, 1.0),
+}
+DEFAULT_GLOBAL_LIMIT = (50, 1.0)
+
+# The job whose Discord calls are being made, None outside of scheduled jobs
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class JobShed(Exception):
+    """
+    Raised by DiscordScheduler.submit when a sheddable call waited too long and was dropped.
+    """
+    pass
+
+
+def route_kind(name):
+    name = name.lower()
+    for kind in ["reaction", "edit", "delete", "fetch"]:
+        if kind in name:
+            return kind
+    return "send"
+
+
+def get_route(func, args):
+    """
+    Guesses the route (kind, channel ID) of a job's first Discord call from the function and its arguments: a bound
+    method of a channel or message, or a function taking a channel, message, context, gather or channel ID first.
+    Returns None if there's no channel, and the job then only waits for the global budget.
+    """
+    target = getattr(func, "__self__", None)
+    if target is None and len(args) > 0:
+        target = args[0]
+    channel = getattr(target, "channel", target)
+    if isinstance(channel, int):
+        channel_id = channel
+    else:
+        channel_id = getattr(channel, "id", None)
+    if channel_id is None:
+        return None
+    return (route_kind(getattr(func, "__name__", "send")), channel_id)
+
+
+def get_request_route(route):
+    """
+    The route (kind, channel ID) of an actual Discord API request, from discord.py's http.Route.
+    None for requests outside of channels (members, roles), which only count against the global budget.
+    """
+    if route.channel_id is None:
+        return None
+    if "/reactions" in route.path:
+        kind = "reaction"
+    else:
+        kind = {"POST": "send", "PATCH": "edit", "DELETE": "delete", "GET": "fetch"}.get(route.method, "send")
+    return (kind, int(route.channel_id))
+
+
+def instrument_http(http, scheduler):
+    """
+    Makes every request of a discord.py HTTPClient take its token from the scheduler first, so budgets are
+    charged per actual call on its actual route, including each call of composite jobs.
+    """
+    request = http.request
+
+    async def scheduled_request(route, **kwargs):
+        await scheduler.charge(get_request_route(route))
+        return await request(route, **kwargs)
+
+    http.request = scheduled_request
+
+
+@contextlib.contextmanager
+def unscheduled():
+    """
+    Discord calls made in this context are charged to the budgets, but never wait (see DiscordScheduler.charge).
+    """
+    token = _current_job.set(None)
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+
+class TokenBucket:
+    __slots__ = ["capacity", "rate", "tokens", "last"]
+
+    def __init__(self, calls, per, now):
+        self.capacity = calls
+        self.rate = calls / per
+        self.tokens = float(calls)
+        self.last = now
+
+    def refill(self, now):
+        self.tokens = min(self.tokens + (now - self.last) * self.rate, self.capacity)
+        self.last = now
+
+    def time_until_token(self):
+        return max(1.0 - self.tokens, 0.0) / self.rate
+
+
+class Job:
+    """
+    A queued job, or a call (func is None) made by a running job and waiting for its token.
+    A started job holds the token it was started with as `credit`, until its first call on that route.
+    """
+    __slots__ = ["func", "priority", "route", "coalesce_key", "sheddable", "seq", "queued_at", "futures", "credit"]
+
+    def __init__(self, func, priority, route, coalesce_key, sheddable, seq, queued_at):
+        self.func = func
+        self.priority = priority
+        self.route = route
+        self.coalesce_key = coalesce_key
+        self.sheddable = sheddable
+        self.seq = seq
+        self.queued_at = queued_at
+        self.futures = []
+        self.credit = False
+
+
+class DiscordScheduler:
+    """
+    Central queue for the master's outbound Discord calls. Budgets are tracked locally per route and globally,
+    with token buckets. A job with budget left starts right away; otherwise it waits, and queued jobs start by
+    priority as budget frees up, so gather and command replies go before lobby edits.
+
+    Every API request a job makes takes a token on its actual route (see instrument_http), so a job making
+    several calls waits for each of them. Calls made outside of jobs (COM messages, per-instance replies) are
+    charged too, but never wait: the failover protocol relies on COM messages going out on time.
+
+    While queued, a job with the same `coalesce_key` as a newer one is replaced by it (both callers get the
+    newer result), and `sheddable` jobs still waiting after `shed_after` seconds are dropped (raising JobShed).
+    """
+    def __init__(self, route_limits=DEFAULT_ROUTE_LIMITS, global_limit=DEFAULT_GLOBAL_LIMIT, shed_after=10.0, on_wait=None, clock=time.monotonic):
+        self._route_limits = route_limits
+        self._global_limit = global_limit
+        self._shed_after = shed_after
+        self._on_wait = on_wait
+        self._clock = clock
+        self._buckets = {}
+        self._global = TokenBucket(global_limit[0], global_limit[1], clock())
+        self._queue = []
+        self._coalescable = {}
+        self._seq = 0
+        self._dispatcher = None
+        # metrics
+        self.num_immediate = 0
+        self.num_queued = 0
+        self.num_coalesced = 0
+        self.num_shed = 0
+        self.num_calls = 0
+        self.num_unscheduled_calls = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def queued_by_priority(self):
+        counts = {priority: 0 for priority in Priority}
+        for job in self._queue:
+            counts[job.priority] += 1
+        return counts
+
+    def _bucket(self, route, now):
+        if route is None:
+            return None
+        bucket = self._buckets.get(route)
+        if bucket is None:
+            calls, per = self._route_limits.get(route[0], self._route_limits["send"])
+            bucket = TokenBucket(calls, per, now)
+            self._buckets[route] = bucket
+        bucket.refill(now)
+        return bucket
+
+    def budget(self, route):
+        """
+        Calls left right now on the route, counting the global budget too.
+        """
+        now = self._clock()
+        self._global.refill(now)
+        bucket = self._bucket(route, now)
+        return self._global.tokens if bucket is None else min(bucket.tokens, self._global.tokens)
+
+    def _take(self, route, now, force=False):
+        bucket = self._bucket(route, now)
+        self._global.refill(now)
+        if not force and ((bucket is not None and bucket.tokens < 1) or self._global.tokens < 1):
+            return False
+        if bucket is not None:
+            bucket.tokens -= 1
+        self._global.tokens -= 1
+        return True
+
+    def _refund(self, route, now):
+        bucket = self._bucket(route, now)
+        if bucket is not None:
+            bucket.tokens = min(bucket.tokens + 1, bucket.capacity)
+        self._global.refill(now)
+        self._global.tokens = min(self._global.tokens + 1, self._global.capacity)
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def submit(self, func, priority, route, coalesce_key=None, sheddable=False):
+        """
+        Runs the coroutine function `func` (no arguments) once there's budget for its first call on `route`, and
+        returns its result.
+        """
+        now = self._clock()
+        if not any([job.route == route for job in self._queue]) and self._take(route, now):
+            self.num_immediate += 1
+            job = Job(func, priority, route, None, False, self._seq, now)
+            self._seq += 1
+            job.credit = True
+            return await self._call(job)
+
+        future = asyncio.get_running_loop().create_future()
+        job = self._coalescable.get(coalesce_key) if coalesce_key is not None else None
+        if job is not None:
+            # The newer call supersedes the queued one, which keeps its place in line
+            job.func = func
+            job.priority = min(job.priority, priority)
+            job.sheddable = job.sheddable and sheddable
+            self.num_coalesced += 1
+        else:
+            job = Job(func, priority, route, coalesce_key, sheddable, self._seq, now)
+            self._seq += 1
+            self._queue.append(job)
+            if coalesce_key is not None:
+                self._coalescable[coalesce_key] = job
+            self.num_queued += 1
+        job.futures.append(future)
+
+        self._ensure_dispatcher()
+        return await future
+
+    async def charge(self, route):
+        """
+        Takes a token for one Discord API request on `route`. Inside a job, waits for it by the job's priority;
+        outside of jobs, takes it even if the budget is exhausted.
+        """
+        job = _current_job.get()
+        now = self._clock()
+        self.num_calls += 1
+        if job is None:
+            self.num_unscheduled_calls += 1
+            self._take(route, now, force=True)
+            return
+        if job.credit and job.route == route:
+            job.credit = False
+            return
+        if not any([queued.route == route for queued in self._queue]) and self._take(route, now):
+            return
+
+        # Goes before jobs queued after this one
+        call = Job(None, job.priority, route, None, False, job.seq, now)
+        future = asyncio.get_running_loop().create_future()
+        call.futures.append(future)
+        self._queue.append(call)
+        self._ensure_dispatcher()
+        await future
+
+    async def _call(self, job):
+        token = _current_job.set(job)
+        try:
+            return await job.func()
+        finally:
+            _current_job.reset(token)
+            # The job never made its first call on the route it was started for
+            if job.credit:
+                job.credit = False
+                self._refund(job.route, self._clock())
+
+    def _remove(self, job):
+        self._queue.remove(job)
+        if job.coalesce_key is not None and self._coalescable.get(job.coalesce_key) is job:
+            del self._coalescable[job.coalesce_key]
+
+    def _shed_expired(self, now):
+        for job in [j for j in self._queue if j.sheddable and now - j.queued_at > self._shed_after]:
+            self._remove(job)
+            self.num_shed += 1
+            logging.warning("Shedding Discord call on route {} after {:.1f}s".format(job.route, now - job.queued_at))
+            for future in job.futures:
+                if not future.done():
+                    future.set_exception(JobShed())
+
+    async def _run(self, job, now):
+        if self._on_wait is not None:
+            self._on_wait(job.priority, now - job.queued_at)
+        job.credit = True
+        try:
+            result = await self._call(job)
+        except Exception as e:
+            for future in job.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future in job.futures:
+            if not future.done():
+                future.set_result(result)
+
+    async def _dispatch(self):
+        while len(self._queue) > 0:
+            now = self._clock()
+            self._shed_expired(now)
+
+            # The first entry per route keeps calls on a route in order of priority, then arrival
+            blocked_routes = set()
+            wait = None
+            for job in sorted(self._queue, key=lambda j: (j.priority, j.seq)):
+                if job.route in blocked_routes:
+                    continue
+                if self._take(job.route, now):
+                    self._remove(job)
+                    if job.func is None:
+                        for future in job.futures:
+                            if not future.done():
+                                future.set_result(None)
+                    else:
+                        asyncio.ensure_future(self._run(job, now))
+                else:
+                    blocked_routes.add(job.route)
+                    bucket = self._buckets.get(job.route)
+                    job_wait = self._global.time_until_token()
+                    if bucket is not None:
+                        job_wait = max(job_wait, bucket.time_until_token())
+                    wait = job_wait if wait is None else min(wait, job_wait)
+
+            if wait is not None:
+                await asyncio.sleep(wait)
+            elif len(self._queue) > 0:
+                # Jobs were started this pass, let them make their first calls
+                await asyncio.sleep(0)
+        self._dispatcher = None
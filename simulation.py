@@ -0,0 +1,320 @@
+"""
+Deterministic simulator of the bot network's master/follower protocol. N instances run on a virtual clock and
+talk over a fake COM channel with configurable latency and message loss, and can crash and restart.
+
+Each SimInstance runs the same protocol as main.py, failover.FailoverNode, and stands in for main.py's side of
+it: the COM channel, timers, Discord calls, and the DB and workspace sync.
+"""
+import collections
+import datetime
+import heapq
+import random
+
+from failover import Effect, FailoverNode
+from messages import MessageType
+
+SIM_EPOCH = datetime.datetime(2024, 1, 1)
+SIM_VERSION = 1
+
+
+class SimConfig:
+    def __init__(
+        self, heartbeat_interval=5, missed_beats=3, connect_timeout=3, ensure_display_window=2,
+        com_latency=(0.05, 0.3), com_loss=0.0, gateway_latency=(0.05, 0.3), api_latency=(0.1, 0.5), seed=0
+    ):
+        self.heartbeat_interval = heartbeat_interval
+        self.missed_beats = missed_beats
+        self.connect_timeout = connect_timeout
+        self.ensure_display_window = ensure_display_window
+        # (min, max) seconds, uniformly distributed
+        self.com_latency = com_latency
+        self.gateway_latency = gateway_latency
+        self.api_latency = api_latency
+        # Probability that an instance misses a given COM message
+        self.com_loss = com_loss
+        self.seed = seed
+
+
+class SimTimer:
+    __slots__ = ["cancelled"]
+
+    def __init__(self):
+        self.cancelled = False
+
+
+class SimAction:
+    """
+    A displayed action triggered by a Discord event every instance sees, like a command or a lobby change.
+    Actions without a key rely on the ENSURE_DISPLAY time window, like edits and reactions do.
+    """
+    def __init__(self, action_id, key):
+        self.action_id = action_id
+        self.key = key
+
+
+class SimInstance:
+    def __init__(self, sim, bot_id):
+        self.sim = sim
+        self.bot_id = bot_id
+        self.up = False
+        self.incarnation = 0
+        self.node = None
+        self.connect_timer = None
+
+    def later(self, delay, func):
+        """
+        Schedules func on this instance, unless it crashed (or restarted) in the meantime.
+        """
+        incarnation = self.incarnation
+        timer = SimTimer()
+
+        def call():
+            if self.up and self.incarnation == incarnation and not timer.cancelled:
+                func()
+        self.sim.schedule(delay, call)
+        return timer
+
+    def com(self, to_id, message_type, message=""):
+        self.sim.send_com(self.bot_id, to_id, message_type, message)
+
+    def apply(self, effects):
+        # main.py's apply_effects
+        for effect, *args in effects:
+            if effect == Effect.COM:
+                self.com(*args)
+            elif effect == Effect.CONNECT_TIMER:
+                self.connect_timer = self.later(self.sim.config.connect_timeout, lambda: self.call(self.node.on_connect_timeout))
+            elif effect == Effect.CANCEL_CONNECT_TIMER:
+                if self.connect_timer is not None:
+                    self.connect_timer.cancelled = True
+            elif effect == Effect.SEND_WORKSPACE:
+                self.com(args[0], MessageType.SEND_WORKSPACE)
+            elif effect == Effect.REQUEST_DB:
+                self.com(args[0], MessageType.REQUEST_DB, "0")
+            elif effect == Effect.PERFORM:
+                self.ensure_display(args[0].func)
+
+    def call(self, method, *args):
+        """
+        Calls a FailoverNode method and carries out its effects, reporting promotions to the simulation.
+        """
+        was_master = self.node.im_master
+        effects = method(*args, now=self.sim.now_datetime())
+        if self.node.im_master and not was_master:
+            self.sim.on_promotion(self)
+        self.apply(effects)
+
+    # on_ready
+    def start(self):
+        self.incarnation += 1
+        self.up = True
+        config = self.sim.config
+        self.node = FailoverNode(self.bot_id, SIM_VERSION, config.heartbeat_interval, config.missed_beats)
+        self.connect_timer = None
+        self.apply(self.node.connect())
+        self.later(config.heartbeat_interval, self.heartbeat)
+
+    def crash(self):
+        self.up = False
+        self.node.im_master = False
+
+    def heartbeat(self):
+        self.later(self.sim.config.heartbeat_interval, self.heartbeat)
+        self.call(self.node.heartbeat)
+
+    def ensure_display(self, action):
+        if self.node.is_displayed(action.key):
+            return
+
+        if self.node.im_master:
+            def displayed():
+                self.sim.on_display(action, self)
+                self.apply(self.node.displayed(action.key))
+            # The Discord call itself takes a while, and the instance may die before it completes
+            self.later(self.sim.latency(self.sim.config.api_latency), displayed)
+        else:
+            self.node.defer(action, self.sim.config.ensure_display_window, key=action.key, now=self.sim.now_datetime())
+
+    def on_message(self, from_id, to_id, message_type, message):
+        if to_id != -1 and to_id != self.bot_id:
+            return
+        self.call(self.node.receive, from_id, message_type, message)
+
+        # main.py's parse_bot_com
+        if message_type == MessageType.REQUEST_DB:
+            if self.node.im_master:
+                self.com(from_id, MessageType.SEND_DB)
+        elif message_type == MessageType.SEND_DB:
+            self.com(from_id, MessageType.SEND_DB_ACK)
+        elif message_type == MessageType.SEND_WORKSPACE:
+            self.com(from_id, MessageType.SEND_WORKSPACE_ACK)
+            self.node.initialized = True
+
+
+class SimResult:
+    def __init__(self):
+        self.displays = collections.Counter()
+        self.actions = []
+        self.com_messages = collections.Counter()
+        self.crashes = []
+        self.promotions = []
+        self.failover_times = []
+        self.max_masters = 0
+        self.duration = 0.0
+
+    def duplicates(self):
+        return sum([max(count - 1, 0) for count in self.displays.values()])
+
+    def missed(self):
+        return len([action for action in self.actions if self.displays[action.action_id] == 0])
+
+    def summary(self):
+        failover = [t for t in self.failover_times if t is not None]
+        return {
+            "actions": len(self.actions),
+            "duplicates": self.duplicates(),
+            "missed": self.missed(),
+            "failovers": len(failover),
+            "failed_failovers": len(self.failover_times) - len(failover),
+            "max_failover_seconds": max(failover) if len(failover) > 0 else None,
+            "max_masters": self.max_masters,
+            "com_messages": sum(self.com_messages.values()),
+            "com_messages_per_minute": sum(self.com_messages.values()) / max(self.duration / 60, 1e-9),
+        }
+
+
+class Simulation:
+    def __init__(self, config, num_instances):
+        self.config = config
+        self.now = 0.0
+        self._rng = random.Random(config.seed)
+        self._events = []
+        self._seq = 0
+        self._next_action_id = 0
+        self._master_crash_times = []
+        self.instances = {bot_id: SimInstance(self, bot_id) for bot_id in range(1, num_instances + 1)}
+        self.result = SimResult()
+
+    def now_datetime(self):
+        return SIM_EPOCH + datetime.timedelta(seconds=self.now)
+
+    def latency(self, bounds):
+        return self._rng.uniform(bounds[0], bounds[1])
+
+    def schedule(self, delay, func):
+        # The sequence number keeps events at the same time in scheduling order, so runs are deterministic
+        heapq.heappush(self._events, (self.now + delay, self._seq, func))
+        self._seq += 1
+
+    def at(self, time, func):
+        self.schedule(max(time - self.now, 0.0), func)
+
+    def run(self, until):
+        while len(self._events) > 0 and self._events[0][0] <= until:
+            time, _, func = heapq.heappop(self._events)
+            self.now = time
+            func()
+        self.now = until
+        self.result.duration = until
+        return self.result
+
+    def send_com(self, from_id, to_id, message_type, message):
+        self.result.com_messages[message_type] += 1
+        for instance in self.instances.values():
+            if instance.bot_id == from_id or self._rng.random() < self.config.com_loss:
+                continue
+            def deliver(instance=instance):
+                if instance.up:
+                    instance.on_message(from_id, to_id, message_type, message)
+            self.schedule(self.latency(self.config.com_latency), deliver)
+
+    def masters(self):
+        return [i for i in self.instances.values() if i.up and i.node.im_master]
+
+    def on_promotion(self, instance):
+        self.result.promotions.append((self.now, instance.bot_id))
+        self.result.max_masters = max(self.result.max_masters, len(self.masters()))
+        # A promotion ends every pending failover
+        for crash_time in self._master_crash_times:
+            self.result.failover_times.append(self.now - crash_time)
+        self._master_crash_times = []
+
+    def on_display(self, action, instance):
+        self.result.displays[action.action_id] += 1
+
+    # Scenario building blocks
+
+    def start(self, time, bot_id):
+        self.at(time, self.instances[bot_id].start)
+
+    def crash(self, time, bot_id=None):
+        """
+        Crashes the given instance, or whichever instance is master at that time.
+        """
+        def crash():
+            instance = self.instances.get(bot_id)
+            if bot_id is None:
+                masters = self.masters()
+                instance = masters[0] if len(masters) > 0 else None
+            if instance is None or not instance.up:
+                return
+            self.result.crashes.append((self.now, instance.bot_id))
+            if instance.node.im_master and len(self.masters()) == 1:
+                self._master_crash_times.append(self.now)
+            instance.crash()
+        self.at(time, crash)
+
+    def action(self, time, key=True):
+        """
+        A Discord event that triggers a displayed action, seen by every running instance.
+        """
+        action_id = self._next_action_id
+        self._next_action_id += 1
+        action = SimAction(action_id, "{:016x}".format(action_id) if key else None)
+
+        def trigger():
+            self.result.actions.append(action)
+            for instance in self.instances.values():
+                def handle(instance=instance):
+                    if instance.up:
+                        instance.ensure_display(action)
+                self.schedule(self.latency(self.config.gateway_latency), handle)
+        self.at(time, trigger)
+
+    def finish(self):
+        # Failovers still pending at the end never happened
+        self.result.failover_times += [None for _ in self._master_crash_times]
+        self._master_crash_times = []
+        return self.result
+
+
+def run_scenario(
+    config, num_instances=3, duration=600, action_interval=5, keyed_fraction=1.0, crashes=[], restarts=[], settle=120,
+    start_interval=10
+):
+    """
+    Starts the instances `start_interval` seconds apart (instances booting within the connect timeout of each
+    other all promote themselves, like the real ones do), triggers an action every `action_interval` seconds (every
+    1/keyed_fraction-th one keyed, the rest without a key), applies the crashes (time, bot ID or None for the
+    current master) and restarts (time, bot ID), then runs `settle` more seconds without actions.
+    """
+    sim = Simulation(config, num_instances)
+    for bot_id in sim.instances:
+        sim.start((bot_id - 1) * start_interval, bot_id)
+    for time, bot_id in crashes:
+        sim.crash(time, bot_id)
+    for time, bot_id in restarts:
+        sim.start(time, bot_id)
+
+    time = (num_instances - 1) * start_interval + config.connect_timeout + 5
+    keyed_count = 0.0
+    while time < duration:
+        keyed_count += keyed_fraction
+        key = keyed_count >= 1.0
+        if key:
+            keyed_count -= 1.0
+        sim.action(time, key=key)
+        time += action_interval
+
+    sim.run(duration + settle)
+    return sim.finish()
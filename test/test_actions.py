@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from actions import ActionGraph
+
+def test_action_graph_concurrency():
+	async def run():
+		events = []
+		def step(name, delay, result=None):
+			async def func():
+				events.append("start " + name)
+				await asyncio.sleep(delay)
+				events.append("end " + name)
+				return result
+			return func
+
+		graph = ActionGraph()
+		graph.add("delete", step("delete", 0.05))
+		graph.add("send", step("send", 0.05, result="message"))
+		graph.add("react", step("react", 0.01), after=["send"])
+
+		loop = asyncio.get_running_loop()
+		start = loop.time()
+		results = await graph.run()
+		elapsed = loop.time() - start
+
+		# delete and send overlap, react waits for send
+		assert elapsed < 0.09
+		assert events.index("start react") > events.index("end send")
+		assert events.index("start send") < events.index("end delete")
+		assert results["send"] == "message"
+	asyncio.run(run())
+
+def test_action_graph_failure():
+	async def run():
+		done = []
+		async def fail():
+			raise RuntimeError("boom")
+		async def ok():
+			done.append("ok")
+		async def dependent():
+			done.append("dependent")
+
+		graph = ActionGraph().add("fail", fail).add("ok", ok).add("dependent", dependent, after=["fail"])
+		with pytest.raises(RuntimeError):
+			await graph.run()
+		assert done == ["ok"]
+	asyncio.run(run())
+
+def test_action_graph_invalid():
+	graph = ActionGraph().add("a", None)
+	with pytest.raises(ValueError):
+		graph.add("a", None)
+	with pytest.raises(ValueError):
+		graph.add("b", None, after=["c"])
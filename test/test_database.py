@@ -0,0 +1,150 @@
+import asyncio
+import datetime
+import os
+import sqlite3
+import zlib
+
+from database import MIGRATIONS, Database, format_event_datetime, migrate, SYNC_DELTA, SYNC_SNAPSHOT, get_high_water_mark, make_sync_payload, apply_sync_payload
+
+def make_db(path, num_events):
+	conn = sqlite3.connect(path)
+	conn.execute("CREATE TABLE Events (Event_type INTEGER, Player_id INTEGER, Reason TEXT, Datetime TEXT, Warner TEXT)")
+	for i in range(num_events):
+		conn.execute("INSERT INTO Events VALUES (666, ?, ?, '2024-01-01', 'shaman')", (i, "reason {}".format(i)))
+	conn.commit()
+	conn.close()
+
+def read_events(path):
+	conn = sqlite3.connect(path)
+	rows = conn.execute("SELECT rowid, * FROM Events ORDER BY rowid").fetchall()
+	conn.close()
+	return rows
+
+def test_db_sync_delta(tmp_path):
+	master = str(tmp_path / "master.db")
+	newcomer = str(tmp_path / "newcomer.db")
+	make_db(master, 10)
+	make_db(newcomer, 4)
+
+	mark = get_high_water_mark(newcomer)
+	assert mark == 4
+	payload = make_sync_payload(master, mark)
+	assert payload[:1] == SYNC_DELTA
+	assert apply_sync_payload(newcomer, str(tmp_path / "archive" / "newcomer.db"), payload) == 6
+	assert read_events(newcomer) == read_events(master)
+
+	# Up to date, nothing to send
+	payload = make_sync_payload(master, get_high_water_mark(newcomer))
+	assert apply_sync_payload(newcomer, str(tmp_path / "archive" / "newcomer.db"), payload) == 0
+
+def test_db_sync_snapshot(tmp_path):
+	master = str(tmp_path / "master.db")
+	newcomer = str(tmp_path / "newcomer.db")
+	archive = str(tmp_path / "archive" / "newcomer.db")
+	make_db(master, 5)
+
+	# No DB at all
+	assert get_high_water_mark(newcomer) == -1
+	payload = make_sync_payload(master, get_high_water_mark(newcomer))
+	assert payload[:1] == SYNC_SNAPSHOT
+	assert apply_sync_payload(newcomer, archive, payload) is None
+	assert read_events(newcomer) == read_events(master)
+	assert not os.path.exists(archive)
+
+	# Diverged DB (ahead of master) gets replaced, old one archived
+	os.remove(newcomer)
+	make_db(newcomer, 8)
+	payload = make_sync_payload(master, get_high_water_mark(newcomer))
+	assert payload[:1] == SYNC_SNAPSHOT
+	apply_sync_payload(newcomer, archive, payload)
+	assert read_events(newcomer) == read_events(master)
+	assert len(read_events(archive)) == 8
+
+def test_database_warnings(tmp_path):
+	path = str(tmp_path / "warn.db")
+	t1 = datetime.datetime(2024, 1, 1)
+	t2 = datetime.datetime(2024, 1, 2)
+	t3 = datetime.datetime(2024, 1, 3)
+
+	async def run():
+		# No DB file at all, the schema gets created
+		db = Database(path)
+		# Parameterized, so quotes in the reason are stored as-is
+		await db.add_warnings([
+			(1, "again", t3, "other shaman"),
+			(2, "'; DROP TABLE Events; --", t2, "shaman"),
+			(1, "said \"hi\"", t1, "shaman"),
+		])
+		rows = await db.get_warnings(1)
+		assert rows == [
+			(1, "said \"hi\"", int(t1.timestamp()), "shaman"),
+			(1, "again", int(t3.timestamp()), "other shaman"),
+		]
+		assert format_event_datetime(rows[0][2]) == "2024-01-01 00:00:00"
+		assert len(await db.get_warnings(2)) == 1
+		assert await db.get_warnings(3) == []
+		assert await db.get_high_water_mark() == 3
+		await db.close()
+	asyncio.run(run())
+
+	conn = sqlite3.connect(path)
+	assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+	conn.close()
+
+def test_database_migrations(tmp_path):
+	path = str(tmp_path / "legacy.db")
+	conn = sqlite3.connect(path)
+	conn.execute("CREATE TABLE Events (Event_type INTEGER, Player_id INTEGER, Reason TEXT, Datetime TEXT, Warner TEXT)")
+	conn.execute("INSERT INTO Events VALUES (666, 1, 'old', '2021-05-06 07:08:09.123456', 'shaman')")
+	conn.execute("INSERT INTO Events VALUES (666, 1, 'older', '2020-05-06 07:08:09.123456', 'shaman')")
+	conn.commit()
+
+	assert migrate(conn) == len(MIGRATIONS)
+	assert migrate(conn) == 0
+	assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+
+	rows = conn.execute("SELECT Id, Reason, typeof(Datetime) FROM Events ORDER BY Datetime").fetchall()
+	assert rows == [(2, "older", "integer"), (1, "old", "integer")]
+	dt = conn.execute("SELECT Datetime FROM Events WHERE Id = 1").fetchone()[0]
+	assert format_event_datetime(dt) == "2021-05-06 07:08:09"
+
+	plan = conn.execute("EXPLAIN QUERY PLAN SELECT * FROM Events WHERE Event_type = 666 AND Player_id = 1").fetchall()
+	assert "Events_type_player_datetime" in str(plan)
+	conn.close()
+
+def test_database_sync_wal_snapshot(tmp_path):
+	master_path = str(tmp_path / "master.db")
+	newcomer_path = str(tmp_path / "newcomer.db")
+	archive = str(tmp_path / "archive" / "newcomer.db")
+	t1 = datetime.datetime(2024, 1, 1)
+
+	async def run():
+		master = Database(master_path)
+		newcomer = Database(newcomer_path)
+		await master.add_warnings([(1, "reason", t1, "shaman")])
+		# Ahead of master, so it gets a full snapshot of a WAL-mode DB
+		await newcomer.add_warnings([(2, "other", t1, "shaman")] * 3)
+		payload = await master.make_sync_payload(await newcomer.get_high_water_mark())
+		assert payload[:1] == SYNC_SNAPSHOT
+		assert await newcomer.apply_sync_payload(archive, payload) is None
+		assert await newcomer.get_warnings(1) == await master.get_warnings(1)
+		assert await newcomer.get_warnings(2) == []
+
+		# Snapshots that still have the WAL header (older instances) restore too
+		conn = sqlite3.connect(master_path)
+		snapshot = sqlite3.connect(":memory:")
+		conn.backup(snapshot)
+		data = snapshot.serialize()
+		snapshot.close()
+		conn.close()
+		assert data[18:20] == b"\x02\x02"
+		assert await newcomer.apply_sync_payload(archive, SYNC_SNAPSHOT + zlib.compress(data)) is None
+		assert len(await newcomer.get_warnings(1)) == 1
+
+		await master.close()
+		await newcomer.close()
+	asyncio.run(run())
+
+	conn = sqlite3.connect(newcomer_path)
+	assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+	conn.close()
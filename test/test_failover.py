@@ -0,0 +1,118 @@
+import datetime
+
+from failover import ActionLog, Effect, FailoverNode, Liveness, PendingActionJournal, action_key, elect_master
+from messages import MessageType
+
+T0 = datetime.datetime(2024, 1, 1)
+
+def seconds(s):
+	return T0 + datetime.timedelta(seconds=s)
+
+def test_elect_master():
+	assert elect_master(set()) is None
+	assert elect_master({3, 1, 2}) == 3
+	assert elect_master({1, 2, 3} - {3}) == 2
+
+def test_liveness_lease():
+	liveness = Liveness(interval=10, missed_beats=3)
+	liveness.beat(1, now=T0)
+	assert liveness.expired([1, 2], now=seconds(30)) == []
+	# 2 was never seen, so it got a lease starting at 30s
+	assert liveness.expired([1, 2], now=seconds(31)) == [1]
+	liveness.beat(1, now=seconds(40))
+	assert liveness.expired([1, 2], now=seconds(61)) == [2]
+	liveness.forget(2)
+	assert not liveness.is_alive(2, now=seconds(61))
+
+def test_pending_action_journal():
+	journal = PendingActionJournal()
+	journal.append("a", 2, now=seconds(0))
+	journal.append("b", 2, now=seconds(5))
+	journal.acknowledge(now=seconds(1))
+	assert len(journal) == 1
+
+	journal.append("c", 2, now=seconds(6))
+	assert [e.func for e in journal.drain(now=seconds(10))] == ["b", "c"]
+	assert len(journal) == 0
+
+	journal.append("old", 2, now=seconds(0))
+	journal.append("new", 2, now=seconds(PendingActionJournal.MAX_AGE_SECONDS))
+	assert [e.func for e in journal.drain(now=seconds(PendingActionJournal.MAX_AGE_SECONDS + 1))] == ["new"]
+
+	for i in range(PendingActionJournal.MAX_ENTRIES + 10):
+		journal.append(i, 2, now=seconds(0))
+	assert len(journal) == PendingActionJournal.MAX_ENTRIES
+
+def test_action_log():
+	assert action_key("lobbycreate", 1234) == action_key("lobbycreate", 1234)
+	assert action_key("lobbycreate", 1234) != action_key("lobbycreate", 1235)
+
+	log = ActionLog(max_keys=3)
+	for key in ["a", "b", "c"]:
+		log.add(key)
+	log.add("a")
+	log.add("d")
+	assert "a" in log
+	assert "b" not in log
+	assert len(log) == 3
+
+def test_pending_action_journal_keys():
+	journal = PendingActionJournal()
+	journal.append("keyed1", 2, key="k1", now=seconds(0))
+	journal.append("keyed2", 2, key="k2", now=seconds(0))
+	journal.append("unkeyed", 2, now=seconds(0))
+
+	# An unrelated confirmation doesn't cover keyed actions
+	journal.acknowledge("other", now=seconds(1))
+	assert [e.func for e in journal.drain(now=seconds(2))] == ["keyed1", "keyed2"]
+
+	journal.append("keyed1", 2, key="k1", now=seconds(0))
+	journal.append("keyed2", 2, key="k2", now=seconds(0))
+	journal.acknowledge("k2", now=seconds(1))
+	assert [e.func for e in journal.drain(now=seconds(2))] == ["keyed1"]
+
+def test_failover_node_takes_over_pending_actions():
+	node = FailoverNode(2, 1, heartbeat_interval=10)
+	node.receive(1, MessageType.CONNECT_ACK, "1+1", now=seconds(0))
+	node.initialized = True
+	assert node.master_instance == 1
+	assert node.alive_instances == {1, 2}
+
+	node.defer("shown", 2, key="k1", now=seconds(1))
+	node.defer("lost", 2, key="k2", now=seconds(1))
+	assert node.receive(1, MessageType.ENSURE_DISPLAY, "1:k1|msgid=i5", now=seconds(2)) == [(Effect.SET_RETURN_VALUE, "msgid", 5)]
+	assert node.is_displayed("k1")
+
+	# The master misses its heartbeats, and this instance displays what it never confirmed
+	effects = node.heartbeat(now=seconds(40))
+	assert node.im_master
+	assert (Effect.COM, -1, MessageType.LET_MASTER, "2") in effects
+	assert [e[1].func for e in effects if e[0] == Effect.PERFORM] == ["lost"]
+
+def test_failover_node_follows_the_highest_claim():
+	node = FailoverNode(2, 1, heartbeat_interval=10)
+	node.self_promote()
+	assert node.term == 1
+
+	# A lower claim gets told about ours, a higher one takes over
+	assert node.receive(1, MessageType.LET_MASTER, "1", now=seconds(0)) == [(Effect.COM, 1, MessageType.LET_MASTER, "1")]
+	assert node.im_master
+	assert node.receive(3, MessageType.ENSURE_DISPLAY, "1:k|", now=seconds(1)) == []
+	assert not node.im_master
+	assert node.master_instance == 3
+	assert node.receive(1, MessageType.HEARTBEAT, "1+2", now=seconds(2)) == []
+	assert (node.master_instance, node.term) == (1, 2)
+	assert node.heartbeat(now=seconds(3))[0] == (Effect.COM, -1, MessageType.HEARTBEAT, "1")
+
+def test_failover_node_drops_malformed_ensure_display():
+	node = FailoverNode(2, 1, heartbeat_interval=10)
+	node.receive(1, MessageType.CONNECT_ACK, "1+1", now=seconds(0))
+	for message in ["1:k1|msgid=ix", "1:k2|msgid", "1:k3|msgid=q5"]:
+		assert node.receive(1, MessageType.ENSURE_DISPLAY, message, now=seconds(1)) == []
+		assert not node.is_displayed(message[2:4])
+	assert not node.message_hub.got_message(MessageType.ENSURE_DISPLAY, 2, "msgid", now=seconds(1))
+
+	# The old format, without a term, still confirms the action
+	assert node.receive(1, MessageType.ENSURE_DISPLAY, "k4|msgid=s1:2", now=seconds(2)) == [(Effect.SET_RETURN_VALUE, "msgid", "1:2")]
+	assert node.is_displayed("k4")
+	assert node.message_hub.got_message(MessageType.ENSURE_DISPLAY, 2, "msgid", now=seconds(2))
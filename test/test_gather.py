@@ -0,0 +1,124 @@
+from gather import Gather, GatherRegistry, GatherState, MemberState
+
+class FakeMember:
+	def __init__(self, member_id, display_name):
+		self.id = member_id
+		self.display_name = display_name
+
+def render(state):
+	return state.render("gatherer", "IB", "OK", "NO", 8)
+
+def test_gather_state_transitions():
+	a = FakeMember(1, "a")
+	b = FakeMember(2, "b")
+	c = FakeMember(3, "c")
+	state = GatherState()
+
+	assert state.set(a, MemberState.OKIB)
+	assert not state.set(a, MemberState.OKIB)
+	assert state.set(b, MemberState.OKIB)
+	# laterIB isn't shown, so joining it directly doesn't change the list
+	assert not state.set(c, MemberState.LATERIB)
+	assert state.set(c, MemberState.NOIB)
+	assert state.set(a, MemberState.LATERIB)
+
+	assert state.members(MemberState.OKIB) == [b]
+	assert state.members(MemberState.LATERIB) == [a]
+	assert state.members(MemberState.NOIB) == [c]
+	assert state.get_state(1) == MemberState.LATERIB
+	assert state.get_state(4) is None
+
+	assert state.set(a, MemberState.OKIB)
+	assert state.members(MemberState.OKIB) == [b, a]
+	assert state.count(MemberState.LATERIB) == 0
+
+def test_gather_state_render_cache():
+	a = FakeMember(1, "a")
+	state = GatherState()
+	assert render(state) == "gatherer asks : IB\nOK 0/8 : \nNO : "
+	state.set(a, MemberState.OKIB)
+	text = render(state)
+	assert text == "gatherer asks : IB\nOK 1/8 : a\nNO : "
+
+	# Cached until membership changes
+	a.display_name = "renamed"
+	assert render(state) is text
+	state.set(FakeMember(2, "b"), MemberState.NOIB)
+	assert render(state) == "gatherer asks : IB\nOK 1/8 : renamed\nNO : b"
+
+def test_gather_state_ids():
+	members = {i: FakeMember(i, str(i)) for i in range(1, 5)}
+	state = GatherState()
+	state.set(members[2], MemberState.OKIB)
+	state.set(members[1], MemberState.OKIB)
+	state.set(members[3], MemberState.NOIB)
+	state.set(members[4], MemberState.LATERIB)
+	ids = state.to_ids()
+	assert ids == {MemberState.OKIB: [2, 1], MemberState.LATERIB: [4], MemberState.NOIB: [3]}
+
+	state2 = GatherState()
+	assert state2.load_ids(ids, members.get) == []
+	assert state2.to_ids() == ids
+	assert render(state2) == render(state)
+
+	del members[3]
+	assert state2.load_ids(ids, members.get) == [3]
+
+class FakeChannel:
+	def __init__(self, channel_id):
+		self.id = channel_id
+
+def test_gather_registry_message_index():
+	registry = GatherRegistry()
+	ent = registry.add(Gather(FakeChannel(10)))
+	pub = registry.add(Gather(FakeChannel(20)))
+	assert len(registry) == 2
+	assert registry.get(10) is ent
+
+	assert Gather.parse_message_id_key(ent.get_message_id_key()) == 10
+	assert Gather.parse_message_id_key("lobbymsg10") is None
+	assert registry.set_message_id(10, 100)
+	assert registry.set_message_id(20, 200)
+	assert not registry.set_message_id(30, 300)
+	assert registry.find_by_message(100) is ent
+	assert registry.find_by_message(200) is pub
+
+	# Re-posting the list moves the index to the new message
+	registry.set_message_id(10, 101)
+	assert registry.find_by_message(100) is None
+	assert registry.find_by_message(101) is ent
+	registry.set_message_id(10, None)
+	assert registry.find_by_message(101) is None
+
+	registry.remove(20)
+	assert registry.find_by_message(200) is None
+	assert list(registry) == [ent]
+
+def test_gather_workspace_round_trip():
+	a = FakeMember(1, "a")
+	b = FakeMember(2, "b")
+	gather = Gather(FakeChannel(10))
+	gather.start(a, [a, b])
+	gather.message_id = 100
+	gather.state.set(b, MemberState.NOIB)
+	gather.update_list("IB", "OK", "NO", 2)
+	assert not gather.check_gathered(2)
+
+	members = {1: a, 2: b}
+	loaded, missing = Gather.from_workspace_dict(gather.to_workspace_dict(), gather.channel, a, members.get)
+	assert missing == []
+	assert loaded.active
+	assert loaded.message_id == 100
+	assert loaded.list_content == gather.list_content
+	assert loaded.state.members(MemberState.OKIB) == [a]
+	assert loaded.state.members(MemberState.NOIB) == [b]
+	assert loaded.time == gather.time
+
+	# Retrieving keeps the previous members
+	loaded.state.set(b, MemberState.OKIB)
+	loaded.start(b, [], retrieve=True)
+	assert loaded.check_gathered(2)
+	loaded.gathered = True
+	loaded.start(b, [])
+	assert not loaded.gathered
+	assert loaded.state.count(MemberState.OKIB) == 0
@@ -0,0 +1,51 @@
+import json
+import logging
+import queue
+
+from logqueue import JsonFormatter, NonBlockingQueueHandler, RateLimitFilter
+from logstore import LOG_JSON_LINE_PREFIX
+
+def make_record(name, level, message, *args, **attrs):
+	record = logging.LogRecord(name, level, __file__, 0, message, args, None)
+	record.__dict__.update(attrs)
+	return record
+
+def test_json_formatter():
+	line = JsonFormatter().format(make_record("com", logging.INFO, "from %d: %s", 3, "hi", from_id=3))
+	assert line.startswith(LOG_JSON_LINE_PREFIX)
+	obj = json.loads(line)
+	assert obj["level"] == "INFO"
+	assert obj["logger"] == "com"
+	assert obj["msg"] == "from 3: hi"
+	assert obj["from_id"] == 3
+	assert "args" not in obj and "suppressed" not in obj
+
+def test_rate_limit_filter():
+	now = [0.0]
+	rate_limit = RateLimitFilter({"com": (1, 3)}, clock=lambda: now[0])
+	passed = [rate_limit.filter(make_record("com", logging.INFO, "m")) for _ in range(5)]
+	assert passed == [True, True, True, False, False]
+	# Warnings, and loggers without a limit, always pass
+	assert rate_limit.filter(make_record("com", logging.WARNING, "w"))
+	assert rate_limit.filter(make_record("other", logging.INFO, "m"))
+
+	now[0] = 1.0
+	record = make_record("com.sub", logging.INFO, "m")
+	assert rate_limit.filter(record)
+	assert record.suppressed == 2
+	assert rate_limit.num_dropped == 2
+
+def test_queue_handler_defers_formatting_and_drops_when_full():
+	class Expensive:
+		formatted = 0
+
+		def __str__(self):
+			Expensive.formatted += 1
+			return "expensive"
+
+	handler = NonBlockingQueueHandler(queue.Queue(2))
+	for _ in range(3):
+		handler.handle(make_record("lobbies", logging.INFO, "%s", Expensive()))
+	assert Expensive.formatted == 0
+	assert handler.num_dropped == 1
+	assert handler.queue.get_nowait().getMessage() == "expensive"
@@ -0,0 +1,107 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+
+from logqueue import JsonFormatter
+from logstore import LogSegment, LogStore, SegmentedLogHandler
+
+T0 = datetime.datetime(2024, 3, 1, 12, 0, 0)
+
+def make_record(message, dt):
+	record = logging.LogRecord("test", logging.INFO, __file__, 0, message, None, None)
+	record.created = dt.timestamp()
+	return record
+
+def make_handler(store, max_bytes=1024 * 1024, max_age_seconds=3600):
+	handler = SegmentedLogHandler(store, max_bytes, max_age_seconds)
+	handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s: %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+	return handler
+
+def write_minutes(handler, minutes):
+	for i in range(minutes):
+		handler.emit(make_record("minute {}".format(i), T0 + datetime.timedelta(minutes=i)))
+
+def test_rotates_by_age_and_compresses(tmp_path):
+	store = LogStore(str(tmp_path), "v1")
+	store.load()
+	handler = make_handler(store, max_age_seconds=10 * 60)
+	write_minutes(handler, 25)
+	handler.close()
+
+	segments = store.segments()
+	assert [s.start for s in segments] == ["2024-03-01 12:00:00", "2024-03-01 12:10:00", "2024-03-01 12:20:00"]
+	assert all([s.is_compressed() and s.end is not None for s in segments])
+	assert sorted(os.listdir(str(tmp_path))) == sorted([s.file for s in segments] + ["index.json"])
+
+def test_rotates_by_size_and_prunes(tmp_path):
+	store = LogStore(str(tmp_path), "v1", max_segments=2)
+	store.load()
+	handler = make_handler(store, max_bytes=100)
+	write_minutes(handler, 10)
+	handler.close()
+	assert len(store) == 2
+	assert store.segments()[-1].start == "2024-03-01 12:09:00"
+
+def test_excerpt_slices_across_segments(tmp_path):
+	store = LogStore(str(tmp_path), "v1")
+	store.load()
+	handler = make_handler(store, max_age_seconds=10 * 60)
+	write_minutes(handler, 25)
+	handler.emit(make_record("failed\nTraceback: boom", T0 + datetime.timedelta(minutes=25)))
+
+	# Spans the first two segments, the last one is still open
+	assert [s.start for s in store.find(T0 + datetime.timedelta(minutes=5), T0 + datetime.timedelta(minutes=12))] == [
+		"2024-03-01 12:00:00", "2024-03-01 12:10:00"
+	]
+	lines = gzip.decompress(store.excerpt(T0 + datetime.timedelta(minutes=8), T0 + datetime.timedelta(minutes=11))).decode().splitlines()
+	assert [line.split(": ")[-1] for line in lines] == ["minute 8", "minute 9", "minute 10", "minute 11"]
+
+	lines = gzip.decompress(store.excerpt(T0 + datetime.timedelta(minutes=25), T0 + datetime.timedelta(minutes=30))).decode().splitlines()
+	assert lines[-1] == "Traceback: boom"
+
+	assert store.excerpt(T0 - datetime.timedelta(hours=1), T0 - datetime.timedelta(minutes=1)) is None
+	handler.close()
+
+def test_excerpt_of_segment_compressed_after_lookup(tmp_path):
+	store = LogStore(str(tmp_path), "v1")
+	store.load()
+	handler = make_handler(store)
+	write_minutes(handler, 5)
+
+	# A copy taken before the rotation still has the uncompressed file name
+	stale = [LogSegment(s.file, s.start, s.end) for s in store.segments()]
+	handler.close()
+	assert not stale[0].is_compressed() and store.segments()[0].is_compressed()
+	store.find = lambda start, end: stale
+
+	lines = gzip.decompress(store.excerpt(T0, T0 + datetime.timedelta(minutes=2))).decode().splitlines()
+	assert [line.split(": ")[-1] for line in lines] == ["minute 0", "minute 1", "minute 2"]
+
+def test_load_rebuilds_index_and_finishes_open_segments(tmp_path):
+	store = LogStore(str(tmp_path), "v1")
+	store.load()
+	handler = make_handler(store, max_age_seconds=10 * 60)
+	write_minutes(handler, 15)
+	# Crash: the open segment is never closed, and the index is lost
+	handler._stream.close()
+	os.remove(os.path.join(str(tmp_path), "index.json"))
+
+	store = LogStore(str(tmp_path), "v2")
+	store.load()
+	segments = store.segments()
+	assert [s.start for s in segments] == ["2024-03-01 12:00:00", "2024-03-01 12:10:00"]
+	assert all([s.is_compressed() for s in segments])
+	lines = gzip.decompress(store.excerpt(T0 + datetime.timedelta(minutes=14), T0 + datetime.timedelta(minutes=20))).decode().splitlines()
+	assert len(lines) == 1
+
+def test_excerpt_of_json_lines(tmp_path):
+	store = LogStore(str(tmp_path), "v1")
+	store.load()
+	handler = SegmentedLogHandler(store, 1024 * 1024, 3600)
+	handler.setFormatter(JsonFormatter())
+	write_minutes(handler, 10)
+	lines = gzip.decompress(store.excerpt(T0 + datetime.timedelta(minutes=3), T0 + datetime.timedelta(minutes=4))).decode().splitlines()
+	assert [json.loads(line)["msg"] for line in lines] == ["minute 3", "minute 4"]
+	handler.close()
@@ -0,0 +1,48 @@
+import asyncio
+
+from memory import MemberLRU, read_rss_bytes
+
+class FakeMember:
+	def __init__(self, member_id):
+		self.id = member_id
+		self.guild = "guild"
+
+class FakeGuild:
+	def __init__(self, member_ids):
+		self.remote = {mid: FakeMember(mid) for mid in member_ids}
+		self.queries = []
+
+	def get_member(self, member_id):
+		# Nothing cached, like in low memory mode
+		return None
+
+	async def query_members(self, user_ids, cache):
+		self.queries.append(list(user_ids))
+		return [self.remote[mid] for mid in user_ids if mid in self.remote]
+
+def test_touch_evicts_least_recently_used():
+	lru = MemberLRU(max_size=2)
+	lru.touch(FakeMember(1))
+	lru.touch(FakeMember(2))
+	assert lru.get(1).id == 1
+	lru.touch(FakeMember(3))
+	assert lru.get(2) is None
+	assert [lru.get(i).id for i in [1, 3]] == [1, 3]
+	# Not a guild member
+	lru.touch(None)
+	assert len(lru) == 2
+
+def test_fetch_many_queries_missing_members_in_one_batch():
+	guild = FakeGuild([1, 2, 3])
+	lru = MemberLRU()
+	lru.touch(FakeMember(1))
+	members = asyncio.run(lru.fetch_many(guild, [1, 2, 3, 4, 2]))
+	assert sorted(members.keys()) == [1, 2, 3]
+	assert len(guild.queries) == 1 and sorted(guild.queries[0]) == [2, 3, 4]
+	assert lru.hits == 1 and lru.misses == 3
+	# Now in the LRU
+	members = asyncio.run(lru.fetch_many(guild, [2, 3]))
+	assert len(members) == 2 and len(guild.queries) == 1
+
+def test_read_rss_bytes():
+	assert read_rss_bytes() > 1024 * 1024
@@ -0,0 +1,65 @@
+import asyncio
+import socket
+
+import aiohttp
+import pytest
+
+from metrics import COUNT_BUCKETS, Histogram, MetricsRegistry, MetricsServer, measure_loop_lag
+
+def test_histogram_buckets():
+	histogram = Histogram(buckets=(0.1, 1.0))
+	for value in [0.05, 0.1, 0.5, 0.7, 3.0]:
+		histogram.observe(value)
+	assert histogram.bucket_counts == [2, 2, 1]
+	assert histogram.count == 5
+	assert histogram.sum == pytest.approx(4.35)
+	assert histogram.max == 3.0
+	assert histogram.quantile(0.4) == 0.1
+	assert histogram.quantile(0.5) == 1.0
+	assert histogram.quantile(1.0) == 3.0
+	assert Histogram().quantile(0.5) == 0.0
+
+def test_registry_render():
+	metrics = MetricsRegistry()
+	metrics.counter("com_messages_total", direction="in", type="HEARTBEAT").inc()
+	metrics.counter("com_messages_total", type="HEARTBEAT", direction="in").inc(2)
+	metrics.histogram("lobbies_diffed", buckets=COUNT_BUCKETS).observe(1)
+	metrics.add_collector(lambda m: m.gauge("open_lobbies").set(3))
+	assert len(metrics) == 2
+
+	text = metrics.render_prometheus()
+	assert "# TYPE com_messages_total counter\n" in text
+	assert "com_messages_total{direction=\"in\",type=\"HEARTBEAT\"} 3\n" in text
+	assert "lobbies_diffed_bucket{le=\"0\"} 0\n" in text
+	assert "lobbies_diffed_bucket{le=\"1\"} 1\n" in text
+	assert "lobbies_diffed_bucket{le=\"+Inf\"} 1\n" in text
+	assert "lobbies_diffed_count 1\n" in text
+	assert "open_lobbies 3\n" in text
+
+	lines = metrics.summary_lines()
+	assert "open_lobbies: 3" in lines
+	assert any(line.startswith("lobbies_diffed: n=1") for line in lines)
+
+	with pytest.raises(ValueError):
+		metrics.gauge("com_messages_total")
+
+def test_metrics_server():
+	with socket.socket() as s:
+		s.bind(("127.0.0.1", 0))
+		port = s.getsockname()[1]
+
+	async def run():
+		metrics = MetricsRegistry()
+		metrics.histogram("event_loop_lag_seconds").observe(await measure_loop_lag(0.01))
+		server = MetricsServer(metrics, "127.0.0.1", port)
+		await server.start()
+		try:
+			async with aiohttp.ClientSession() as session:
+				response = await session.get("http://127.0.0.1:{}/metrics".format(port))
+				assert response.status == 200
+				return await response.text()
+		finally:
+			await server.stop()
+
+	text = asyncio.run(run())
+	assert "event_loop_lag_seconds_count 1\n" in text
@@ -0,0 +1,88 @@
+import asyncio
+
+import discord
+
+from lobbies import Lobby, get_lobby_region
+from messages import format_ensure_display_value, parse_ensure_display_value
+from notify import DmFanout, RolePingLimiter
+
+class FakeResponse:
+	status = 403
+	reason = "Forbidden"
+
+class FakeMember:
+	def __init__(self, member_id, dm_closed=False, delay=0.05):
+		self.id = member_id
+		self.name = str(member_id)
+		self.dm_closed = dm_closed
+		self.delay = delay
+		self.received = []
+
+	async def send(self, content):
+		await asyncio.sleep(self.delay)
+		if self.dm_closed:
+			raise discord.Forbidden(FakeResponse(), "Cannot send messages to this user")
+		self.received.append(content)
+
+def test_dm_fanout():
+	async def run():
+		fanout = DmFanout(max_concurrent=4, min_interval=0)
+		members = [FakeMember(i) for i in range(8)] + [FakeMember(100, dm_closed=True)]
+
+		loop = asyncio.get_running_loop()
+		start = loop.time()
+		result = await fanout.send(members, "Time to play !")
+		# 9 sends of 50ms, 4 at a time
+		assert loop.time() - start < 0.3
+		assert len(result.sent) == 8
+		assert [m.id for m, e in result.failed] == [100]
+		assert all(m.received == ["Time to play !"] for m in members[:8])
+
+		# The closed DM is cached and skipped next time
+		result = await fanout.send(members, "again")
+		assert [m.id for m in result.skipped] == [100]
+		assert len(result.failed) == 0
+		assert "skipped 1" in result.summary()
+	asyncio.run(run())
+
+def test_dm_fanout_closed_ttl():
+	fanout = DmFanout(closed_dm_ttl=0)
+	fanout.mark_dm_closed(1)
+	assert not fanout.is_dm_closed(1)
+	fanout = DmFanout()
+	fanout.mark_dm_closed(1)
+	assert fanout.is_dm_closed(1)
+	assert not fanout.is_dm_closed(2)
+
+class FakeRole:
+	def __init__(self, role_id):
+		self.id = role_id
+
+def test_lobby_region():
+	assert get_lobby_region("usw") == "na"
+	assert get_lobby_region("New York") == "na"
+	assert get_lobby_region("Amsterdam") == "eu"
+	assert get_lobby_region("kr") == "kr"
+	assert get_lobby_region("somewhere") is None
+
+def test_lobby_mentions_sync():
+	# New lobby messages return their ID and mentioned roles to every instance
+	key = Lobby.MESSAGE_KEY_PREFIX + "42"
+	assert Lobby.parse_message_id_key(key) == 42
+	assert Lobby.parse_message_id_key("okibmsg42") is None
+	assert Lobby.parse_message_id_key("lobbymsgx") is None
+	message = format_ensure_display_value(key, [900, 1228087653929455646, 766268372252884994])
+	assert parse_ensure_display_value(message) == (key, [900, 1228087653929455646, 766268372252884994])
+
+def test_role_ping_limiter():
+	now = [0.0]
+	limiter = RolePingLimiter(min_interval=60, clock=lambda: now[0])
+	eu, na = FakeRole(1), FakeRole(2)
+
+	assert limiter.take([eu]) == [eu]
+	now[0] = 30
+	assert limiter.take([eu, na]) == [na]
+	now[0] = 61
+	assert limiter.take([eu, na]) == [eu]
+	assert limiter.num_pinged == 3
+	assert limiter.num_suppressed == 2
@@ -0,0 +1,39 @@
+from pagination import NEXT_PAGE_EMOJI, PREV_PAGE_EMOJI, PagedMessage, Paginator, is_page_message_key, page_message_key, paginate_lines
+
+def test_paginate_lines():
+	assert paginate_lines([]) == [""]
+	assert paginate_lines(["a", "b"]) == ["a\nb"]
+	assert paginate_lines(["aaa", "bbb", "ccc"], max_chars=7) == ["aaa\nbbb", "ccc"]
+	assert paginate_lines(["a" * 10], max_chars=6) == ["aaa..."]
+
+	lines = ["warning {}".format(i) for i in range(1000)]
+	pages = paginate_lines(lines)
+	assert all(len(page) <= 4096 for page in pages)
+	assert "\n".join(pages).split("\n") == lines
+	assert len(pages) == 3
+
+def test_paged_message():
+	paged = PagedMessage("Pedigree", ["one", "two"], "pagemsg1")
+	assert paged.to_embed().description == "one"
+	assert not paged.turn(PREV_PAGE_EMOJI)
+	assert paged.turn(NEXT_PAGE_EMOJI)
+	assert not paged.turn(NEXT_PAGE_EMOJI)
+	embed = paged.to_embed()
+	assert embed.description == "two"
+	assert embed.footer.text == "Page 2/2"
+
+def test_paginator_find():
+	paginator = Paginator()
+	for i in range(Paginator.MAX_MESSAGES + 1):
+		paginator.add(PagedMessage("Pedigree", ["page"], page_message_key(i)))
+		assert paginator.set_message_id(page_message_key(i), 100 + i)
+	assert len(paginator) == Paginator.MAX_MESSAGES
+
+	assert paginator.find(1) is None
+	assert paginator.find(105).message_key == "pagemsg5"
+	assert is_page_message_key("pagemsg5")
+
+	# Evicted messages forget their ID
+	assert paginator.find(100) is None
+	assert not paginator.set_message_id(page_message_key(0), 100)
+	assert paginator.find(100) is None
@@ -0,0 +1,79 @@
+import asyncio
+
+from permissions import Rank, RankResolver, requires_rank
+
+# Roles compare by position, like discord.Role
+PEON_ROLE = 10
+SHAMAN_ROLE = 20
+
+class FakeMember:
+	def __init__(self, member_id, top_role):
+		self.id = member_id
+		self.roles = [0, top_role]
+
+class FakeMessage:
+	def __init__(self, author):
+		self.author = author
+
+class FakeContext:
+	def __init__(self, author):
+		self.message = FakeMessage(author)
+
+def make_resolver(now):
+	resolver = RankResolver(ttl=60, clock=lambda: now[0])
+	resolver.set_roles({Rank.PEON: PEON_ROLE, Rank.SHAMAN: SHAMAN_ROLE})
+	return resolver
+
+def test_rank_from_top_role():
+	resolver = make_resolver([0.0])
+	assert resolver.rank(FakeMember(1, 5)) == Rank.NONE
+	assert resolver.rank(FakeMember(2, PEON_ROLE)) == Rank.PEON
+	assert resolver.rank(FakeMember(3, 15)) == Rank.PEON
+	assert resolver.rank(FakeMember(4, 25)) == Rank.SHAMAN
+	assert resolver.at_least(FakeMember(4, 25), Rank.PEON)
+	# A user from a DM has no roles
+	assert resolver.rank(object()) == Rank.NONE
+
+def test_rank_is_cached_until_invalidated_or_expired():
+	now = [0.0]
+	resolver = make_resolver(now)
+	member = FakeMember(1, PEON_ROLE)
+	assert resolver.rank(member) == Rank.PEON
+	assert resolver.rank(member) == Rank.PEON
+	assert resolver.hits == 1 and resolver.misses == 1
+
+	resolver.invalidate(member.id)
+	assert resolver.rank(member) == Rank.PEON
+	assert resolver.misses == 2
+
+	now[0] = 61.0
+	assert resolver.rank(member) == Rank.PEON
+	assert resolver.misses == 3
+
+def test_rank_follows_the_member_passed_in():
+	# Without the member cache, demotions don't come with a member update
+	resolver = make_resolver([0.0])
+	member = FakeMember(1, SHAMAN_ROLE)
+	assert resolver.rank(member) == Rank.SHAMAN
+	assert resolver.rank(FakeMember(1, PEON_ROLE)) == Rank.PEON
+	member.roles = [0]
+	assert resolver.rank(member) == Rank.NONE
+	assert resolver.misses == 3
+
+def test_requires_rank():
+	resolver = make_resolver([0.0])
+	ran = []
+	denied = []
+
+	async def on_denied(ctx):
+		denied.append(ctx.message.author.id)
+
+	@requires_rank(resolver, Rank.SHAMAN, on_denied=on_denied)
+	async def command(ctx, arg=None):
+		ran.append((ctx.message.author.id, arg))
+
+	asyncio.run(command(FakeContext(FakeMember(1, PEON_ROLE)), "x"))
+	asyncio.run(command(FakeContext(FakeMember(2, SHAMAN_ROLE)), arg="y"))
+	assert ran == [(2, "y")]
+	assert denied == [1]
+	assert command.__name__ == "command"
@@ -0,0 +1,78 @@
+from resolver import DiscordResolver
+
+class FakeObject:
+	def __init__(self, object_id, name):
+		self.id = object_id
+		self.name = name
+
+class FakeGuild(FakeObject):
+	def __init__(self, guild_id, name, channels):
+		super().__init__(guild_id, name)
+		self.channels = {c.id: c for c in channels}
+		self.scans = 0
+
+	@property
+	def text_channels(self):
+		self.scans += 1
+		return list(self.channels.values())
+
+	def get_channel(self, channel_id):
+		return self.channels.get(channel_id)
+
+class FakeClient:
+	def __init__(self, guilds):
+		self.by_id = {g.id: g for g in guilds}
+		self.scans = 0
+
+	@property
+	def guilds(self):
+		self.scans += 1
+		return list(self.by_id.values())
+
+	def get_guild(self, guild_id):
+		return self.by_id.get(guild_id)
+
+def make_client():
+	guild = FakeGuild(1, "IB CAFETERIA", [FakeObject(10, "pub-games"), FakeObject(11, "general-chat")])
+	return FakeClient([FakeGuild(2, "other", []), guild]), guild
+
+def resolve(resolver, client):
+	guild = resolver.guild(client, "IB CAFETERIA")
+	return guild, resolver.text_channel(guild, "pub-games"), resolver.text_channel(guild, "general-chat")
+
+def test_resolver_uses_cached_ids(tmp_path):
+	cache_path = str(tmp_path / "ids.json")
+	client, guild = make_client()
+
+	resolver = DiscordResolver(cache_path)
+	guild_ib, bnet, ent = resolve(resolver, client)
+	assert (guild_ib.id, bnet.id, ent.id) == (1, 10, 11)
+	assert resolver.misses == 3
+	resolver.save()
+
+	# Next boot resolves everything by ID, without scanning
+	client, guild = make_client()
+	resolver = DiscordResolver(cache_path)
+	guild_ib, bnet, ent = resolve(resolver, client)
+	assert (guild_ib.id, bnet.id, ent.id) == (1, 10, 11)
+	assert resolver.hits == 3
+	assert client.scans == 0
+	assert guild.scans == 0
+
+def test_resolver_stale_ids(tmp_path):
+	cache_path = str(tmp_path / "ids.json")
+	with open(cache_path, "w") as f:
+		f.write("not json")
+	client, guild = make_client()
+	resolver = DiscordResolver(cache_path)
+	resolve(resolver, client)
+	resolver.save()
+
+	# Channel renamed and re-created under the configured name
+	del guild.channels[10]
+	guild.channels[12] = FakeObject(12, "pub-games")
+	resolver = DiscordResolver(cache_path)
+	guild_ib, bnet, ent = resolve(resolver, client)
+	assert bnet.id == 12
+	assert (resolver.hits, resolver.misses) == (2, 1)
+	assert resolver.text_channel(guild, "nope") is None
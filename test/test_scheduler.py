@@ -0,0 +1,151 @@
+import asyncio
+import time
+
+from discord.http import Route
+
+from scheduler import DiscordScheduler, JobShed, Priority, get_request_route, get_route
+
+ROUTE = ("send", 1)
+
+class FakeChannel:
+	def __init__(self, channel_id):
+		self.id = channel_id
+
+	async def send(self, content):
+		return content
+
+class FakeMessage:
+	def __init__(self, channel):
+		self.channel = channel
+
+	async def edit(self, content):
+		return content
+
+def make_call(scheduler, calls, name, num_requests=1):
+	# Stands for a Discord call, its API requests are charged like instrument_http does
+	async def call():
+		for i in range(num_requests):
+			await scheduler.charge(ROUTE)
+		calls.append(name)
+		return name
+	return call
+
+def test_get_route():
+	channel = FakeChannel(7)
+	assert get_route(channel.send, ()) == ("send", 7)
+	assert get_route(FakeMessage(channel).edit, ()) == ("edit", 7)
+
+	async def remove_reaction(channel_id, message_id):
+		pass
+	assert get_route(remove_reaction, (7, 8)) == ("reaction", 7)
+	assert get_route(make_call(None, [], "x"), ()) is None
+
+def test_get_request_route():
+	assert get_request_route(Route("POST", "/channels/{channel_id}/messages", channel_id=7)) == ("send", 7)
+	assert get_request_route(Route("GET", "/channels/{channel_id}/messages/{message_id}", channel_id=7, message_id=8)) == ("fetch", 7)
+	assert get_request_route(Route(
+		"PUT", "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me", channel_id=7, message_id=8, emoji="x"
+	)) == ("reaction", 7)
+	assert get_request_route(Route("GET", "/guilds/{guild_id}/members/{user_id}", guild_id=1, user_id=2)) is None
+
+def test_queued_calls_run_by_priority():
+	calls = []
+
+	async def run():
+		scheduler = DiscordScheduler({"send": (1, 0.05)}, (100, 1.0))
+		# Takes the only token, the rest wait for the route's budget
+		await scheduler.submit(make_call(scheduler, calls, "first"), Priority.COMMAND, ROUTE)
+		results = await asyncio.gather(
+			scheduler.submit(make_call(scheduler, calls, "lobby"), Priority.LOBBY_EDIT, ROUTE),
+			scheduler.submit(make_call(scheduler, calls, "command"), Priority.COMMAND, ROUTE),
+			scheduler.submit(make_call(scheduler, calls, "gather"), Priority.GATHER, ROUTE),
+		)
+		return scheduler, results
+
+	scheduler, results = asyncio.run(run())
+	assert calls == ["first", "gather", "command", "lobby"]
+	assert results == ["lobby", "command", "gather"]
+	assert scheduler.num_immediate == 1
+	assert scheduler.num_queued == 3
+	assert scheduler.num_calls == 4
+	assert len(scheduler) == 0
+
+def test_each_call_of_a_job_is_charged():
+	calls = []
+
+	async def run():
+		scheduler = DiscordScheduler({"send": (1, 0.05)}, (100, 1.0))
+		start = time.monotonic()
+		# No route guess (a composite action), its three calls still wait for the route's budget
+		await scheduler.submit(make_call(scheduler, calls, "composite", num_requests=3), Priority.COMMAND, None)
+		return scheduler, time.monotonic() - start
+
+	scheduler, elapsed = asyncio.run(run())
+	assert calls == ["composite"]
+	assert scheduler.num_calls == 3
+	assert elapsed >= 0.09
+	# The global token the job started with was never used by a call on its route, and was given back
+	assert scheduler.budget(None) > 96
+
+def test_unscheduled_calls_never_wait():
+	async def run():
+		scheduler = DiscordScheduler({"send": (1, 10.0)}, (100, 1.0))
+		start = time.monotonic()
+		for i in range(3):
+			await scheduler.charge(ROUTE)
+		return scheduler, time.monotonic() - start
+
+	scheduler, elapsed = asyncio.run(run())
+	assert elapsed < 0.05
+	assert scheduler.num_unscheduled_calls == 3
+	# Still charged, so scheduled calls on the route wait longer
+	assert scheduler.budget(ROUTE) < -1
+
+def test_queued_calls_coalesce():
+	calls = []
+
+	async def run():
+		scheduler = DiscordScheduler({"send": (1, 0.05)}, (100, 1.0))
+		await scheduler.submit(make_call(scheduler, calls, "first"), Priority.COMMAND, ROUTE)
+		return scheduler, await asyncio.gather(
+			scheduler.submit(make_call(scheduler, calls, "edit1"), Priority.LOBBY_EDIT, ROUTE, coalesce_key="lobbymsg1"),
+			scheduler.submit(make_call(scheduler, calls, "edit2"), Priority.LOBBY_EDIT, ROUTE, coalesce_key="lobbymsg1"),
+		)
+
+	scheduler, results = asyncio.run(run())
+	assert calls == ["first", "edit2"]
+	assert results == ["edit2", "edit2"]
+	assert scheduler.num_coalesced == 1
+
+def test_sheddable_calls_are_dropped_when_budget_is_short():
+	calls = []
+
+	async def run():
+		scheduler = DiscordScheduler({"send": (1, 0.2)}, (100, 1.0), shed_after=0.05)
+		await scheduler.submit(make_call(scheduler, calls, "first"), Priority.COMMAND, ROUTE)
+		return scheduler, await asyncio.gather(
+			scheduler.submit(make_call(scheduler, calls, "cosmetic"), Priority.LOBBY_EDIT, ROUTE, sheddable=True),
+			scheduler.submit(make_call(scheduler, calls, "closed"), Priority.LOBBY_EDIT, ROUTE),
+			return_exceptions=True
+		)
+
+	scheduler, results = asyncio.run(run())
+	assert calls == ["first", "closed"]
+	assert isinstance(results[0], JobShed)
+	assert results[1] == "closed"
+	assert scheduler.num_shed == 1
+
+def test_errors_reach_the_caller():
+	async def fail():
+		raise ValueError("boom")
+
+	async def run():
+		scheduler = DiscordScheduler({"send": (1, 0.05)}, (100, 1.0))
+		await scheduler.submit(make_call(scheduler, [], "first"), Priority.COMMAND, ROUTE)
+		try:
+			await scheduler.submit(fail, Priority.COMMAND, ROUTE)
+		except ValueError:
+			return True
+		return False
+
+	assert asyncio.run(run())
@@ -0,0 +1,83 @@
+from simulation import SimConfig, Simulation, run_scenario
+
+def test_simulation_is_deterministic():
+	config = SimConfig(seed=7, com_loss=0.1)
+	kwargs = {"keyed_fraction": 0.5, "crashes": [(200, None)], "restarts": [(300, 1)]}
+	a = run_scenario(config, **kwargs)
+	b = run_scenario(config, **kwargs)
+	assert a.summary() == b.summary()
+	assert a.promotions == b.promotions
+	assert a.com_messages == b.com_messages
+
+def test_first_instance_becomes_master():
+	sim = Simulation(SimConfig(), 3)
+	for bot_id in sim.instances:
+		sim.start((bot_id - 1) * 10, bot_id)
+	sim.run(60)
+	assert [i.bot_id for i in sim.masters()] == [1]
+	for instance in sim.instances.values():
+		assert instance.node.initialized
+		assert instance.node.master_instance == 1
+		assert instance.node.alive_instances == {1, 2, 3}
+
+def test_no_duplicates_or_misses_without_faults():
+	summary = run_scenario(SimConfig(seed=1), keyed_fraction=0.5).summary()
+	assert summary["actions"] > 0
+	assert summary["duplicates"] == 0
+	assert summary["missed"] == 0
+	assert summary["max_masters"] == 1
+
+def test_failover_is_bounded_by_missed_heartbeats():
+	config = SimConfig(seed=3, heartbeat_interval=5, missed_beats=3)
+	result = run_scenario(config, crashes=[(200, None)])
+	summary = result.summary()
+	assert summary["failovers"] == 1
+	assert summary["failed_failovers"] == 0
+	assert summary["max_failover_seconds"] <= config.heartbeat_interval * (config.missed_beats + 1)
+	# The highest remaining ID takes over, and the journal covers actions during the gap
+	assert result.promotions[-1][1] == 3
+	assert summary["missed"] == 0
+
+def test_no_failover_when_every_instance_crashed():
+	result = run_scenario(SimConfig(), num_instances=2, crashes=[(100, 1), (100, 2)])
+	assert result.summary()["failed_failovers"] == 1
+	assert result.missed() > 0
+
+def run_seeds(config_kwargs, seeds=5, **kwargs):
+	# Totals over seeds, the worst case for masters, like benchmarks/bench_failover.py
+	total = {"duplicates": 0, "missed": 0, "max_masters": 0}
+	for seed in range(seeds):
+		summary = run_scenario(SimConfig(seed=seed, **config_kwargs), **kwargs).summary()
+		total["duplicates"] += summary["duplicates"]
+		total["missed"] += summary["missed"]
+		total["max_masters"] = max(total["max_masters"], summary["max_masters"])
+	return total
+
+def test_lossy_com_stays_within_bounds():
+	# Regression bounds, the same as bench_failover.py's limits for these scenarios
+	steady = run_seeds({"com_loss": 0.1})
+	assert steady["duplicates"] == 0
+	assert steady["missed"] == 0
+	assert steady["max_masters"] == 1
+
+	crash = run_seeds({"com_loss": 0.1}, crashes=[(200, None)])
+	assert crash["duplicates"] <= 20
+	assert crash["missed"] == 0
+	assert crash["max_masters"] == 1
+
+	window = run_seeds({"com_loss": 0.1, "ensure_display_window": 5}, crashes=[(200, None)], keyed_fraction=0.0)
+	assert window["duplicates"] == 0
+	assert window["missed"] <= 5
+
+def test_masters_converge_on_the_highest_term():
+	sim = Simulation(SimConfig(), 3)
+	for bot_id in sim.instances:
+		sim.start((bot_id - 1) * 10, bot_id)
+	sim.run(60)
+	# 3 lost track of the master and took over, and 1 missed its LET_MASTER
+	sim.instances[3].node.self_promote()
+	sim.run(90)
+	assert [i.bot_id for i in sim.masters()] == [3]
+	for instance in sim.instances.values():
+		assert instance.node.master_instance == 3
+		assert instance.node.term == 2
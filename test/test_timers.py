@@ -0,0 +1,80 @@
+import asyncio
+
+from timers import Debouncer, TimerWheel
+
+def test_timer_wheel_fires_in_order():
+	async def run():
+		wheel = TimerWheel(tick=0.01, num_slots=8)
+		fired = []
+		def make_callback(name):
+			async def callback():
+				fired.append(name)
+			return callback
+
+		# Delays beyond one wheel revolution must wait for their round
+		wheel.schedule(0.15, make_callback("c"))
+		wheel.schedule(0.02, make_callback("a"))
+		wheel.schedule(0.05, make_callback("b"))
+		assert len(wheel) == 3
+		await asyncio.sleep(0.1)
+		assert fired == ["a", "b"]
+		await asyncio.sleep(0.1)
+		assert fired == ["a", "b", "c"]
+		assert len(wheel) == 0
+		assert wheel.stats()["fired"] == 3
+		assert wheel.stats()["max_lag"] >= 0
+	asyncio.run(run())
+
+def test_timer_wheel_cancel():
+	async def run():
+		wheel = TimerWheel(tick=0.01)
+		fired = []
+		async def callback():
+			fired.append(True)
+
+		handle = wheel.schedule(0.02, callback)
+		for _ in range(5):
+			wheel.schedule(0.02, callback, category="backup")
+		wheel.schedule(0.03, callback, category="other")
+		assert wheel.count("backup") == 5
+
+		wheel.cancel(handle)
+		wheel.cancel(handle)
+		assert wheel.cancel_category("backup") == 5
+		assert wheel.cancel_category("backup") == 0
+		assert len(wheel) == 1
+		await asyncio.sleep(0.1)
+		assert fired == [True]
+		assert wheel.stats()["cancelled"] == 6
+
+		# The driver task stops when idle and restarts on the next schedule
+		wheel.schedule(0.01, callback)
+		await asyncio.sleep(0.05)
+		assert fired == [True, True]
+	asyncio.run(run())
+
+def test_debouncer():
+	async def run():
+		wheel = TimerWheel(tick=0.01)
+		calls = []
+		state = {"value": 0}
+		async def flush():
+			calls.append(state["value"])
+
+		debouncer = Debouncer(wheel, 0.05, flush)
+		for i in range(10):
+			state["value"] = i
+			debouncer.request()
+		assert debouncer.pending()
+		await asyncio.sleep(0.1)
+		# One call, seeing the latest state
+		assert calls == [9]
+		assert not debouncer.pending()
+
+		debouncer.request()
+		debouncer.cancel()
+		await asyncio.sleep(0.1)
+		assert calls == [9]
+		assert debouncer.requests == 11
+		assert debouncer.calls == 1
+	asyncio.run(run())
@@ -0,0 +1,49 @@
+import os
+import subprocess
+
+import pytest
+
+from version import StartupTimer, get_source_version, read_head_sha, read_version_cache
+
+def git(root, *args):
+	subprocess.run(["git", *args], cwd=root, check=True, capture_output=True)
+
+@pytest.fixture
+def repo(tmp_path):
+	git(tmp_path, "init", "-q")
+	for i in range(3):
+		git(tmp_path, "-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "--allow-empty", "-m", str(i))
+	return tmp_path
+
+def test_read_head_sha(repo):
+	sha = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo, check=True, capture_output=True, text=True).stdout.strip()
+	assert read_head_sha(str(repo)) == sha
+	git(repo, "pack-refs", "--all")
+	assert read_head_sha(str(repo)) == sha
+	assert read_head_sha(str(repo / "nothere")) is None
+
+def test_source_version_cache(repo):
+	cache_path = str(repo / "version_cache")
+	assert get_source_version(str(repo), cache_path) == 3
+	sha, count = read_version_cache(cache_path)
+	assert sha == read_head_sha(str(repo))
+	assert count == 3
+
+	# A cache hit doesn't count commits
+	with open(cache_path, "w") as f:
+		f.write("{} 42\n".format(sha))
+	assert get_source_version(str(repo), cache_path) == 42
+
+	# A new HEAD invalidates it
+	git(repo, "-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "--allow-empty", "-m", "3")
+	assert get_source_version(str(repo), cache_path) == 4
+
+def test_startup_timer():
+	timer = StartupTimer(start=0.0)
+	timer.mark("imports")
+	timer.mark("imports")
+	timer.mark("login")
+	assert [name for name, _ in timer.phases] == ["imports", "login"]
+	assert timer.has_phase("login")
+	assert timer.total() == pytest.approx(sum(seconds for _, seconds in timer.phases))
+	assert timer.report().startswith("Startup took")
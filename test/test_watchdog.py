@@ -0,0 +1,31 @@
+import asyncio
+import logging
+import time
+
+from watchdog import LoopWatchdog
+
+def block_the_loop():
+	time.sleep(0.3)
+
+def test_watchdog_samples_blocking_call():
+	lags = []
+
+	async def run():
+		watchdog = LoopWatchdog(0.1, 0.02, logging.getLogger("test_watchdog"), on_lag=lags.append)
+		watchdog.start()
+		await asyncio.sleep(0.1)
+		assert watchdog.num_stalls == 0
+		block_the_loop()
+		await asyncio.sleep(0.1)
+		await watchdog.stop()
+		return watchdog
+
+	watchdog = asyncio.run(run())
+	assert watchdog.num_stalls == 1
+	stall = watchdog.stalls[0]
+	assert stall.ended
+	assert 0.2 < stall.duration < 0.5
+	assert "block_the_loop" in "".join(stall.stack)
+	assert "time.sleep" in stall.location()
+	assert len(watchdog.report_lines()) == 1
+	assert max(lags) > 0.2
@@ -0,0 +1,82 @@
+import pickle
+
+import pytest
+
+from lobbies import Lobby
+from workspace import WORKSPACE_SCHEMA_VERSION, encode_workspace, decode_workspace
+
+def make_workspace():
+	lobby = Lobby({
+		"id": 1234,
+		"name": "ib pls",
+		"map": "Impossible.Bosses.v1.12.2",
+		"host": "someone",
+		"location": "France",
+		"slots_taken": 3,
+		"slots_total": 8,
+	}, is_ent=True)
+	lobby.mention_role_ids = [766268372252884994]
+	return {
+		"open_lobbies": [lobby.to_workspace_dict()],
+		"lobby_message_ids": {lobby.get_message_id_key(): 987654321},
+		"gathers": [{
+			"channel_id": 55,
+			"active": True,
+			"message_id": 66,
+			"list_content": "",
+			"okib_member_ids": [1, 2, 3],
+			"laterib_member_ids": [],
+			"noib_member_ids": [4],
+			"gatherer_id": 1,
+			"gathered": False,
+			"gather_time": 1700000000.5,
+		}, {
+			"channel_id": 56,
+			"active": False,
+			"message_id": None,
+			"list_content": "",
+			"okib_member_ids": [],
+			"laterib_member_ids": [],
+			"noib_member_ids": [],
+			"gatherer_id": None,
+			"gathered": False,
+			"gather_time": 1700000000,
+		}],
+	}
+
+def test_workspace_round_trip():
+	workspace = make_workspace()
+	data = encode_workspace(workspace)
+	assert isinstance(data, bytes)
+
+	for buffer in [data, bytearray(data), memoryview(data)]:
+		decoded = decode_workspace(buffer)
+		assert decoded["schema"] == WORKSPACE_SCHEMA_VERSION
+		for key, value in workspace.items():
+			assert decoded[key] == value
+
+	lobby = Lobby.from_workspace_dict(decoded["open_lobbies"][0])
+	assert lobby.id == 1234
+	assert lobby.is_ent
+	assert lobby.server == "France"
+	assert lobby.mention_role_ids == [766268372252884994]
+	assert lobby.subscribers == []
+	assert not lobby.is_updated(Lobby.from_workspace_dict(workspace["open_lobbies"][0]))
+
+@pytest.mark.parametrize("data", [
+	b"not json",
+	b"[]",
+	pickle.dumps({"open_lobbies": []}),
+	encode_workspace(make_workspace()).replace(
+		b"\"schema\":" + str(WORKSPACE_SCHEMA_VERSION).encode(), b"\"schema\":0"
+	),
+	encode_workspace(make_workspace()).replace(b"\"noib_member_ids\":[4]", b"\"noib_member_ids\":[\"4\"]"),
+	encode_workspace(make_workspace()).replace(b"\"gathered\":false,", b""),
+	encode_workspace(make_workspace()).replace(b"[766268372252884994]", b"[\"766268372252884994\"]"),
+	encode_workspace(make_workspace()).replace(b"\"France\"", b"7"),
+	encode_workspace(make_workspace()).replace(b"\"France\",", b""),
+	encode_workspace(make_workspace()).replace(b"\"channel_id\":56", b"\"channel_id\":55"),
+])
+def test_workspace_rejects_invalid(data):
+	with pytest.raises(ValueError):
+		decode_workspace(data)
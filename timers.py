@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import math
+import traceback
+
+
+class TimerHandle:
+    __slots__ = ["deadline", "target_tick", "callback", "category", "cancelled"]
+
+    def __init__(self, deadline, target_tick, callback, category):
+        self.deadline = deadline
+        self.target_tick = target_tick
+        self.callback = callback
+        self.category = category
+        self.cancelled = False
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel driven by a single asyncio task, replacing one sleeping task per timer.
+    Scheduling and cancelling a handle are O(1), and timers can be cancelled in bulk by category.
+    The driver task only runs while timers are pending.
+    """
+    def __init__(self, tick=0.1, num_slots=512):
+        self.tick = tick
+        self._slots = [dict() for _ in range(num_slots)]
+        self._categories = {}
+        self._count = 0
+        self._task = None
+        self._start = 0.0
+        self._processed_tick = 0
+        # metrics
+        self.fired = 0
+        self.cancelled = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, delay, callback, category=None):
+        """
+        Calls the coroutine function `callback` after `delay` seconds. Returns a handle for cancel().
+        """
+        loop = asyncio.get_event_loop()
+        if self._task is None or self._task.done():
+            self._start = loop.time()
+            self._processed_tick = 0
+            self._task = asyncio.ensure_future(self._run())
+
+        deadline = loop.time() + delay
+        target_tick = max(math.ceil((deadline - self._start) / self.tick), self._processed_tick + 1)
+        handle = TimerHandle(deadline, target_tick, callback, category)
+        self._slots[target_tick % len(self._slots)][handle] = None
+        self._categories.setdefault(category, {})[handle] = None
+        self._count += 1
+        return handle
+
+    def _remove(self, handle):
+        del self._slots[handle.target_tick % len(self._slots)][handle]
+        category = self._categories[handle.category]
+        del category[handle]
+        if len(category) == 0:
+            del self._categories[handle.category]
+        self._count -= 1
+
+    def cancel(self, handle):
+        if handle.cancelled:
+            return
+        handle.cancelled = True
+        self._remove(handle)
+        self.cancelled += 1
+
+    def cancel_category(self, category):
+        handles = list(self._categories.get(category, {}).keys())
+        for handle in handles:
+            self.cancel(handle)
+        return len(handles)
+
+    def count(self, category):
+        return len(self._categories.get(category, {}))
+
+    def stats(self):
+        return {
+            "pending": self._count,
+            "fired": self.fired,
+            "cancelled": self.cancelled,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+            "tasks": len(asyncio.all_tasks()),
+        }
+
+    def _fire(self, handle, now):
+        self._remove(handle)
+        handle.cancelled = True
+        self.fired += 1
+        self.last_lag = max(now - handle.deadline, 0.0)
+        self.max_lag = max(self.max_lag, self.last_lag)
+        asyncio.ensure_future(self._call(handle))
+
+    async def _call(self, handle):
+        try:
+            await handle.callback()
+        except Exception as e:
+            logging.error("Timer callback failed: {}".format(e))
+            traceback.print_exc()
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while self._count > 0:
+            next_tick_time = self._start + (self._processed_tick + 1) * self.tick
+            await asyncio.sleep(max(next_tick_time - loop.time(), 0))
+
+            now = loop.time()
+            current_tick = int((now - self._start) / self.tick)
+            while self._processed_tick < current_tick:
+                self._processed_tick += 1
+                slot = self._slots[self._processed_tick % len(self._slots)]
+                due = [h for h in slot if h.target_tick <= self._processed_tick]
+                for handle in due:
+                    self._fire(handle, now)
+
+
+class Debouncer:
+    """
+    Coalesces repeated requests into at most one call of the coroutine function `func` per `window` seconds.
+    The call happens at the end of the window, so it sees the latest state.
+    """
+    def __init__(self, timers, window, func, category=None):
+        self._timers = timers
+        self._window = window
+        self._func = func
+        self._category = category
+        self._handle = None
+        # metrics
+        self.requests = 0
+        self.calls = 0
+
+    def pending(self):
+        return self._handle is not None
+
+    def request(self):
+        self.requests += 1
+        if self._handle is None:
+            self._handle = self._timers.schedule(self._window, self._call, category=self._category)
+
+    def cancel(self):
+        if self._handle is not None:
+            self._timers.cancel(self._handle)
+            self._handle = None
+
+    async def _call(self):
+        self._handle = None
+        self.calls += 1
+        await self._func()
@@ -0,0 +1,127 @@
+import logging
+import os
+import subprocess
+import time
+
+VERSION_CACHE_FILE_NAME = ".source_version"
+
+
+def _read_ref(git_dir, ref):
+    ref_path = os.path.join(git_dir, *ref.split("/"))
+    if os.path.isfile(ref_path):
+        with open(ref_path, "r") as f:
+            return f.read().strip()
+
+    packed_refs_path = os.path.join(git_dir, "packed-refs")
+    if os.path.isfile(packed_refs_path):
+        with open(packed_refs_path, "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    return None
+
+
+def read_head_sha(root_dir):
+    """
+    Reads the HEAD commit sha straight from the .git directory, without spawning git.
+    Returns None for layouts this doesn't handle (e.g. worktrees, where .git is a file).
+    """
+    git_dir = os.path.join(root_dir, ".git")
+    head_path = os.path.join(git_dir, "HEAD")
+    if not os.path.isfile(head_path):
+        return None
+    with open(head_path, "r") as f:
+        head = f.read().strip()
+    if head.startswith("ref:"):
+        return _read_ref(git_dir, head[len("ref:"):].strip())
+    return head
+
+
+def _git(root_dir, *args):
+    return subprocess.run(
+        ["git", *args], cwd=root_dir, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def count_commits(root_dir):
+    """
+    Number of commits reachable from HEAD. Uses the git CLI, and only falls back to gitpython
+    (imported here, it's slow to import) if git isn't on the PATH.
+    """
+    try:
+        return int(_git(root_dir, "rev-list", "--count", "HEAD"))
+    except FileNotFoundError:
+        logging.warning("git not found, counting commits with gitpython")
+        import git
+        return sum(1 for _ in git.Repo(root_dir).iter_commits("HEAD"))
+
+
+def read_version_cache(cache_path):
+    try:
+        with open(cache_path, "r") as f:
+            sha, count = f.read().split()
+        return sha, int(count)
+    except (OSError, ValueError):
+        return None, None
+
+
+def write_version_cache(cache_path, sha, count):
+    # Write then rename, so a crash mid-write never leaves a corrupt cache
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write("{} {}\n".format(sha, count))
+    os.replace(tmp_path, cache_path)
+
+
+def get_source_version(root_dir, cache_path=None):
+    """
+    Source version, the number of commits up to HEAD. Cached per HEAD sha in cache_path, so the history is only
+    walked once per checkout (normally right after an update).
+    """
+    if cache_path is None:
+        cache_path = os.path.join(root_dir, VERSION_CACHE_FILE_NAME)
+
+    sha = read_head_sha(root_dir)
+    if sha is None:
+        sha = _git(root_dir, "rev-parse", "HEAD")
+
+    cached_sha, cached_count = read_version_cache(cache_path)
+    if cached_sha == sha:
+        return cached_count
+
+    count = count_commits(root_dir)
+    try:
+        write_version_cache(cache_path, sha, count)
+    except OSError as e:
+        logging.warning("Failed to write version cache {}: {}".format(cache_path, e))
+    return count
+
+
+class StartupTimer:
+    """
+    Records how long each startup phase took. A phase lasts from the previous mark (or `start`) to its own mark.
+    Phases are only recorded once, so marks in handlers that run again on reconnect are ignored.
+    """
+    def __init__(self, start=None):
+        self._start = time.perf_counter() if start is None else start
+        self._last = self._start
+        self.phases = []
+
+    def has_phase(self, name):
+        return any(phase == name for phase, _ in self.phases)
+
+    def mark(self, name):
+        if self.has_phase(name):
+            return
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def total(self):
+        return self._last - self._start
+
+    def report(self):
+        return "Startup took {:.2f}s: {}".format(
+            self.total(), ", ".join(["{} {:.2f}s".format(name, seconds) for name, seconds in self.phases])
+        )
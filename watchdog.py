@@ -0,0 +1,124 @@
+import asyncio
+import collections
+import datetime
+import sys
+import threading
+import time
+import traceback
+
+from metrics import measure_loop_lag
+
+# Stack frames kept per stall, innermost last
+STALL_STACK_DEPTH = 12
+
+
+class Stall:
+    __slots__ = ["start", "duration", "stack", "ended"]
+
+    def __init__(self, start, duration, stack):
+        self.start = start
+        self.duration = duration
+        self.stack = stack
+        self.ended = False
+
+    def location(self):
+        """
+        The innermost frame of the sampled stack, usually the blocking call itself.
+        """
+        if len(self.stack) == 0:
+            return "unknown"
+        return " ".join([line.strip() for line in self.stack[-1].strip().split("\n")])
+
+
+class LoopWatchdog:
+    """
+    Detects event loop stalls. A task on the loop beats every `interval` seconds, and a thread checks the beats.
+    When the loop misses its beat by more than `threshold` seconds, the thread samples the loop thread's stack,
+    which shows the blocking handler while it's still blocking. Stalls go to `logger` and a short history.
+    """
+    MAX_STALLS = 32
+
+    def __init__(self, threshold, interval, logger, on_lag=None, max_stalls=MAX_STALLS):
+        self._threshold = threshold
+        self._interval = interval
+        self._logger = logger
+        self._on_lag = on_lag
+        self._last_beat = 0.0
+        self._loop_thread_id = None
+        self._beat_task = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.stalls = collections.deque(maxlen=max_stalls)
+        # metrics
+        self.num_stalls = 0
+
+    def is_running(self):
+        return self._thread is not None
+
+    def start(self, debug=False):
+        """
+        Must be called from the loop's thread. With `debug`, asyncio's own debug mode is enabled too, which
+        logs every callback slower than the threshold but slows everything down.
+        """
+        loop = asyncio.get_running_loop()
+        loop.slow_callback_duration = self._threshold
+        if debug:
+            loop.set_debug(True)
+
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._beat_task = asyncio.ensure_future(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._beat_task is not None:
+            self._beat_task.cancel()
+            self._beat_task = None
+        if self._thread is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+            self._thread = None
+
+    async def _beat(self):
+        while True:
+            lag = await measure_loop_lag(self._interval)
+            self._last_beat = time.monotonic()
+            if self._on_lag is not None:
+                self._on_lag(lag)
+
+    def _sample_stack(self):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return []
+        return traceback.format_stack(frame)[-STALL_STACK_DEPTH:]
+
+    def _watch(self):
+        stall = None
+        stall_beat = 0.0
+        while not self._stop.wait(self._interval / 2):
+            last_beat = self._last_beat
+            now = time.monotonic()
+            if stall is None:
+                blocked = now - last_beat - self._interval
+                if blocked > self._threshold:
+                    stall = Stall(datetime.datetime.now() - datetime.timedelta(seconds=blocked), blocked, self._sample_stack())
+                    stall_beat = last_beat
+                    self.stalls.append(stall)
+                    self.num_stalls += 1
+                    self._logger.warning("Event loop blocked for over {:.3f}s, at:\n{}".format(blocked, "".join(stall.stack)))
+            elif last_beat != stall_beat:
+                # The beat that was late finally ran
+                stall.duration = last_beat - stall_beat - self._interval
+                stall.ended = True
+                self._logger.warning("Event loop unblocked after {:.3f}s, blocked at {}".format(stall.duration, stall.location()))
+                stall = None
+
+    def report_lines(self):
+        lines = []
+        for stall in reversed(self.stalls):
+            lines.append("{} blocked {:.3f}s{} at {}".format(
+                stall.start.strftime("%Y-%m-%d %H:%M:%S"), stall.duration, "" if stall.ended else "+", stall.location()
+            ))
+        return lines
@@ -0,0 +1,128 @@
+import json
+
+# Bump this whenever the workspace layout changes. Instances on different schema versions refuse
+# each other's workspaces instead of guessing, and the version mismatch triggers an update anyway.
+WORKSPACE_SCHEMA_VERSION = 4
+
+_NONE_TYPE = type(None)
+
+_LOBBY_SCHEMA = {
+    "id": int,
+    "is_ent": bool,
+    "name": str,
+    "map": str,
+    "host": str,
+    "server": str,
+    "slots_taken": int,
+    "slots_total": int,
+    "subscriber_ids": list,
+    "mention_role_ids": list,
+}
+# Lobbies are sent as rows of their values in this order, rather than repeating the field names
+_LOBBY_FIELDS = tuple(_LOBBY_SCHEMA.keys())
+_LOBBY_TYPES = tuple(_LOBBY_SCHEMA.values())
+_LOBBY_ID_FIELDS = [_LOBBY_FIELDS.index("subscriber_ids"), _LOBBY_FIELDS.index("mention_role_ids")]
+
+_GATHER_SCHEMA = {
+    "channel_id": int,
+    "active": bool,
+    "message_id": (int, _NONE_TYPE),
+    "list_content": str,
+    "okib_member_ids": list,
+    "laterib_member_ids": list,
+    "noib_member_ids": list,
+    "gatherer_id": (int, _NONE_TYPE),
+    "gathered": bool,
+    "gather_time": (int, float),
+}
+
+_WORKSPACE_SCHEMA = {
+    "schema": int,
+    # Lobbies
+    "open_lobbies": list,
+    "lobby_message_ids": dict,
+    # OKIB
+    "gathers": list,
+}
+
+
+def _check_fields(obj, schema, what):
+    if not isinstance(obj, dict):
+        raise ValueError("{} is {}, not dict".format(what, type(obj)))
+    for key, expected_type in schema.items():
+        if key not in obj:
+            raise ValueError("{} is missing field '{}'".format(what, key))
+        if not isinstance(obj[key], expected_type):
+            raise ValueError("{} field '{}' has type {}".format(what, key, type(obj[key])))
+
+
+def _check_ids(ids, what):
+    for i in ids:
+        # Exact type, bool is a subclass of int but never a valid Discord ID
+        if type(i) is not int:
+            raise ValueError("{} contains non-ID value {!r}".format(what, i))
+
+
+def _lobby_from_row(row):
+    if not isinstance(row, list) or len(row) != len(_LOBBY_FIELDS):
+        raise ValueError("lobby is not a row of {} values: {!r}".format(len(_LOBBY_FIELDS), row))
+    # Checks all fields in one pass, and only looks for the culprit when one is wrong
+    if not all(map(isinstance, row, _LOBBY_TYPES)):
+        for field, value, expected_type in zip(_LOBBY_FIELDS, row, _LOBBY_TYPES):
+            if not isinstance(value, expected_type):
+                raise ValueError("lobby field '{}' has type {}".format(field, type(value)))
+    for i in _LOBBY_ID_FIELDS:
+        if len(row[i]) > 0:
+            _check_ids(row[i], "lobby " + _LOBBY_FIELDS[i])
+    return dict(zip(_LOBBY_FIELDS, row))
+
+
+def validate_workspace(obj):
+    """
+    Checks that a decoded workspace matches the current schema and contains only IDs and primitives, and turns
+    its lobby rows back into dicts. Raises ValueError otherwise.
+    """
+    _check_fields(obj, _WORKSPACE_SCHEMA, "workspace")
+    if obj["schema"] != WORKSPACE_SCHEMA_VERSION:
+        raise ValueError("Workspace schema version {}, expected {}".format(obj["schema"], WORKSPACE_SCHEMA_VERSION))
+
+    obj["open_lobbies"] = [_lobby_from_row(row) for row in obj["open_lobbies"]]
+    for key, value in obj["lobby_message_ids"].items():
+        if not key.startswith("lobbymsg"):
+            raise ValueError("Invalid lobby message key {!r}".format(key))
+        if value is not None:
+            _check_ids([value], "lobby_message_ids")
+    channel_ids = set()
+    for gather_obj in obj["gathers"]:
+        _check_fields(gather_obj, _GATHER_SCHEMA, "gather")
+        if gather_obj["channel_id"] in channel_ids:
+            raise ValueError("Duplicate gather for channel {}".format(gather_obj["channel_id"]))
+        channel_ids.add(gather_obj["channel_id"])
+        for key in ["okib_member_ids", "laterib_member_ids", "noib_member_ids"]:
+            _check_ids(gather_obj[key], "gather " + key)
+
+
+def encode_workspace(obj):
+    """
+    Serializes a workspace dict (IDs and primitives only) to UTF-8 JSON bytes, stamped with the schema version.
+    The workspace is built from our own state, so only the receiving decode_workspace validates it.
+    """
+    obj = dict(obj, schema=WORKSPACE_SCHEMA_VERSION)
+    obj["open_lobbies"] = [[lobby_obj[field] for field in _LOBBY_FIELDS] for lobby_obj in obj["open_lobbies"]]
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def decode_workspace(data):
+    """
+    Parses and validates workspace bytes produced by encode_workspace. Never executes or instantiates anything
+    from the payload, so it's safe to call on data received from the COM channel.
+    """
+    # json.loads parses bytes directly, so only copy when handed a buffer view
+    if isinstance(data, (memoryview, bytearray)):
+        data = bytes(data)
+    try:
+        obj = json.loads(data)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError("Workspace is not valid JSON: {}".format(e))
+    validate_workspace(obj)
+    return obj